@@ -26,6 +26,7 @@ import logging
 import os
 from typing import Annotated, Optional
 
+import qt
 import vtk
 
 import numpy as np
@@ -40,6 +41,29 @@ from slicer.parameterNodeWrapper import (
 
 from slicer import vtkMRMLDiffusionTensorVolumeNode
 from slicer import vtkMRMLLabelMapVolumeNode
+from slicer import vtkMRMLTableNode
+from slicer import vtkMRMLTransformNode
+
+from DTI_ALPSLib import alps
+from DTI_ALPSLib.alps import DIAGONAL_COMPONENTS
+from DTI_ALPSLib.bootstrap import ALPSBootstrap, bootstrapDTIALPS
+from DTI_ALPSLib.cache import ResultCache
+from DTI_ALPSLib.longitudinal import calculateDTIALPSSessions, longitudinalChange
+from DTI_ALPSLib.maps import calculateALPSMaps
+from DTI_ALPSLib.mni import MNI_HEMISPHERE_PAIRS, loadMNIROIIndex, mniHemisphereLabels, mniSpaceMismatches
+from DTI_ALPSLib.orientation import TENSOR_AXES, orientROITensors, tensorAxesMatrix
+from DTI_ALPSLib.profiling import ProcessingProfile
+from DTI_ALPSLib.results import RESULT_FIELDS, RESULT_TEXT_FIELDS, resultRecord
+from DTI_ALPSLib.robust import ROIEstimator
+from DTI_ALPSLib.tasks import TASK_DONE, TASK_FAILED, ProcessingTask, TaskQueue
+from DTI_ALPSLib.tensorfit import GradientTable, fitROITensorDiagonal
+from DTI_ALPSLib.volumeio import writeNRRD
+from DTI_ALPSLib.warp import MNITransform, warpMNILabels
+
+
+# Label volume name suffixes of a DTI volume NAME in the scene batch mode, e.g. NAME_proj and NAME_assoc
+PROJECTION_LABEL_SUFFIXES = ("_proj", "_projection", "_proj_label")
+ASSOCIATION_LABEL_SUFFIXES = ("_assoc", "_association", "_assoc_label")
 
 
 #
@@ -130,10 +154,12 @@ class DTI_ALPSParameterNode:
     inputVolume - The DTI volume to calculate the DTI-ALPS index.
     inputProjectionLabel - The image label that defines the Projection area
     inputAssociationLabel - The image label that defines the Association area
+    resultsTable - The table filled with the DTI-ALPS index of every DTI volume of the scene (scene batch)
     """
     inputVolume: vtkMRMLDiffusionTensorVolumeNode
     inputProjectionLabel: vtkMRMLLabelMapVolumeNode
     inputAssociationLabel: vtkMRMLLabelMapVolumeNode
+    resultsTable: vtkMRMLTableNode
 
 
 #
@@ -154,6 +180,11 @@ class DTI_ALPSWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.logic = None
         self._parameterNode = None
         self._parameterNodeGuiTag = None
+        self.taskQueue = None
+        self.taskTimer = None
+        self._submittedTasks = 0
+        self._finishedTasks = 0
+        self._batchTasks = {}
 
     def setup(self) -> None:
         """
@@ -184,6 +215,15 @@ class DTI_ALPSWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
         # Buttons
         self.ui.applyButton.connect('clicked(bool)', self.onApplyButton)
+        self.ui.batchButton.connect('clicked(bool)', self.onBatchButton)
+        self.ui.cancelButton.connect('clicked(bool)', self.onCancelButton)
+
+        # The calculations run in a background task queue, whose finished tasks are collected by a timer in the main thread
+        self.taskQueue = TaskQueue()
+        self.taskTimer = qt.QTimer()
+        self.taskTimer.setInterval(100)
+        self.taskTimer.connect('timeout()', self.onTaskTimer)
+        self.updateTaskProgress()
 
         # Make sure parameter node is initialized (needed for module reload)
         self.initializeParameterNode()
@@ -193,6 +233,10 @@ class DTI_ALPSWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         Called when the application closes and the module widget is destroyed.
         """
         self.removeObservers()
+        if self.taskTimer:
+            self.taskTimer.stop()
+        if self.taskQueue:
+            self.taskQueue.cancelAll()
 
     def enter(self) -> None:
         """
@@ -258,14 +302,97 @@ class DTI_ALPSWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     def onApplyButton(self) -> None:
         """
-        Run processing when user clicks "Apply" button.
+        Queue the processing of the current selection when user clicks "Apply" button. The GUI is not blocked: the result
+        is shown once calculated, and other selections can be queued meanwhile.
         """
-        with slicer.util.tryWithErrorDisplay("Failed to compute results.", waitCursor=True):
+        with slicer.util.tryWithErrorDisplay("Failed to compute results."):
 
             # Compute DTI-ALPS index
-            self.logic.process(self.ui.inputDTISelector.currentNode(), self.ui.inputProjLabelSelector.currentNode(),
-                               self.ui.inputAssocLabelSelector.currentNode(), self.ui.MNISpaceCheckBox.checked)
-            self.ui.dti_alps_output.text = str(self.logic.dti_alps)
+            self.logic.submitProcess(self.taskQueue, self.ui.inputDTISelector.currentNode(), self.ui.inputProjLabelSelector.currentNode(),
+                                     self.ui.inputAssocLabelSelector.currentNode(), self.ui.MNISpaceCheckBox.checked,
+                                     tensorAxes=TENSOR_AXES[self.ui.tensorAxesComboBox.currentIndex])
+            self._submittedTasks += 1
+            self.taskTimer.start()
+        self.updateTaskProgress()
+
+    def onBatchButton(self) -> None:
+        """
+        Queue the processing of every DTI volume of the scene, whose results are appended to the results table.
+        Each DTI volume NAME uses the labels NAME_proj and NAME_assoc if loaded, otherwise the selected labels, otherwise
+        the standard MNI labels if the input is in MNI space.
+        """
+        with slicer.util.tryWithErrorDisplay("Failed to compute results."):
+            labelPairs = self.logic.sceneLabelPairs(None, self.ui.inputProjLabelSelector.currentNode(),
+                                                    self.ui.inputAssocLabelSelector.currentNode(), self.ui.MNISpaceCheckBox.checked)
+            if not labelPairs:
+                raise ValueError("No DTI volume found in the scene")
+
+            tableNode = self.ui.resultsTableSelector.currentNode()
+            if tableNode is None:
+                tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", slicer.mrmlScene.GenerateUniqueName("DTI-ALPS results"))
+                self.ui.resultsTableSelector.setCurrentNode(tableNode)
+            submitted = self.logic.submitScene(self.taskQueue, labelPairs, tensorAxes=TENSOR_AXES[self.ui.tensorAxesComboBox.currentIndex])
+            for dtiNode, projLabel, assocLabel, task in submitted:
+                if task.finished:
+                    # Not submitted, e.g. without labels
+                    self.logic.appendResultTableRow(tableNode, self.logic.resultTableRecord(dtiNode, projLabel, assocLabel, task))
+                else:
+                    self._batchTasks[task] = (tableNode, dtiNode, projLabel, assocLabel)
+                    self._submittedTasks += 1
+            self.taskTimer.start()
+
+            # Show the results table
+            slicer.app.layoutManager().setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutFourUpTableView)
+            slicer.app.applicationLogic().GetSelectionNode().SetActiveTableID(tableNode.GetID())
+            slicer.app.applicationLogic().PropagateTableSelection()
+        self.updateTaskProgress()
+
+    def onCancelButton(self) -> None:
+        """
+        Cancel the running calculation (at its next processing stage) and the queued ones.
+        """
+        self.taskQueue.cancelAll()
+
+    def onTaskTimer(self) -> None:
+        """
+        Collect the finished tasks of the task queue and show their results.
+        """
+        for task in self.taskQueue.popFinished():
+            self._finishedTasks += 1
+            # The failures of the scene batch are reported in the results table, instead of one error message each
+            batchTask = task in self._batchTasks
+            if batchTask:
+                tableNode, dtiNode, projLabel, assocLabel = self._batchTasks.pop(task)
+                if slicer.mrmlScene.IsNodePresent(tableNode):
+                    self.logic.appendResultTableRow(tableNode, self.logic.resultTableRecord(dtiNode, projLabel, assocLabel, task))
+            if task.status == TASK_DONE:
+                # The results of the scene batch are in the results table, the single result shows the last Apply
+                if not batchTask:
+                    self.logic.dti_alps = task.result
+                    self.logic.profile = task.profile
+                    self.ui.dti_alps_output.text = str(task.result)
+                logging.info(f'DTI-ALPS index of {task.name}: {task.result:.6f}')
+            elif task.status == TASK_FAILED:
+                logging.error(f'DTI-ALPS calculation of {task.name} failed: {task.error}')
+                if not batchTask:
+                    slicer.util.errorDisplay(f"Failed to compute results of {task.name}: {task.error}")
+            else:
+                logging.info(f'DTI-ALPS calculation of {task.name} cancelled')
+
+        if self.taskQueue.idle:
+            self.taskTimer.stop()
+            self._submittedTasks, self._finishedTasks = 0, 0
+        self.updateTaskProgress()
+
+    def updateTaskProgress(self) -> None:
+        self.ui.progressBar.maximum = max(self._submittedTasks, 1)
+        self.ui.progressBar.value = self._finishedTasks
+        self.ui.cancelButton.enabled = self._submittedTasks > self._finishedTasks
+        task = self.taskQueue.runningTask
+        if task is not None:
+            self.ui.progressLabel.text = f"Processing {task.name} ({self._finishedTasks+1}/{self._submittedTasks}): {task.stage}"
+        else:
+            self.ui.progressLabel.text = "Queued" if self._submittedTasks > self._finishedTasks else "Idle"
 
 #
 # DTI_ALPSLogic
@@ -281,6 +408,7 @@ class DTI_ALPSLogic(ScriptedLoadableModuleLogic):
     """
 
     dti_alps = 0.0
+    profile = None
 
     def __init__(self) -> None:
         """
@@ -299,132 +427,778 @@ class DTI_ALPSLogic(ScriptedLoadableModuleLogic):
         
         return True
 
-    def checkMNISpaceInput(self, inputDTIVolume, referenceMNI):
-        in_array = slicer.util.arrayFromVolume(inputDTIVolume)
-        ref_array = slicer.util.arrayFromVolume(referenceMNI)
+    def volumeGeometry(self, volumeNode):
+        """
+        Image shape (K, J, I) and 4x4 IJK to RAS matrix of a volume node, without accessing the voxel data.
+        """
+        ijkToRAS = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRAS)
+        return volumeNode.GetImageData().GetDimensions()[::-1], slicer.util.arrayFromVTKMatrix(ijkToRAS)
+
+    def mniSpaceInputMismatches(self, inputDTIVolume, referenceMNI=None):
+        """
+        Compare the input DTI volume grid (dimensions, spacing, directions and origin) with the MNI 2 mm space.
+        :param referenceMNI: Volume node in MNI space. If not given, the cached MNI ROI index is used as reference
+        :return: list describing each mismatch, empty if the input is in the MNI 2 mm space
+        """
+        shape, ijkToRAS = self.volumeGeometry(inputDTIVolume)
+        if referenceMNI is None:
+            return mniSpaceMismatches(shape, ijkToRAS)
+
+        return alps.spaceMismatches(shape, ijkToRAS, *self.volumeGeometry(referenceMNI))
+
+    def checkMNISpaceInput(self, inputDTIVolume, referenceMNI=None):
+        """
+        Check if the input DTI volume is in the MNI 2 mm space, from the volume geometry only.
+        :param referenceMNI: Volume node in MNI space. If not given, the cached MNI ROI index is used as reference
+        """
+        return not self.mniSpaceInputMismatches(inputDTIVolume, referenceMNI)
+
+    def mniTransformFromNode(self, transformNode):
+        """
+        MNITransform of a transform node (linear or not) that maps the subject volume to the MNI space when applied to it,
+        e.g. the output transform of a registration of the subject (moving) to the MNI template (fixed).
+        """
+        from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+        def transformPoints(transform):
+            def apply(points):
+                inputPoints, outputPoints = vtk.vtkPoints(), vtk.vtkPoints()
+                inputPoints.SetData(numpy_to_vtk(np.ascontiguousarray(points, dtype=np.float64), deep=True))
+                transform.TransformPoints(inputPoints, outputPoints)
+                return vtk_to_numpy(outputPoints.GetData()).astype(np.float64)
+            return apply
+
+        return MNITransform(transformPoints(transformNode.GetTransformToParent()), transformPoints(transformNode.GetTransformFromParent()))
+
+    def warpedMNILabels(self, inputVolume, mniTransform):
+        """
+        Standard MNI labels (split in left and right hemispheres) warped to the input volume grid (see DTI_ALPSLib.warp.warpMNILabels).
+        :param mniTransform: Transform node mapping the input volume to the MNI space
+        """
+        shape, ijkToRAS = self.volumeGeometry(inputVolume)
+        return warpMNILabels(shape, ijkToRAS, self.mniTransformFromNode(mniTransform))
+
+    def reduceROIDiagonal(self, dtiArray, roi, components=("Dxx", "Dyy", "Dzz")):
+        """
+        Sum, count and mean of the tensor diagonal components inside a ROI (see DTI_ALPSLib.alps.reduceROIDiagonal).
+        """
+        return alps.reduceROIDiagonal(dtiArray, roi, components)
+
+    def tensorAxesMatrixFromNode(self, volumeNode, tensorAxes="tensor"):
+        """
+        Directions of Dxx, Dyy and Dzz in the tensor frame of a DTI volume node, from its measurement frame and IJK to RAS
+        directions (see DTI_ALPSLib.orientation.tensorAxesMatrix), or None for the stored tensor axes.
+        """
+        if tensorAxes == "tensor":
+            return None
+        measurementFrame = vtk.vtkMatrix4x4()
+        volumeNode.GetMeasurementFrameMatrix(measurementFrame)
+        return tensorAxesMatrix(tensorAxes, slicer.util.arrayFromVTKMatrix(measurementFrame)[:3, :3], self.volumeGeometry(volumeNode)[1])
+
+    def calculateDTIALPSFromROIs(self, dtiArray, projROI, assocROI, profile=None, estimator=None, bootstrap=None, axesMatrix=None):
+        """
+        DTI-ALPS index of the ROI arrays (see DTI_ALPSLib.alps.calculateDTIALPSFromROIs). With bootstrap (ALPSBootstrap),
+        the confidence interval of the index is recorded in the profile measures (see DTI_ALPSLib.bootstrap.bootstrapDTIALPS).
+        :param axesMatrix: Directions of Dxx, Dyy and Dzz in the tensor frame (see tensorAxesMatrixFromNode), the ROI tensors are
+                           projected on them first. The stored tensor diagonal is used if not given
+        """
+        profile = profile or ProcessingProfile()
+        if axesMatrix is not None:
+            full = estimator is not None and estimator.minFA is not None
+            dtiArray, (projROI, assocROI) = orientROITensors(dtiArray, [projROI, assocROI], axesMatrix, full, profile)
+        index = alps.calculateDTIALPSFromROIs(dtiArray, projROI, assocROI, profile, estimator)
+        if bootstrap is not None:
+            bootstrapDTIALPS(dtiArray, projROI, assocROI, bootstrap, estimator, profile)
+        return index
+
+    def calculateDTIALPS(self, inputDTIVolume, inputProjLabel, inputAssocLabel, profile=None, estimator=None, bootstrap=None,
+                         tensorAxes="tensor"):
+        profile = profile or ProcessingProfile()
+        with profile.stage("arrayFromVolume") as stage:
+            dti_vol = slicer.util.arrayFromVolume(inputDTIVolume)
+            proj_vol = slicer.util.arrayFromVolume(inputProjLabel)
+            assoc_vol = slicer.util.arrayFromVolume(inputAssocLabel)
+            stage["bytes"] = dti_vol.nbytes+proj_vol.nbytes+assoc_vol.nbytes
+
+        return self.calculateDTIALPSFromROIs(dti_vol, proj_vol != 0, assoc_vol != 0, profile, estimator, bootstrap,
+                                             self.tensorAxesMatrixFromNode(inputDTIVolume, tensorAxes))
+
+    def calculateDTIALPSMNI(self, inputDTIVolume, profile=None, estimator=None, bootstrap=None, tensorAxes="tensor"):
+        """
+        DTI-ALPS index of a DTI volume in MNI 2 mm space, using the cached voxel index of the standard MNI labels.
+        """
+        profile = profile or ProcessingProfile()
+        with profile.stage("arrayFromVolume") as stage:
+            dti_vol = slicer.util.arrayFromVolume(inputDTIVolume)
+            stage["bytes"] = dti_vol.nbytes
+        mniIndex = loadMNIROIIndex()
+
+        return self.calculateDTIALPSFromROIs(dti_vol, mniIndex.projection, mniIndex.association, profile, estimator, bootstrap,
+                                             self.tensorAxesMatrixFromNode(inputDTIVolume, tensorAxes))
+
+    def calculateDTIALPSWarpedMNI(self, inputDTIVolume, mniTransform, profile=None, estimator=None, bootstrap=None, tensorAxes="tensor"):
+        """
+        DTI-ALPS index of a DTI volume in native space, using the standard MNI labels warped to the DTI volume grid.
+        :param mniTransform: Transform node mapping the DTI volume to the MNI space
+        """
+        profile = profile or ProcessingProfile()
+        with profile.stage("warpLabels") as stage:
+            proj_vol, assoc_vol = self.warpedMNILabels(inputDTIVolume, mniTransform)
+            stage["bytes"] = proj_vol.nbytes+assoc_vol.nbytes
+        with profile.stage("arrayFromVolume") as stage:
+            dti_vol = slicer.util.arrayFromVolume(inputDTIVolume)
+            stage["bytes"] = dti_vol.nbytes
+
+        return self.calculateDTIALPSFromROIs(dti_vol, proj_vol != 0, assoc_vol != 0, profile, estimator, bootstrap,
+                                             self.tensorAxesMatrixFromNode(inputDTIVolume, tensorAxes))
+
+    def calculateDTIALPSMultiROI(self, inputDTIVolume, inputProjLabel=None, inputAssocLabel=None, roiPairs=None, profile=None,
+                                 estimator=None, tensorAxes="tensor"):
+        """
+        DTI-ALPS indices of several ROI pairs (e.g. left, right and bilateral) from multi-valued labels in a single pass.
+        Without labels, the standard MNI labels split in left and right hemispheres are used (input in MNI space).
+        :param roiPairs: List of (name, projection label values, association label values), see DTI_ALPSLib.alps.calculateDTIALPSMultiROI
+        :param profile: ProcessingProfile where the per-stage timings are recorded
+        :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given
+        :param tensorAxes: Axes of Dxx, Dyy and Dzz: tensor, ras or image (see DTI_ALPSLib.orientation)
+        :return: dict mapping each ROI pair name to its DTI-ALPS index
+        """
+        profile = profile or ProcessingProfile()
+        with profile.stage("arrayFromVolume") as stage:
+            dti_vol = slicer.util.arrayFromVolume(inputDTIVolume)
+            if inputProjLabel is None or inputAssocLabel is None:
+                proj_vol, assoc_vol = mniHemisphereLabels()
+                roiPairs = roiPairs or MNI_HEMISPHERE_PAIRS
+            else:
+                proj_vol = slicer.util.arrayFromVolume(inputProjLabel)
+                assoc_vol = slicer.util.arrayFromVolume(inputAssocLabel)
+            stage["bytes"] = dti_vol.nbytes+proj_vol.nbytes+assoc_vol.nbytes
+
+        axesMatrix = self.tensorAxesMatrixFromNode(inputDTIVolume, tensorAxes)
+        if axesMatrix is not None:
+            full = estimator is not None and estimator.minFA is not None
+            dti_vol, (proj_vol, assoc_vol) = orientROITensors(dti_vol, [proj_vol, assoc_vol], axesMatrix, full, profile)
+
+        return alps.calculateDTIALPSMultiROI(dti_vol, proj_vol, assoc_vol, roiPairs, profile, estimator)
+
+    def dwiGradientTable(self, inputDWIVolume):
+        """
+        Gradient table of a DWI volume node, with the gradient directions in the RAS frame.
+        """
+        from vtk.util.numpy_support import vtk_to_numpy
+
+        bvals = vtk_to_numpy(inputDWIVolume.GetBValues())
+        gradients = vtk_to_numpy(inputDWIVolume.GetDiffusionGradients()).reshape(-1, 3).astype(np.float64)
+        measurementFrame = vtk.vtkMatrix4x4()
+        inputDWIVolume.GetMeasurementFrameMatrix(measurementFrame)
+        norms = np.linalg.norm(gradients, axis=1, keepdims=True)
+        gradients = np.divide(gradients, norms, out=np.zeros_like(gradients), where=norms > 0)
+
+        return GradientTable(bvals, gradients @ slicer.util.arrayFromVTKMatrix(measurementFrame)[:3, :3].T)
+
+    def calculateDTIALPSFromDWI(self, inputDWIVolume, inputProjLabel=None, inputAssocLabel=None, fitRegion="roi", fitMethod="wls",
+                                profile=None, mniTransform=None, estimator=None, bootstrap=None, tensorAxes="tensor"):
+        """
+        DTI-ALPS index of a raw DWI volume, fitting the diffusion tensors only inside the ROIs (see DTI_ALPSLib.tensorfit).
+        Without labels, the standard MNI labels are used (input in MNI space, or warped to the DWI volume grid with mniTransform).
+        :param fitRegion: roi to fit only the ROI voxels, or bounds to fit every voxel of their bounding box
+        :param fitMethod: ols or wls tensor fitting
+        :param mniTransform: Transform node mapping the DWI volume to the MNI space
+        :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), without the FA exclusion (only the tensor diagonal is fitted)
+        :param tensorAxes: Axes of Dxx, Dyy and Dzz (see DTI_ALPSLib.orientation). The tensors are fitted in the RAS frame,
+                           thus tensor and ras are the same
+        """
+        profile = profile or ProcessingProfile()
+        with profile.stage("arrayFromVolume") as stage:
+            dwi_vol = slicer.util.arrayFromVolume(inputDWIVolume)
+            if mniTransform is not None:
+                proj_vol, assoc_vol = self.warpedMNILabels(inputDWIVolume, mniTransform)
+            elif inputProjLabel is None or inputAssocLabel is None:
+                proj_vol, assoc_vol = mniHemisphereLabels()
+            else:
+                proj_vol = slicer.util.arrayFromVolume(inputProjLabel)
+                assoc_vol = slicer.util.arrayFromVolume(inputAssocLabel)
+            stage["bytes"] = dwi_vol.nbytes+proj_vol.nbytes+assoc_vol.nbytes
+
+        gradients = self.dwiGradientTable(inputDWIVolume)
+        axesMatrix = tensorAxesMatrix(tensorAxes, ijkToRAS=self.volumeGeometry(inputDWIVolume)[1])
+        diagonal, proj_vol, assoc_vol = fitROITensorDiagonal(dwi_vol, gradients, proj_vol, assoc_vol, fitRegion, fitMethod, profile,
+                                                             axesMatrix)
+
+        return self.calculateDTIALPSFromROIs(diagonal, proj_vol != 0, assoc_vol != 0, profile, estimator, bootstrap)
 
-        # Comparing the image size (numpy shape) to unsure the same image space
-        # DTI has a 3x3 matrix at the final part, thus we are have to compare only the 3 part of the image shape
-        if in_array.shape[:3]==ref_array.shape:
-            return True
+    def createALPSMapNodes(self, inputDTIVolume, inputProjLabel=None, inputAssocLabel=None, MNISpaceCheck=False, mniTransform=None,
+                           profile=None):
+        """
+        Voxelwise ratio maps (Dxx/Dyy in the Projection ROI, Dxx/Dzz in the Association ROI and the whole volume
+        Dxx/mean(Dyy, Dzz), see DTI_ALPSLib.maps) as new scalar volume nodes with the geometry of the DTI volume.
+        Without labels (or MNISpaceCheck or mniTransform), only the whole volume map is created.
+        :return: dict mapping each map name to its scalar volume node
+        """
+        profile = profile or ProcessingProfile()
+        if mniTransform is not None:
+            proj_vol, assoc_vol = self.warpedMNILabels(inputDTIVolume, mniTransform)
+        elif MNISpaceCheck:
+            mismatches = self.mniSpaceInputMismatches(inputDTIVolume)
+            if mismatches:
+                raise ValueError(f"Input DTI image is not in MNI space: {'; '.join(mismatches)}")
+            proj_vol, assoc_vol = mniHemisphereLabels()
+        elif inputProjLabel is not None and inputAssocLabel is not None:
+            proj_vol, assoc_vol = slicer.util.arrayFromVolume(inputProjLabel), slicer.util.arrayFromVolume(inputAssocLabel)
         else:
-            return False
+            proj_vol, assoc_vol = None, None
 
-    def calculateDTIALPS(self, inputDTIVolume, inputProjLabel, inputAssocLabel):
-        dti_vol = slicer.util.arrayFromVolume(inputDTIVolume)
-        proj_vol = slicer.util.arrayFromVolume(inputProjLabel)
-        assoc_vol = slicer.util.arrayFromVolume(inputAssocLabel)
-
-        proj_points = np.where( proj_vol != 0 )
-        assoc_points = np.where( assoc_vol != 0)
-
-        dti_proj_vals = dti_vol[proj_points]
-        dti_assoc_vals = dti_vol[assoc_points]
-
-        # DTI-ALPS calculation: mean(Dxx-proj, Dxx-assoc)/mean(Dyy-proj, Dzz-assoc)
-        # Recall that the diffusion tensor ir represented as: 
-        # D = [ Dxx Dxy Dxz
-        #       Dyx Dyy Dyz
-        #       Dzx Dzy Dzz ]
-        dxx_proj = {
-            "diff_value": 0,
-            "points": 0
-        }
-        dyy_proj = {
-            "diff_value": 0,
-            "points": 0
-        }
-        dxx_assoc = {
-            "diff_value": 0,
-            "points": 0
-        }
-        dzz_assoc = {
-            "diff_value": 0,
-            "points": 0
-        }
-        for voxel in dti_proj_vals:
-            dxx_proj["diff_value"] += voxel[0][0]
-            dyy_proj["diff_value"] += voxel[1][1]
-            dxx_proj["points"] += 1
-            dyy_proj["points"] += 1
-
-        for voxel in dti_assoc_vals:
-            dxx_assoc["diff_value"] += voxel[0][0]
-            dzz_assoc["diff_value"] += voxel[2][2]
-            dxx_assoc["points"] += 1
-            dzz_assoc["points"] += 1
-
-        # DTI-ALPS index calculations
-        mean_numerator = ((dxx_proj["diff_value"]/dxx_proj["points"])+(dxx_assoc["diff_value"]/dxx_assoc["points"]))/2.0
-        mean_denominator = ((dyy_proj["diff_value"]/dyy_proj["points"])+(dzz_assoc["diff_value"]/dzz_assoc["points"]))/2.0
-        
-        return mean_numerator/mean_denominator
+        maps = calculateALPSMaps(slicer.util.arrayFromVolume(inputDTIVolume), proj_vol, assoc_vol, profile=profile)
+        mapNodes = {}
+        for name, mapArray in maps.items():
+            nodeName = slicer.mrmlScene.GenerateUniqueName(f"{inputDTIVolume.GetName()}_{name}")
+            mapNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", nodeName)
+            mapNode.CopyOrientation(inputDTIVolume)
+            slicer.util.updateVolumeFromArray(mapNode, mapArray)
+            mapNodes[name] = mapNode
+
+        return mapNodes
+
+    def exportTensorDiagonal(self, inputDTIVolume, path, encoding="raw"):
+        """
+        Write the tensor diagonal (Dxx, Dyy, Dzz) of a DTI volume as a compact float32 NRRD file, with the volume geometry
+        and measurement frame. The runDTIALPS.py and runDTIALPSBatch.py scripts read it in place of the tensor volume file
+        (see DTI_ALPSLib.volumeio.writeTensorDiagonal).
+        :param encoding: raw (memory-mapped when read) or gzip
+        """
+        measurementFrame = vtk.vtkMatrix4x4()
+        inputDTIVolume.GetMeasurementFrameMatrix(measurementFrame)
+        diagonal = np.diagonal(slicer.util.arrayFromVolume(inputDTIVolume), axis1=3, axis2=4).astype(np.float32)
+        writeNRRD(path, diagonal, self.volumeGeometry(inputDTIVolume)[1], encoding, slicer.util.arrayFromVTKMatrix(measurementFrame)[:3, :3],
+                  componentKind="3D-diagonal-matrix")
+
+    def nodeFilePath(self, node):
+        """
+        File the node was loaded from, or None if the node was not loaded from a file or was modified since then.
+        """
+        storageNode = node.GetStorageNode() if node else None
+        if storageNode is None or node.GetModifiedSinceRead():
+            return None
+        return storageNode.GetFileName() or None
+
+    def resultCacheFiles(self, inputDTIVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck, mniTransform=None):
+        """
+        Input files of the result cache key, or None if any input node is not backed by an unmodified file.
+        :param mniTransform: Transform node warping the standard MNI labels, used in place of the label nodes
+        :return: (dtiPath, projPath, assocPath, transformPath), the unused paths being None
+        """
+        dtiPath = self.nodeFilePath(inputDTIVolume)
+        projPath, assocPath, transformPath = None, None, None
+        if mniTransform is not None:
+            transformPath = self.nodeFilePath(mniTransform)
+            if not transformPath:
+                return None
+        elif not MNISpaceCheck:
+            projPath, assocPath = self.nodeFilePath(inputProjLabel), self.nodeFilePath(inputAssocLabel)
+            if not projPath or not assocPath:
+                return None
+        if not dtiPath:
+            return None
+
+        return dtiPath, projPath, assocPath, transformPath
+
+    def resultCacheKeyFromFiles(self, resultCache, cacheFiles, MNISpaceCheck, **parameters):
+        """
+        Result cache key of the input files given by resultCacheFiles. The files are hashed, thus it does not access the scene.
+        :param parameters: Calculation options given by resultCacheParameters (see DTI_ALPSLib.cache.ResultCache.calculationKey)
+        """
+        dtiPath, projPath, assocPath, transformPath = cacheFiles
+        return resultCache.calculationKey(dtiPath, projPath, assocPath, MNISpaceCheck, mniTransformPath=transformPath, **parameters)
+
+    def resultCacheKey(self, resultCache, inputDTIVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck, mniTransform=None, **parameters):
+        """
+        Result cache key of the inputs, or None if any input node is not backed by an unmodified file.
+        :param mniTransform: Transform node warping the standard MNI labels, used in place of the label nodes
+        :param parameters: Calculation options given by resultCacheParameters (see DTI_ALPSLib.cache.ResultCache.calculationKey)
+        """
+        cacheFiles = self.resultCacheFiles(inputDTIVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck, mniTransform)
+        if cacheFiles is None:
+            return None
+
+        return self.resultCacheKeyFromFiles(resultCache, cacheFiles, MNISpaceCheck, **parameters)
+
+    def resultCacheParameters(self, isDWI=False, fitRegion="roi", fitMethod="wls", estimator=None, bootstrap=None, tensorAxes="tensor"):
+        """
+        Calculation options of the result cache key (see DTI_ALPSLib.cache.ResultCache.calculationKey), the same key as the
+        runDTIALPS.py script for the same input files and options.
+        """
+        return {"isDWI": isDWI, "fitRegion": fitRegion, "fitMethod": fitMethod, "estimator": estimator, "bootstrap": bootstrap,
+                "tensorAxes": tensorAxes}
+
+    def restoreCachedResult(self, resultCache, cacheKey, profile):
+        """
+        DTI-ALPS index cached for the key, or None if it is not cached. The cached profile measures (e.g. the confidence
+        interval with bootstrap) are restored (see DTI_ALPSLib.cache.ResultCache.getResult).
+        """
+        cached = resultCache.getResult(cacheKey, profile)
+        if cached is not None:
+            profile.metadata.update(cached=True, dti_alps=cached)
+        return cached
+
+    def storeCachedResult(self, resultCache, cacheKey, index, profile):
+        """
+        Cache the DTI-ALPS index along with the profile measures (see DTI_ALPSLib.cache.ResultCache.putResult).
+        """
+        with profile.stage("cacheStore"):
+            resultCache.putResult(cacheKey, index, profile)
 
     def process(self,
                 inputDTIVolume: vtkMRMLDiffusionTensorVolumeNode,
                 inputProjLabel: vtkMRMLLabelMapVolumeNode,
                 inputAssocLabel: vtkMRMLLabelMapVolumeNode,
-                MNISpaceCheck: bool = False) -> None:
+                MNISpaceCheck: bool = False,
+                useCache: bool = True,
+                refreshCache: bool = False,
+                profile: Optional[ProcessingProfile] = None,
+                fitRegion: str = "roi",
+                fitMethod: str = "wls",
+                mniTransform: Optional[vtkMRMLTransformNode] = None,
+                estimator: Optional[ROIEstimator] = None,
+                bootstrap: Optional[ALPSBootstrap] = None,
+                tensorAxes: str = "tensor") -> ProcessingProfile:
         """
         Run the processing algorithm.
         Can be used without GUI widget.
-        :param inputDTIVolume: DTI volume to be the source of DTI-ALPS index calculation
+        :param inputDTIVolume: DTI volume to be the source of DTI-ALPS index calculation. A raw DWI volume
+                               (vtkMRMLDiffusionWeightedVolumeNode) is also accepted, its tensors are fitted only inside the ROIs
         :param inputProjLabel: The Projection ROI area
         :param inputAssocLabel: The Association ROI area
         :param MNISpaceCheck: Informs if the input volume is in MNI space (2 mm) to use standard Proj/Assoc labels
+        :param useCache: Reuse the result cached for the same input files (see DTI_ALPSLib.cache.ResultCache)
+        :param refreshCache: Recalculate the index even if it is cached, and update the cache
+        :param profile: ProcessingProfile to be filled, e.g. with loading stages timed by the caller. A new one is created if not given
+        :param fitRegion: DWI input only, roi to fit only the ROI voxels, or bounds to fit every voxel of their bounding box
+        :param fitMethod: DWI input only, ols or wls tensor fitting
+        :param mniTransform: Transform node mapping the input volume to the MNI space. The standard MNI labels are warped
+                             to the input volume grid and used in place of the Proj/Assoc labels (see DTI_ALPSLib.warp)
+        :param estimator: ROI statistic (trimmed mean, median, MAD/MD/FA voxel exclusion, see DTI_ALPSLib.robust.ROIEstimator),
+                          plain ROI means if not given
+        :param bootstrap: Bootstrap resampling of the ROI voxels (see DTI_ALPSLib.bootstrap.ALPSBootstrap). The confidence interval
+                          of the index is recorded in the profile measures (dtiAlpsLower, dtiAlpsUpper and dtiAlpsSE)
+        :param tensorAxes: Axes of Dxx, Dyy and Dzz: tensor (the stored tensor diagonal), ras (scanner axes) or image (image axes
+                           nearest to the RAS axes). The ROI tensors are projected with the measurement frame and the IJK to RAS
+                           directions, without reorienting the volume (see DTI_ALPSLib.orientation)
+        :return: ProcessingProfile with the per-stage durations, bytes loaded, ROI voxel counts and peak memory (also kept in self.profile)
         """
 
-        if not MNISpaceCheck:
+        if MNISpaceCheck and mniTransform is not None:
+            raise ValueError("The MNI space check and the MNI transform cannot be used together")
+        if not MNISpaceCheck and mniTransform is None:
             if not inputDTIVolume or not inputProjLabel or not inputAssocLabel:
                 raise ValueError("Input DTI, Projection and/or Association labels are not valid")
+        if tensorAxes not in TENSOR_AXES:
+            raise ValueError(f"Unknown tensor axes '{tensorAxes}', expected one of {', '.join(TENSOR_AXES)}")
 
-        import time
-        startTime = time.time()
         logging.info('Processing started')
+        profile = profile or ProcessingProfile()
+        isDWI = inputDTIVolume.IsA("vtkMRMLDiffusionWeightedVolumeNode")
+        profile.metadata.update(MNISpace=bool(MNISpaceCheck), MNITransform=mniTransform is not None, DWI=isDWI, cached=False)
+        self.profile = profile
+
+        resultCache, cacheKey = None, None
+        if useCache:
+            with profile.stage("cacheLookup"):
+                resultCache = ResultCache()
+                parameters = self.resultCacheParameters(isDWI, fitRegion, fitMethod, estimator, bootstrap, tensorAxes)
+                cacheKey = self.resultCacheKey(resultCache, inputDTIVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck, mniTransform,
+                                               **parameters)
+                cached = self.restoreCachedResult(resultCache, cacheKey, profile) if cacheKey and not refreshCache else None
+            if cached is not None:
+                # The confidence interval is cached along with the index
+                self.dti_alps = cached
+                logging.info(f'DTI-ALPS index (cached): {self.dti_alps:.6f}')
+                print("DTI-ALPS index: ", self.dti_alps)
+                return profile
 
         if MNISpaceCheck:
             logging.info("MNI space processing started.")
-            module_path = os.path.dirname(slicer.modules.dti_alps.path)
+            logging.info("--> Checking if the input image shape is in MNI coordinates...")
+            # The standard MNI labels are not loaded, their precomputed voxel index is used instead
+            with profile.stage("checkMNISpace"):
+                mismatches = self.mniSpaceInputMismatches(inputDTIVolume)
+            if mismatches:
+                message = (f"Input DTI image is not in MNI space: {'; '.join(mismatches)}. "
+                           "Please resample the input DTI image to MNI before calling this option.")
+                logging.error(message)
+                raise ValueError(message)
+            
+            logging.info("Calculating DTI-ALPS in MNI space...")
+            if isDWI:
+                self.dti_alps = self.calculateDTIALPSFromDWI(inputDTIVolume, None, None, fitRegion, fitMethod, profile, estimator=estimator,
+                                                             bootstrap=bootstrap, tensorAxes=tensorAxes)
+            else:
+                self.dti_alps = self.calculateDTIALPSMNI(inputDTIVolume, profile, estimator, bootstrap, tensorAxes)
+        elif mniTransform is not None:
+            logging.info("Warping the MNI labels and calculating DTI-ALPS in native space...")
+            if isDWI:
+                self.dti_alps = self.calculateDTIALPSFromDWI(inputDTIVolume, None, None, fitRegion, fitMethod, profile, mniTransform, estimator,
+                                                             bootstrap, tensorAxes)
+            else:
+                self.dti_alps = self.calculateDTIALPSWarpedMNI(inputDTIVolume, mniTransform, profile, estimator, bootstrap, tensorAxes)
+        elif isDWI:
+            logging.info("Fitting the DWI tensors inside the ROIs and calculating DTI-ALPS in native space...")
+            self.dti_alps = self.calculateDTIALPSFromDWI(inputDTIVolume, inputProjLabel, inputAssocLabel, fitRegion, fitMethod, profile,
+                                                         estimator=estimator, bootstrap=bootstrap, tensorAxes=tensorAxes)
+        else:
+            logging.info("Calculating DTI-ALPS in native space...")
+            self.dti_alps = self.calculateDTIALPS(inputDTIVolume, inputProjLabel, inputAssocLabel, profile, estimator, bootstrap,
+                                                  tensorAxes)
+            logging.info("Calculating DTI-ALPS in native space...done")               
+
+        if cacheKey:
+            self.storeCachedResult(resultCache, cacheKey, self.dti_alps, profile)
 
-            proj_mni_label, assoc_mni_label = "", ""
-            if not self.checkLabelNode("Projection-label-2mm-MNI"):
-                proj_mni_label = slicer.util.loadNodeFromFile(module_path+os.path.sep+"Resources"+os.path.sep+"MNI"+os.path.sep+"Projection-label-2mm-MNI.nii.gz")
+        profile.metadata["dti_alps"] = self.dti_alps
+        logging.info(f'DTI-ALPS index: {self.dti_alps:.6f}')
+        if bootstrap is not None:
+            logging.info(f'DTI-ALPS index {bootstrap.confidence:.0%} confidence interval: '
+                         f'[{profile.measures["dtiAlpsLower"]:.6f}, {profile.measures["dtiAlpsUpper"]:.6f}]')
+        print("DTI-ALPS index: ", self.dti_alps)
+
+        logging.info(f'Processing completed in {profile.totalSeconds:.2f} seconds')
+        for record in profile.stages:
+            logging.debug(f'  {record["name"]}: {record["seconds"]:.3f} seconds, {record["bytes"]} bytes')
+
+        return profile
+
+    def processSessions(self, inputDTIVolumes, inputProjLabel=None, inputAssocLabel=None, MNISpaceCheck=False, times=None,
+                        profile=None, estimator=None, tensorAxes="tensor", sessionProfiles=None):
+        """
+        Longitudinal DTI-ALPS index of the sessions of a subject, and its change along the sessions.
+        The sessions sharing a space (same grid and geometry) are checked once against the MNI space or the labels, share
+        the label ROIs and their bounding box (see croppedLabelROIs), and are reduced together (see DTI_ALPSLib.longitudinal).
+        :param inputDTIVolumes: DTI volumes of the sessions, in time order unless times are given
+        :param inputProjLabel: The Projection ROI area shared by the sessions
+        :param inputAssocLabel: The Association ROI area shared by the sessions
+        :param MNISpaceCheck: Informs if the sessions are in MNI space (2 mm) to use standard Proj/Assoc labels
+        :param times: Session times (e.g. years from the first scan), the session order if not given
+        :param profile: ProcessingProfile where the per-stage timings of the whole subject are recorded
+        :param sessionProfiles: One ProcessingProfile per session where the ROI voxel counts and means are recorded
+        :return: (indices, change), the session indices and the change metrics (see DTI_ALPSLib.longitudinal.longitudinalChange)
+        """
+        if not inputDTIVolumes:
+            raise ValueError("No session DTI volume given")
+        if not MNISpaceCheck and (not inputProjLabel or not inputAssocLabel):
+            raise ValueError("Input Projection and/or Association labels are not valid")
+        if any(node.IsA("vtkMRMLDiffusionWeightedVolumeNode") for node in inputDTIVolumes):
+            raise ValueError("The longitudinal mode requires DTI volumes, the DWI volumes are processed one at a time")
+        if tensorAxes not in TENSOR_AXES:
+            raise ValueError(f"Unknown tensor axes '{tensorAxes}', expected one of {', '.join(TENSOR_AXES)}")
+
+        logging.info(f'Longitudinal processing of {len(inputDTIVolumes)} sessions started')
+        profile = profile or ProcessingProfile()
+        profile.metadata.update(MNISpace=bool(MNISpaceCheck), sessions=len(inputDTIVolumes))
+        self.profile = profile
+        sessionProfiles = sessionProfiles or [ProcessingProfile() for _ in inputDTIVolumes]
+        keepTensors = estimator is not None and estimator.minFA is not None
+
+        # Sessions sharing a space, the first session of each space being its reference
+        geometries = [self.volumeGeometry(node) for node in inputDTIVolumes]
+        spaces = []
+        for number, geometry in enumerate(geometries):
+            space = next((sessions for sessions in spaces if not alps.spaceMismatches(*geometry, *geometries[sessions[0]])), None)
+            if space is None:
+                spaces.append([number])
             else:
-                proj_mni_label = slicer.util.getNode("Projection-label-2mm-MNI")
+                space.append(number)
+
+        roiCache = {}
+        indices = np.empty(len(inputDTIVolumes))
+        for sessions in spaces:
+            referenceVolume = inputDTIVolumes[sessions[0]]
+            with profile.stage("checkMNISpace" if MNISpaceCheck else "checkLabelSpace"):
+                if MNISpaceCheck:
+                    mismatches = self.mniSpaceInputMismatches(referenceVolume)
+                else:
+                    mismatches = alps.spaceMismatches(*geometries[sessions[0]], *self.volumeGeometry(inputProjLabel))
+            if mismatches:
+                message = (f"Input DTI image {referenceVolume.GetName()} is not in the {'MNI' if MNISpaceCheck else 'label'} space: "
+                           f"{'; '.join(mismatches)}")
+                logging.error(message)
+                raise ValueError(message)
+
+            with profile.stage("arrayFromVolume") as stage:
+                bounds, projROI, assocROI = self.croppedLabelROIs(referenceVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck,
+                                                                  roiCache=roiCache)
+                (k0, k1), (j0, j1), (i0, i1) = bounds
+                dtiArrays, rois = [], (projROI, assocROI)
+                for number in sessions:
+                    inputArray = slicer.util.arrayFromVolume(inputDTIVolumes[number])[k0:k1, j0:j1, i0:i1]
+                    axesMatrix = self.tensorAxesMatrixFromNode(inputDTIVolumes[number], tensorAxes)
+                    if axesMatrix is not None:
+                        # The compact ROIs are the same for every session of the space
+                        dtiArray, rois = orientROITensors(inputArray, [projROI, assocROI], axesMatrix, keepTensors, profile)
+                    else:
+                        dtiArray = inputArray if keepTensors else np.diagonal(inputArray, axis1=3, axis2=4)
+                    dtiArrays.append(dtiArray)
+                stage["bytes"] = sum(dtiArray.nbytes for dtiArray in dtiArrays)
+
+            indices[sessions] = calculateDTIALPSSessions(dtiArrays, *rois, profile, estimator,
+                                                         [sessionProfiles[number] for number in sessions])
+
+        change = longitudinalChange(indices, times)
+        profile.metadata["dti_alps"] = indices.tolist()
+        logging.info(f'DTI-ALPS indices: {", ".join(f"{index:.6f}" for index in indices)}, '
+                     f'change {change["alps_change"]:+.6f} ({change["alps_percent_change"]:+.2f}%)')
+        logging.info(f'Processing completed in {profile.totalSeconds:.2f} seconds')
+
+        return indices, change
+
+    def croppedLabelROIs(self, inputVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck=False, mniTransform=None, labelArrays=False,
+                         roiCache=None):
+        """
+        ROIs bounding box of the labels, and the ROIs cropped to it.
+        :param labelArrays: Crop the label arrays (e.g. for the DWI tensor fitting), instead of giving flat voxel indices into the cropped grid
+        :param roiCache: dict where the ROIs are kept by label node (and modification time), so that the volumes sharing the same
+                         labels (or the standard MNI labels) do not recompute their masks and bounding box
+        :return: (bounds, projROI, assocROI), see DTI_ALPSLib.alps.roiBounds
+        """
+        shape = self.volumeGeometry(inputVolume)[0]
+        cacheKey = None
+        if roiCache is not None and mniTransform is None:
+            labels = "MNI" if MNISpaceCheck else tuple((node.GetID(), node.GetMTime()) for node in (inputProjLabel, inputAssocLabel))
+            cacheKey = (labels, tuple(shape), labelArrays)
+            if cacheKey in roiCache:
+                return roiCache[cacheKey]
+
+        if mniTransform is not None:
+            proj_vol, assoc_vol = self.warpedMNILabels(inputVolume, mniTransform)
+        elif MNISpaceCheck:
+            proj_vol, assoc_vol = mniHemisphereLabels()
+        else:
+            proj_vol = slicer.util.arrayFromVolume(inputProjLabel)
+            assoc_vol = slicer.util.arrayFromVolume(inputAssocLabel)
+        projMask, assocMask = proj_vol != 0, assoc_vol != 0
+        bounds = alps.roiBounds(shape, projMask, assocMask)
+        if labelArrays:
+            (k0, k1), (j0, j1), (i0, i1) = bounds
+            rois = bounds, proj_vol[k0:k1, j0:j1, i0:i1].copy(), assoc_vol[k0:k1, j0:j1, i0:i1].copy()
+        else:
+            rois = bounds, alps.cropROI(projMask, shape, bounds), alps.cropROI(assocMask, shape, bounds)
 
-            if not self.checkLabelNode("Association-label-2mm-MNI"):
-                assoc_mni_label = slicer.util.loadNodeFromFile(module_path+os.path.sep+"Resources"+os.path.sep+"MNI"+os.path.sep+"Association-label-2mm-MNI.nii.gz")
+        if cacheKey is not None:
+            roiCache[cacheKey] = rois
+        return rois
+
+    def snapshotInputArrays(self, inputDTIVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck=False, mniTransform=None,
+                            estimator=None, profile=None, roiCache=None, axesMatrix=None):
+        """
+        Copy of the input arrays cropped to the ROIs bounding box, which a background thread can process while the scene
+        changes (see submitProcess). Only the tensor diagonal is kept, unless the estimator excludes voxels by FA.
+        :param roiCache: dict sharing the label ROIs between volumes, see croppedLabelROIs
+        :param axesMatrix: DTI volume only, directions of Dxx, Dyy and Dzz in the tensor frame (see tensorAxesMatrixFromNode).
+                           The ROI tensors are projected on them, in a compact array of the ROI voxels
+        :return: (dtiArray, projROI, assocROI, gradients), with flat voxel indices into the cropped grid as ROIs for a DTI
+                 volume. For a DWI volume, dtiArray is the cropped DWI array, the ROIs are the cropped label arrays and
+                 gradients is its GradientTable (None for a DTI volume)
+        """
+        profile = profile or ProcessingProfile()
+        isDWI = inputDTIVolume.IsA("vtkMRMLDiffusionWeightedVolumeNode")
+        keepTensors = estimator is not None and estimator.minFA is not None
+        with profile.stage("arrayFromVolume") as stage:
+            bounds, projROI, assocROI = self.croppedLabelROIs(inputDTIVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck,
+                                                              mniTransform, isDWI, roiCache)
+            (k0, k1), (j0, j1), (i0, i1) = bounds
+            inputArray = slicer.util.arrayFromVolume(inputDTIVolume)[k0:k1, j0:j1, i0:i1]
+            gradients = None
+            if isDWI:
+                dtiArray, gradients = inputArray.copy(), self.dwiGradientTable(inputDTIVolume)
+            elif axesMatrix is not None:
+                # Compact array of the ROI voxels only
+                dtiArray, (projROI, assocROI) = orientROITensors(inputArray, [projROI, assocROI], axesMatrix, keepTensors, profile)
             else:
-                assoc_mni_label = slicer.util.getNode("Association-label-2mm-MNI")
+                dtiArray = inputArray.copy() if keepTensors else np.diagonal(inputArray, axis1=3, axis2=4).copy()
+            stage["bytes"] = dtiArray.nbytes+projROI.nbytes+assocROI.nbytes
+
+        return dtiArray, projROI, assocROI, gradients
+
+    def submitProcess(self,
+                      taskQueue: TaskQueue,
+                      inputDTIVolume: vtkMRMLDiffusionTensorVolumeNode,
+                      inputProjLabel: vtkMRMLLabelMapVolumeNode,
+                      inputAssocLabel: vtkMRMLLabelMapVolumeNode,
+                      MNISpaceCheck: bool = False,
+                      useCache: bool = True,
+                      refreshCache: bool = False,
+                      fitRegion: str = "roi",
+                      fitMethod: str = "wls",
+                      mniTransform: Optional[vtkMRMLTransformNode] = None,
+                      estimator: Optional[ROIEstimator] = None,
+                      bootstrap: Optional[ALPSBootstrap] = None,
+                      roiCache: Optional[dict] = None,
+                      tensorAxes: str = "tensor") -> ProcessingTask:
+        """
+        Queue the processing algorithm (see process) in a background task queue, so that the GUI is not blocked.
+        The inputs are validated and their ROIs bounding box is copied from the scene now, in the calling (main) thread,
+        since the scene can only be accessed from the main thread. The cache lookup, DWI tensor fitting, ROI reduction,
+        bootstrap and cache store then run in the background.
+        :param taskQueue: DTI_ALPSLib.tasks.TaskQueue running the calculation
+        :param roiCache: dict sharing the label ROIs between the volumes submitted with it, see croppedLabelROIs
+        :param tensorAxes: Axes of Dxx, Dyy and Dzz: tensor, ras or image. The ROI tensors of a DTI volume are projected
+                           when they are copied (see DTI_ALPSLib.orientation)
+        :return: ProcessingTask, whose result is the DTI-ALPS index. The confidence interval (bootstrap) and the per-stage
+                 timings are recorded in the task profile
+        """
+        if MNISpaceCheck and mniTransform is not None:
+            raise ValueError("The MNI space check and the MNI transform cannot be used together")
+        if not inputDTIVolume:
+            raise ValueError("Input DTI volume is not valid")
+        if not MNISpaceCheck and mniTransform is None and (not inputProjLabel or not inputAssocLabel):
+            raise ValueError("Input DTI, Projection and/or Association labels are not valid")
+        if tensorAxes not in TENSOR_AXES:
+            raise ValueError(f"Unknown tensor axes '{tensorAxes}', expected one of {', '.join(TENSOR_AXES)}")
+
+        isDWI = inputDTIVolume.IsA("vtkMRMLDiffusionWeightedVolumeNode")
+        profile = ProcessingProfile(input=inputDTIVolume.GetName())
+        profile.metadata.update(MNISpace=bool(MNISpaceCheck), MNITransform=mniTransform is not None, DWI=isDWI, cached=False)
+        if MNISpaceCheck:
+            with profile.stage("checkMNISpace"):
+                mismatches = self.mniSpaceInputMismatches(inputDTIVolume)
+            if mismatches:
+                raise ValueError(f"Input DTI image is not in MNI space: {'; '.join(mismatches)}")
+
+        cacheFiles = self.resultCacheFiles(inputDTIVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck, mniTransform) if useCache else None
+        parameters = self.resultCacheParameters(isDWI, fitRegion, fitMethod, estimator, bootstrap, tensorAxes)
+        if isDWI:
+            # The DWI tensors are fitted in the RAS frame, and projected on the axes when fitted
+            axesMatrix = tensorAxesMatrix(tensorAxes, ijkToRAS=self.volumeGeometry(inputDTIVolume)[1])
+        else:
+            axesMatrix = self.tensorAxesMatrixFromNode(inputDTIVolume, tensorAxes)
+        dtiArray, projROI, assocROI, gradients = self.snapshotInputArrays(inputDTIVolume, inputProjLabel, inputAssocLabel, MNISpaceCheck,
+                                                                          mniTransform, estimator, profile, roiCache, axesMatrix)
+
+        def calculate(profile):
+            # Background thread: no scene access from here
+            resultCache, cacheKey = None, None
+            if cacheFiles is not None:
+                with profile.stage("cacheLookup"):
+                    resultCache = ResultCache()
+                    cacheKey = self.resultCacheKeyFromFiles(resultCache, cacheFiles, MNISpaceCheck, **parameters)
+                    cached = self.restoreCachedResult(resultCache, cacheKey, profile) if not refreshCache else None
+                if cached is not None:
+                    return cached
+
+            if gradients is not None:
+                diagonal, proj_vol, assoc_vol = fitROITensorDiagonal(dtiArray, gradients, projROI, assocROI, fitRegion, fitMethod, profile,
+                                                                     axesMatrix)
+                index = self.calculateDTIALPSFromROIs(diagonal, proj_vol != 0, assoc_vol != 0, profile, estimator, bootstrap)
+            else:
+                index = self.calculateDTIALPSFromROIs(dtiArray, projROI, assocROI, profile, estimator, bootstrap)
 
-            logging.info("--> Checking if the input image shape is in MNI coordinates...")
-            # Choosing one of labels to represent the MNI space (both are already in MNI space)
-            if not self.checkMNISpaceInput(inputDTIVolume, proj_mni_label):
-                logging.error("Input DTI image is not in MNI space. Please resample the input DTI image to MNI before calling this option.")
-                raise ValueError("Input DTI image is not in MNI space. Please resample the input DTI image to MNI before calling this option.")
-            
-            logging.info("Calculating DTI-ALPS in MNI space...")
-            self.dti_alps = self.calculateDTIALPS(inputDTIVolume, proj_mni_label, assoc_mni_label)
-            logging.info(f'DTI-ALPS index: {self.dti_alps:.6f}')
-            print("DTI-ALPS index: ", self.dti_alps)
+            if cacheKey:
+                self.storeCachedResult(resultCache, cacheKey, index, profile)
+            profile.metadata["dti_alps"] = index
+            return index
 
-            # Finish the process logic
-            stopTime = time.time()
-            logging.info(f'Processing completed in {stopTime-startTime:.2f} seconds')
+        return taskQueue.submit(inputDTIVolume.GetName(), calculate, profile)
 
-            return True
-        
-        logging.info("Calculating DTI-ALPS in native space...")
-        self.dti_alps = self.calculateDTIALPS(inputDTIVolume, inputProjLabel, inputAssocLabel) 
-        logging.info("Calculating DTI-ALPS in native space...done")               
+    def sceneLabelPairs(self, dtiNodes=None, defaultProjLabel=None, defaultAssocLabel=None, MNISpaceCheck=False):
+        """
+        Projection and Association labels of each DTI volume of the scene: the label volumes named after the DTI volume
+        (e.g. NAME_proj and NAME_assoc, see PROJECTION_LABEL_SUFFIXES and ASSOCIATION_LABEL_SUFFIXES, case insensitive),
+        otherwise the default labels if given, otherwise the standard MNI labels with MNISpaceCheck.
+        :param dtiNodes: DTI volumes, every vtkMRMLDiffusionTensorVolumeNode of the scene if not given
+        :return: list of (dtiNode, projLabel, assocLabel, MNISpace), the labels being None for the MNI labels or when none was found
+        """
+        if dtiNodes is None:
+            dtiNodes = slicer.util.getNodesByClass("vtkMRMLDiffusionTensorVolumeNode")
+        # Label maps and scalar volumes, but not the tensor (DTI or DWI) volumes that derive from the scalar volumes
+        labelNodes = {}
+        for node in slicer.util.getNodesByClass("vtkMRMLScalarVolumeNode"):
+            if not node.IsA("vtkMRMLTensorVolumeNode"):
+                labelNodes.setdefault(node.GetName().lower(), node)
+
+        labelPairs = []
+        for dtiNode in dtiNodes:
+            name = dtiNode.GetName().lower()
+            projLabel = next((labelNodes[name+suffix] for suffix in PROJECTION_LABEL_SUFFIXES if name+suffix in labelNodes), None)
+            assocLabel = next((labelNodes[name+suffix] for suffix in ASSOCIATION_LABEL_SUFFIXES if name+suffix in labelNodes), None)
+            if projLabel is not None and assocLabel is not None:
+                labelPairs.append((dtiNode, projLabel, assocLabel, False))
+            elif defaultProjLabel is not None and defaultAssocLabel is not None:
+                labelPairs.append((dtiNode, defaultProjLabel, defaultAssocLabel, False))
+            else:
+                labelPairs.append((dtiNode, None, None, bool(MNISpaceCheck)))
 
-        logging.info(f'DTI-ALPS index: {self.dti_alps:.6f}')
-        print("DTI-ALPS index: ", self.dti_alps)
+        return labelPairs
 
-        stopTime = time.time()
-        logging.info(f'Processing completed in {stopTime-startTime:.2f} seconds')
+    def submitScene(self, taskQueue, labelPairs, useCache=True, refreshCache=False, estimator=None, bootstrap=None, tensorAxes="tensor"):
+        """
+        Queue the processing of several DTI volumes (see submitProcess), e.g. the whole scene with sceneLabelPairs.
+        The label masks and bounding boxes shared by several volumes (the default labels or the standard MNI labels) are computed once.
+        :param labelPairs: List of (dtiNode, projLabel, assocLabel, MNISpace)
+        :return: list of (dtiNode, projLabel, assocLabel, task). The volumes which could not be submitted (e.g. without
+                 labels, or not in MNI space) are given a failed ProcessingTask
+        """
+        roiCache = {}
+        submitted = []
+        for dtiNode, projLabel, assocLabel, MNISpace in labelPairs:
+            try:
+                if not MNISpace and (projLabel is None or assocLabel is None):
+                    raise ValueError("No Projection and Association labels found")
+                task = self.submitProcess(taskQueue, dtiNode, projLabel, assocLabel, MNISpace, useCache, refreshCache,
+                                          estimator=estimator, bootstrap=bootstrap, roiCache=roiCache, tensorAxes=tensorAxes)
+            except ValueError as error:
+                task = ProcessingTask(dtiNode.GetName(), None)
+                task.status, task.error = TASK_FAILED, error
+            submitted.append((dtiNode, projLabel, assocLabel, task))
+
+        return submitted
+
+    def resultTableRecord(self, dtiNode, projLabel, assocLabel, task):
+        """
+        Result table record (see DTI_ALPSLib.results.resultRecord) of a finished task.
+        """
+        inputs = {"dti": dtiNode.GetName(), "proj_label": projLabel.GetName() if projLabel else "MNI",
+                  "assoc_label": assocLabel.GetName() if assocLabel else "MNI"}
+        if task.status == TASK_DONE:
+            return resultRecord(task.name, task.result, task.profile, cached=task.profile.metadata.get("cached", False), **inputs)
+        if task.status == TASK_FAILED:
+            return resultRecord(task.name, profile=task.profile, status="failed", error=task.error, **inputs)
+        return resultRecord(task.name, profile=task.profile, status="cancelled", **inputs)
+
+    def appendResultTableRow(self, tableNode, record):
+        """
+        Append a result record to a table node, whose columns (RESULT_FIELDS) are created with the first row.
+        """
+        table = tableNode.GetTable()
+        if table.GetNumberOfColumns() == 0:
+            for field in RESULT_FIELDS:
+                column = vtk.vtkStringArray() if field in RESULT_TEXT_FIELDS else vtk.vtkDoubleArray()
+                column.SetName(field)
+                table.AddColumn(column)
+        row = tableNode.AddEmptyRow()
+        for columnIndex in range(table.GetNumberOfColumns()):
+            field = table.GetColumnName(columnIndex)
+            value = record.get(field, "")
+            if field not in RESULT_TEXT_FIELDS and value in ("", None):
+                value = float("nan")
+            tableNode.SetCellText(row, columnIndex, str(value))
+        tableNode.Modified()
+
+    def processScene(self, tableNode=None, dtiNodes=None, defaultProjLabel=None, defaultAssocLabel=None, MNISpaceCheck=False,
+                     useCache=True, refreshCache=False, estimator=None, bootstrap=None, tensorAxes="tensor"):
+        """
+        DTI-ALPS index of every DTI volume of the scene (see sceneLabelPairs), in a results table node with one row per volume.
+        :param tableNode: Table node where the rows are appended, a new "DTI-ALPS results" table node if not given
+        :return: vtkMRMLTableNode
+        """
+        if tableNode is None:
+            tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", slicer.mrmlScene.GenerateUniqueName("DTI-ALPS results"))
+        taskQueue = TaskQueue()
+        labelPairs = self.sceneLabelPairs(dtiNodes, defaultProjLabel, defaultAssocLabel, MNISpaceCheck)
+        submitted = self.submitScene(taskQueue, labelPairs, useCache, refreshCache, estimator, bootstrap, tensorAxes)
+        taskQueue.wait()
+        for dtiNode, projLabel, assocLabel, task in submitted:
+            self.appendResultTableRow(tableNode, self.resultTableRecord(dtiNode, projLabel, assocLabel, task))
 
-        return True
+        return tableNode
 
 
 #
@@ -447,49 +1221,928 @@ class DTI_ALPSTest(ScriptedLoadableModuleTest):
         """
         self.setUp()
         self.test_DTI_ALPS1()
+        self.test_reduceROIDiagonal()
+        self.test_MNIROIIndex()
+        self.test_readTensorDiagonal()
+        self.test_calculateDTIALPSMultiROI()
+        self.test_resultCache()
+        self.test_calculateDTIALPSFromDWI()
+        self.test_warpMNILabels()
+        self.test_resultSink()
+        self.test_calculateALPSMaps()
+        self.test_ROIEstimator()
+        self.test_bootstrapDTIALPS()
+        self.test_taskQueue()
+        self.test_processScene()
+        self.test_orientROITensors()
+        self.test_prefetcher()
+        self.test_ALPSService()
+        self.test_writeTensorDiagonal()
+        self.test_longitudinal()
 
     def test_DTI_ALPS1(self):
-        """ Ideally you should have several levels of tests.  At the lowest level
-        tests should exercise the functionality of the logic with different inputs
-        (both valid and invalid).  At higher levels your tests should emulate the
-        way the user would interact with your code and confirm that it still works
-        the way you intended.
-        One of the most important features of the tests is that it should alert other
-        developers when their changes will have an impact on the behavior of your
-        module.  For example, if a developer removes a feature that you depend on,
-        your test should break so they know that the feature is needed.
+        """ Full processing on synthetic tensor volumes with a known analytic DTI-ALPS index,
+        in native space (Projection and Association label nodes) and in MNI space (standard MNI labels).
+        Runs offline, no sample data is downloaded.
         """
-
         self.delayDisplay("Starting the test")
 
-        # Get/create input data
+        from DTI_ALPSLib import syntheticDTI
 
-        import SampleData
-        registerSampleData()
-        inputVolume = SampleData.downloadSample('DTI_ALPS1')
-        self.delayDisplay('Loaded test data set')
+        logic = DTI_ALPSLogic()
+
+        # Native space: label nodes drawn by the user
+        synthetic = syntheticDTI("mni2mm")
+        inputDTI = slicer.util.addVolumeFromArray(synthetic.array, synthetic.ijkToRAS, "SyntheticDTI", "vtkMRMLDiffusionTensorVolumeNode")
+        inputProjLabel = slicer.util.addVolumeFromArray(synthetic.projArray, synthetic.ijkToRAS, "SyntheticProj", "vtkMRMLLabelMapVolumeNode")
+        inputAssocLabel = slicer.util.addVolumeFromArray(synthetic.assocArray, synthetic.ijkToRAS, "SyntheticAssoc", "vtkMRMLLabelMapVolumeNode")
+        self.delayDisplay('Created synthetic data set')
+
+        profile = logic.process(inputDTI, inputProjLabel, inputAssocLabel, useCache=False)
+        self.assertAlmostEqual(logic.dti_alps, synthetic.expected, places=6)
+        self.assertEqual([record["name"] for record in profile.stages], ["arrayFromVolume", "reduction"])
+        self.assertEqual(profile.counts["projVoxels"], np.count_nonzero(synthetic.projArray))
+        self.assertEqual(profile.toDict()["dti_alps"], logic.dti_alps)
+
+        with self.assertRaises(ValueError):
+            logic.process(inputDTI, None, inputAssocLabel, useCache=False)
+
+        # MNI space: ROIs placed on the standard MNI labels, no label node is given
+        mniIndex = loadMNIROIIndex()
+        synthetic = syntheticDTI(mniIndex.shape, projROI=mniIndex.projection, assocROI=mniIndex.association, ijkToRAS=mniIndex.ijkToRAS)
+        slicer.util.updateVolumeFromArray(inputDTI, synthetic.array)
+        inputDTI.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(synthetic.ijkToRAS))
+
+        self.assertTrue(logic.process(inputDTI, None, None, MNISpaceCheck=True, useCache=False))
+        self.assertAlmostEqual(logic.dti_alps, synthetic.expected, places=6)
+
+        # Images outside the MNI 2 mm grid are rejected from their geometry, reporting what differs
+        shiftedIJKToRAS = synthetic.ijkToRAS.copy()
+        shiftedIJKToRAS[:3, 3] += 10.0
+        inputDTI.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(shiftedIJKToRAS))
+        self.assertEqual(len(logic.mniSpaceInputMismatches(inputDTI)), 1)
+        with self.assertRaisesRegex(ValueError, "origin"):
+            logic.process(inputDTI, None, None, MNISpaceCheck=True, useCache=False)
+
+        slicer.util.updateVolumeFromArray(inputDTI, syntheticDTI((20, 20, 20)).array)
+        with self.assertRaisesRegex(ValueError, "dimensions"):
+            logic.process(inputDTI, None, None, MNISpaceCheck=True, useCache=False)
 
-        inputScalarRange = inputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(inputScalarRange[0], 0)
-        self.assertEqual(inputScalarRange[1], 695)
+        self.delayDisplay('Test passed')
 
-        outputVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
-        threshold = 100
+    def test_reduceROIDiagonal(self):
+        """ Vectorized ROI reduction must match a per-voxel accumulation.
+        """
+        self.delayDisplay("Starting the ROI reduction test")
 
-        # Test the module logic
+        rng = np.random.default_rng(0)
+        dti_vol = rng.random((8, 9, 10, 3, 3)).astype(np.float32)
+        roi = rng.random((8, 9, 10)) > 0.5
 
         logic = DTI_ALPSLogic()
+        stats = logic.reduceROIDiagonal(dti_vol, roi)
+        stats_idx = logic.reduceROIDiagonal(dti_vol, np.flatnonzero(roi))
+
+        for component, axis in DIAGONAL_COMPONENTS.items():
+            expected = sum(float(voxel[axis][axis]) for voxel in dti_vol[np.where(roi)])
+            self.assertAlmostEqual(stats[component]["diff_value"], expected, places=6)
+            self.assertEqual(stats[component]["points"], int(roi.sum()))
+            self.assertEqual(stats[component], stats_idx[component])
+
+        with self.assertRaises(ValueError):
+            logic.reduceROIDiagonal(dti_vol, np.zeros((8, 9, 10), dtype=bool))
+
+        # Integer label arrays are masks (any nonzero voxel), only 1-D integer arrays are voxel indices
+        from DTI_ALPSLib import syntheticDTI
+        labels = roi.astype(np.int16)*3
+        self.assertEqual(logic.reduceROIDiagonal(dti_vol, labels), stats)
+        with self.assertRaises(ValueError):
+            logic.reduceROIDiagonal(dti_vol, labels[:, :, 1:])
+        synthetic = syntheticDTI((20, 24, 22))
+        self.assertAlmostEqual(alps.calculateDTIALPSFromROIs(synthetic.array, synthetic.projArray, synthetic.assocArray),
+                               synthetic.expected, places=6)
+        self.assertEqual(alps.roiBounds(labels.shape, labels), alps.roiBounds(roi.shape, roi))
+
+        self.delayDisplay('Test passed')
+
+    def test_MNIROIIndex(self):
+        """ The shipped MNI ROI index must match the standard MNI labels.
+        """
+        self.delayDisplay("Starting the MNI ROI index test")
+
+        from DTI_ALPSLib import mni
+
+        shipped = mni.readMNIROIIndex()
+        self.assertIsNotNone(shipped, "MNI ROI index file is missing or outdated")
+
+        scanned = mni.buildMNIROIIndex()
+        self.assertEqual(shipped.shape, scanned.shape)
+        np.testing.assert_array_equal(shipped.projection, scanned.projection)
+        np.testing.assert_array_equal(shipped.association, scanned.association)
+        self.assertIs(mni.loadMNIROIIndex(), mni.loadMNIROIIndex())
+
+        self.delayDisplay('Test passed')
+
+    def test_readTensorDiagonal(self):
+        """ ROI-only lazy loading must give the same DTI-ALPS index as the whole tensor volume.
+        """
+        self.delayDisplay("Starting the lazy loading test")
+
+        import gzip
+        import tempfile
+        from DTI_ALPSLib import alps, pipeline, volumeio
+
+        rng = np.random.default_rng(0)
+        dti_vol = rng.random((6, 7, 8, 3, 3)).astype(np.float32)
+        proj_vol = np.zeros((6, 7, 8), dtype=np.uint8)
+        proj_vol[1:3, 2:4, 1:3] = 1
+        assoc_vol = np.zeros((6, 7, 8), dtype=np.uint8)
+        assoc_vol[3:5, 4:6, 5:7] = 1
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {}
+            for name, array, sizes, kinds, encoding in [("dti", dti_vol, "9 8 7 6", "3D-matrix domain domain domain", "gzip"),
+                                                        ("proj", proj_vol, "8 7 6", "domain domain domain", "raw"),
+                                                        ("assoc", assoc_vol, "8 7 6", "domain domain domain", "raw")]:
+                header = (f"NRRD0004\ntype: {'float' if array.dtype == np.float32 else 'uchar'}\ndimension: {len(kinds.split())}\n"
+                          f"sizes: {sizes}\nkinds: {kinds}\nendian: little\nencoding: {encoding}\n\n")
+                payload = array.tobytes()
+                paths[name] = os.path.join(tempDir, f"{name}.nrrd")
+                with open(paths[name], "wb") as f:
+                    f.write(header.encode("ascii"))
+                    f.write(gzip.compress(payload) if encoding == "gzip" else payload)
+
+            bounds = ((1, 5), (2, 6), (1, 7))
+            diagonal = volumeio.readTensorDiagonal(paths["dti"], bounds).array
+            np.testing.assert_array_equal(diagonal, np.stack([dti_vol[1:5, 2:6, 1:7, n, n] for n in range(3)], axis=-1))
+
+            expected = alps.calculateDTIALPS(dti_vol, proj_vol, assoc_vol)
+            for lazyLoading in [False, True]:
+                index = pipeline.calculateDTIALPSFromFiles(paths["dti"], paths["proj"], paths["assoc"], lazyLoading=lazyLoading)
+                self.assertAlmostEqual(index, expected, places=12)
+
+            # Detached data: the lines are skipped in the file, the bytes after the decompression (or from the end with -1)
+            payload = dti_vol.tobytes()
+            for encoding, skips, data in [("gzip", "line skip: 1\nbyte skip: 5\n", b"text\n"+gzip.compress(b"12345"+payload)),
+                                          ("raw", "byte skip: -1\n", b"12345"+payload)]:
+                with open(os.path.join(tempDir, "detached.raw"), "wb") as f:
+                    f.write(data)
+                with open(os.path.join(tempDir, "detached.nhdr"), "w") as f:
+                    f.write(f"NRRD0004\ntype: float\ndimension: 4\nsizes: 9 8 7 6\nkinds: 3D-matrix domain domain domain\n"
+                            f"endian: little\nencoding: {encoding}\n{skips}data file: detached.raw\n\n")
+                np.testing.assert_array_equal(volumeio.readVolume(os.path.join(tempDir, "detached.nhdr")).array, dti_vol)
+                np.testing.assert_array_equal(volumeio.readTensorDiagonal(os.path.join(tempDir, "detached.nhdr"), bounds).array, diagonal)
+            with open(os.path.join(tempDir, "detached.nhdr"), "w") as f:
+                f.write("NRRD0004\ntype: float\ndimension: 4\nsizes: 9 8 7 6\nkinds: 3D-matrix domain domain domain\n"
+                        "endian: little\nencoding: gzip\nbyte skip: -1\ndata file: detached.raw\n\n")
+            with self.assertRaises(ValueError):
+                volumeio.readNRRDVolumeHeader(os.path.join(tempDir, "detached.nhdr"))
+
+        self.delayDisplay('Test passed')
+
+    def test_calculateDTIALPSMultiROI(self):
+        """ Single pass multi-label indices must match one calculation per ROI pair.
+        """
+        self.delayDisplay("Starting the multi-ROI test")
+
+        from DTI_ALPSLib import alps
+
+        rng = np.random.default_rng(0)
+        dti_vol = rng.random((8, 9, 10, 3, 3)).astype(np.float32)
+        proj_vol = np.zeros((8, 9, 10), dtype=np.uint8)
+        proj_vol[1:3, 1:4, 1:3] = 1
+        proj_vol[1:3, 1:4, 7:9] = 2
+        assoc_vol = np.zeros((8, 9, 10), dtype=np.uint8)
+        assoc_vol[5:7, 5:8, 1:3] = 1
+        assoc_vol[5:7, 5:8, 7:9] = 2
+
+        indices = alps.calculateDTIALPSMultiROI(dti_vol, proj_vol, assoc_vol,
+                                                alps.parseROIPairs(["left=1:1", "right=2:2", "bilateral=1+2:1+2"]))
+        self.assertAlmostEqual(indices["left"], alps.calculateDTIALPS(dti_vol, proj_vol == 1, assoc_vol == 1), places=12)
+        self.assertAlmostEqual(indices["right"], alps.calculateDTIALPS(dti_vol, proj_vol == 2, assoc_vol == 2), places=12)
+        self.assertAlmostEqual(indices["bilateral"], alps.calculateDTIALPS(dti_vol, proj_vol, assoc_vol), places=12)
+        self.assertEqual(list(alps.calculateDTIALPSMultiROI(dti_vol, proj_vol, assoc_vol)), ["1", "2", "all"])
+
+        with self.assertRaises(ValueError):
+            alps.calculateDTIALPSMultiROI(dti_vol, proj_vol, assoc_vol, [("missing", [3], [1])])
+
+        self.delayDisplay('Test passed')
+
+    def test_resultCache(self):
+        """ Result cache keys must follow the input files content, and the cache must stay within its size bound.
+        """
+        self.delayDisplay("Starting the result cache test")
+
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            resultCache = ResultCache(os.path.join(tempDir, "cache"), maxBytes=1024)
+            paths = []
+            for name in ["dti.nii", "proj.nii", "assoc.nii"]:
+                paths.append(os.path.join(tempDir, name))
+                with open(paths[-1], "wb") as f:
+                    f.write(name.encode("ascii"))
+
+            key = resultCache.resultKey(*paths)
+            self.assertEqual(key, resultCache.resultKey(*paths))
+            self.assertNotEqual(key, resultCache.resultKey(*paths, MNISpace=True))
+            self.assertNotEqual(key, resultCache.resultKey(*paths, multiROI=True))
+            self.assertIsNone(resultCache.get(key))
+
+            calls = []
+            compute = lambda: calls.append(1) or 1.5
+            self.assertEqual(resultCache.getOrCompute(key, compute), 1.5)
+            self.assertEqual(resultCache.getOrCompute(key, compute), 1.5)
+            self.assertEqual(len(calls), 1)
+            resultCache.getOrCompute(key, compute, refresh=True)
+            self.assertEqual(len(calls), 2)
+
+            # DTI-ALPS results are cached with their profile measures (e.g. the bootstrap confidence interval)
+            profile = ProcessingProfile()
+            profile.measure("dtiAlpsLower", 1.25)
+            profile.count("projVoxels", 54)
+            resultCache.putResult(key, 1.5, profile)
+            restored = ProcessingProfile()
+            self.assertEqual(resultCache.getResult(key, restored), 1.5)
+            self.assertEqual((restored.measures, restored.counts), ({"dtiAlpsLower": 1.25}, {"projVoxels": 54}))
+            self.assertIsNone(resultCache.getResult("0"*64, ProcessingProfile()))
+
+            # The Slicer module, the runDTIALPS.py script (its calculationKey call) and the service share their keys
+            from DTI_ALPSLib import ALPSJob, ROIEstimator
+            logic = DTI_ALPSLogic()
+            for estimator, tensorAxes in [(None, "tensor"), (ROIEstimator("median"), "ras")]:
+                logicKey = logic.resultCacheKeyFromFiles(resultCache, (*paths, None), False,
+                                                         **logic.resultCacheParameters(estimator=estimator, tensorAxes=tensorAxes))
+                cliKey = resultCache.calculationKey(*paths, False, False, "roi", "wls", [None, None], None, estimator, None, tensorAxes,
+                                                    False, None)
+                jobKey = ALPSJob(dti=paths[0], proj_label=paths[1], assoc_label=paths[2], estimator="median" if estimator else "mean",
+                                 tensorAxes=tensorAxes).cacheKey(resultCache, False)
+                self.assertEqual(logicKey, cliKey)
+                self.assertEqual(logicKey, jobKey)
+            self.assertEqual(key, resultCache.calculationKey(*paths))
+            self.assertNotEqual(key, resultCache.calculationKey(*paths, multiROI=True))
+
+            # Changing the DTI content changes the key
+            with open(paths[0], "ab") as f:
+                f.write(b"changed")
+            self.assertNotEqual(key, resultCache.resultKey(*paths))
+
+            # Least recently used results are evicted beyond maxBytes
+            for number in range(200):
+                resultCache.put(f"{number:064d}", float(number))
+            entries = os.listdir(resultCache.resultsDir)
+            self.assertLessEqual(sum(os.path.getsize(os.path.join(resultCache.resultsDir, entry)) for entry in entries), 1024)
+            self.assertEqual(resultCache.get(f"{199:064d}"), 199.0)
+
+        self.delayDisplay('Test passed')
+
+    def test_calculateDTIALPSFromDWI(self):
+        """ ROI-only tensor fitting of raw DWI must recover the DTI-ALPS index of the tensors that generated the signals.
+        """
+        self.delayDisplay("Starting the DWI tensor fitting test")
+
+        import tempfile
+        from DTI_ALPSLib import nrrdGradientKeyValues, pipeline, syntheticDTI, syntheticDWI, writeNRRD
+
+        synthetic = syntheticDTI((30, 40, 35))
+        signals, gradients = syntheticDWI(synthetic)
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {name: os.path.join(tempDir, name+".nrrd") for name in ["dwi", "proj", "assoc"]}
+            writeNRRD(paths["dwi"], signals, synthetic.ijkToRAS, keyValues=nrrdGradientKeyValues(gradients))
+            writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS)
+            writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS)
+
+            for fitMethod in ["ols", "wls"]:
+                index = pipeline.calculateDTIALPSFromDWI(paths["dwi"], paths["proj"], paths["assoc"], method=fitMethod)
+                self.assertAlmostEqual(index, synthetic.expected, places=5)
+
+            # Same fit from the DWI node loaded by Slicer
+            inputDWI = slicer.util.loadVolume(paths["dwi"])
+            self.assertTrue(inputDWI.IsA("vtkMRMLDiffusionWeightedVolumeNode"))
+            inputProjLabel = slicer.util.loadLabelVolume(paths["proj"])
+            inputAssocLabel = slicer.util.loadLabelVolume(paths["assoc"])
+
+            logic = DTI_ALPSLogic()
+            profile = logic.process(inputDWI, inputProjLabel, inputAssocLabel, useCache=False)
+            self.assertAlmostEqual(logic.dti_alps, synthetic.expected, places=5)
+            self.assertEqual(profile.counts["fittedVoxels"], np.count_nonzero(synthetic.projArray)+np.count_nonzero(synthetic.assocArray))
+
+        self.delayDisplay('Test passed')
+
+    def test_warpMNILabels(self):
+        """ The standard MNI labels warped to a native space must match the labels of a subject known to be a translation of MNI,
+        from the transform files (matrix, ITK affine and displacement field) and from a transform node.
+        """
+        self.delayDisplay("Starting the MNI labels warping test")
+
+        import tempfile
+        from DTI_ALPSLib import loadMNIROIIndex, mniHemisphereLabels, pipeline, readMNITransform, syntheticDTI, warpMNILabels, writeNRRD
+
+        mniIndex = loadMNIROIIndex()
+        synthetic = syntheticDTI(mniIndex.shape, projROI=mniIndex.projection, assocROI=mniIndex.association, ijkToRAS=mniIndex.ijkToRAS)
+        shift = np.array([12.0, -7.0, 25.0])
+        nativeIJKToRAS = mniIndex.ijkToRAS.copy()
+        nativeIJKToRAS[:3, 3] += shift
+        subjectToMNI = np.eye(4)
+        subjectToMNI[:3, 3] = -shift
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {name: os.path.join(tempDir, name) for name in ["dti.nrrd", "matrix.txt", "affine.tfm", "warp.nrrd"]}
+            writeNRRD(paths["dti.nrrd"], synthetic.array, nativeIJKToRAS)
+            np.savetxt(paths["matrix.txt"], subjectToMNI)
+            # ITK transforms map the fixed (MNI) points to the moving (subject) points, in LPS
+            with open(paths["affine.tfm"], "w") as f:
+                f.write("#Insight Transform File V1.0\n#Transform 0\nTransform: AffineTransform_double_3_3\n"
+                        f"Parameters: 1 0 0 0 1 0 0 0 1 {-shift[0]} {-shift[1]} {shift[2]}\nFixedParameters: 10 -20 30\n")
+            writeNRRD(paths["warp.nrrd"], np.broadcast_to(shift*[-1, -1, 1], mniIndex.shape+(3,)).astype(np.float32), mniIndex.ijkToRAS)
+
+            for transformPath in [paths["matrix.txt"], paths["affine.tfm"], paths["warp.nrrd"]]:
+                warpedLabels = warpMNILabels(mniIndex.shape, nativeIJKToRAS, readMNITransform(transformPath))
+                for warpedLabel, mniLabel in zip(warpedLabels, mniHemisphereLabels(mniIndex)):
+                    np.testing.assert_array_equal(warpedLabel, mniLabel)
+                index = pipeline.calculateDTIALPSFromFiles(paths["dti.nrrd"], mniTransformPath=transformPath, lazyLoading=True)
+                self.assertAlmostEqual(index, synthetic.expected, places=6)
+
+            # Same labels from a linear transform node, applied to the subject volume to move it to MNI
+            inputDTI = slicer.util.loadVolume(paths["dti.nrrd"])
+            mniTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+            mniTransform.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(subjectToMNI))
+
+            logic = DTI_ALPSLogic()
+            profile = logic.process(inputDTI, None, None, useCache=False, mniTransform=mniTransform)
+            self.assertAlmostEqual(logic.dti_alps, synthetic.expected, places=6)
+            self.assertIn("warpLabels", [record["name"] for record in profile.stages])
+
+        self.delayDisplay('Test passed')
+
+    def test_resultSink(self):
+        """ Result tables are appended one record at a time, survive an interrupted write and are resumed from the finished subjects.
+        """
+        self.delayDisplay("Starting the result sink test")
+
+        import tempfile
+        from DTI_ALPSLib import ProcessingProfile, ResultSink, calculateDTIALPS, readResultRecords, resultRecord, syntheticDTI
+
+        synthetic = syntheticDTI((20, 24, 22))
+        profile = ProcessingProfile()
+        index = calculateDTIALPS(synthetic.array, synthetic.projArray, synthetic.assocArray, profile)
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            for name in ["results.csv", "results.jsonl"]:
+                path = os.path.join(tempDir, name)
+                resultSink = ResultSink(path)
+                resultSink.write(resultRecord("sub-01", index, profile))
+                resultSink.write(resultRecord("sub-02", status="failed", error="Input DTI image is not valid"))
+                # Interrupted while writing the next record
+                with open(path, "a") as f:
+                    f.write("sub-03,")
+
+                resultSink = ResultSink(path, resume=True)
+                self.assertEqual(resultSink.finishedSubjects, {"sub-01"})
+                resultSink.write(resultRecord("sub-02", index, profile))
+                resultSink.compact()
+
+                records = readResultRecords(path)
+                self.assertEqual([record["subject"] for record in records], ["sub-01", "sub-02"])
+                self.assertEqual([record["status"] for record in records], ["ok", "ok"])
+                self.assertAlmostEqual(float(records[0]["dti_alps"]), synthetic.expected, places=6)
+                self.assertEqual(int(records[0]["proj_voxels"]), np.count_nonzero(synthetic.projArray))
+                self.assertAlmostEqual(float(records[0]["proj_Dxx"]), profile.measures["projDxx"], places=9)
+
+                # A new table is started without resuming
+                self.assertEqual(ResultSink(path).finishedSubjects, set())
+
+                # The multi-ROI indices are added as columns, the previous rows being kept
+                resultSink = ResultSink(path, resume=True)
+                resultSink.write(resultRecord("sub-01", index, profile))
+                resultSink.write(resultRecord("sub-02", {"left": 1.5, "right": 1.6, "all": 1.55}))
+                records = readResultRecords(path)
+                self.assertAlmostEqual(float(records[0]["dti_alps"]), synthetic.expected, places=6)
+                self.assertEqual([float(records[1][f"dti_alps_{name}"]) for name in ["left", "right", "all"]], [1.5, 1.6, 1.55])
+
+        self.delayDisplay('Test passed')
+
+    def test_calculateALPSMaps(self):
+        """ The voxelwise ratio maps computed slab by slab, in memory and file to file, must hold the ROI diffusivity ratios.
+        """
+        self.delayDisplay("Starting the voxelwise ratio maps test")
+
+        import tempfile
+        from DTI_ALPSLib import MAP_NAMES, calculateALPSMaps, readVolume, syntheticDTI, writeALPSMapsFromFiles, writeNRRD
+
+        synthetic = syntheticDTI((20, 24, 22))
+        maps = calculateALPSMaps(synthetic.array, synthetic.projArray, synthetic.assocArray, slabSlices=3)
+        self.assertEqual(sorted(maps), sorted(MAP_NAMES))
+        projMask, assocMask = synthetic.projArray != 0, synthetic.assocArray != 0
+        np.testing.assert_allclose(maps["projectionRatio"][projMask], 2.0, rtol=1e-6)
+        np.testing.assert_allclose(maps["associationRatio"][assocMask], 0.0011/0.0007, rtol=1e-6)
+        self.assertFalse(maps["projectionRatio"][~projMask].any())
+        self.assertFalse(maps["associationRatio"][~assocMask].any())
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            for encoding in ["raw", "gzip"]:
+                paths = {name: os.path.join(tempDir, f"{name}-{encoding}.nrrd") for name in ["dti", "proj", "assoc"]}
+                writeNRRD(paths["dti"], synthetic.array, synthetic.ijkToRAS, encoding=encoding)
+                writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS)
+                writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS)
+                mapPaths = writeALPSMapsFromFiles(paths["dti"], os.path.join(tempDir, f"sub-{encoding}"), paths["proj"], paths["assoc"],
+                                                  slabSlices=4, encoding=encoding)
+                for name, mapPath in mapPaths.items():
+                    np.testing.assert_array_equal(readVolume(mapPath).array, maps[name])
+
+            # Scalar volume nodes with the geometry of the DTI volume
+            inputDTI = slicer.util.loadVolume(paths["dti"])
+            mapNodes = DTI_ALPSLogic().createALPSMapNodes(inputDTI, slicer.util.loadLabelVolume(paths["proj"]),
+                                                          slicer.util.loadLabelVolume(paths["assoc"]))
+            np.testing.assert_allclose(slicer.util.arrayFromVolume(mapNodes["projectionRatio"]), maps["projectionRatio"], rtol=1e-6)
+            self.assertEqual(mapNodes["alpsRatio"].GetImageData().GetDimensions(), inputDTI.GetImageData().GetDimensions())
+
+        self.delayDisplay('Test passed')
+
+    def test_ROIEstimator(self):
+        """ The robust ROI estimators must recover the DTI-ALPS index of a subject whose Projection ROI is contaminated by CSF voxels.
+        """
+        self.delayDisplay("Starting the robust ROI estimators test")
+
+        from DTI_ALPSLib import ProcessingProfile, ROIEstimator, calculateDTIALPS, calculateDTIALPSMultiROI, diffusionMeasures, syntheticDTI
+
+        synthetic = syntheticDTI((20, 24, 22))
+        noise = 1.0+0.02*np.random.default_rng(0).standard_normal(synthetic.array.shape[:3])
+        dti_vol = (synthetic.array*noise[..., None, None]).astype(np.float32)
+        dti_vol.reshape(-1, 3, 3)[np.flatnonzero(synthetic.projArray)[:10]] = 0.003*np.eye(3)
+
+        md, fa = diffusionMeasures(np.diag([0.0017, 0.0003, 0.0003]))
+        self.assertAlmostEqual(md, 0.0023/3)
+        self.assertAlmostEqual(fa, np.sqrt(1.5)*np.linalg.norm([0.0017-md, 0.0003-md, 0.0003-md])/np.linalg.norm([0.0017, 0.0003, 0.0003]))
+
+        plain = calculateDTIALPS(dti_vol, synthetic.projArray, synthetic.assocArray)
+        self.assertGreater(abs(plain-synthetic.expected), 0.1)
+        for estimator in [ROIEstimator("median"), ROIEstimator("trimmed", 0.2), ROIEstimator(madThreshold=3.0),
+                          ROIEstimator(maxMD=0.002), ROIEstimator(minFA=0.1)]:
+            profile = ProcessingProfile()
+            index = calculateDTIALPS(dti_vol, synthetic.projArray, synthetic.assocArray, profile, estimator)
+            self.assertAlmostEqual(index, synthetic.expected, delta=0.02)
+            self.assertGreater(profile.measures["projDxxSD"], 0.0)
+        self.assertEqual(profile.counts["projExcluded"], 10)
+        self.assertEqual(profile.counts["projVoxels"], np.count_nonzero(synthetic.projArray)-10)
+
+        # Plain means through the estimator, multi-ROI pairs and the tensor diagonal input
+        self.assertAlmostEqual(calculateDTIALPS(dti_vol, synthetic.projArray, synthetic.assocArray, estimator=ROIEstimator()), plain, places=9)
+        indices = calculateDTIALPSMultiROI(dti_vol, synthetic.projArray, synthetic.assocArray, estimator=ROIEstimator(maxMD=0.002))
+        self.assertAlmostEqual(indices["all"], synthetic.expected, delta=0.02)
+        diagonal = np.ascontiguousarray(np.diagonal(dti_vol, axis1=3, axis2=4))
+        self.assertAlmostEqual(calculateDTIALPS(diagonal, synthetic.projArray, synthetic.assocArray, estimator=ROIEstimator("median")),
+                               calculateDTIALPS(dti_vol, synthetic.projArray, synthetic.assocArray, estimator=ROIEstimator("median")))
+        with self.assertRaises(ValueError):
+            calculateDTIALPS(diagonal, synthetic.projArray, synthetic.assocArray, estimator=ROIEstimator(minFA=0.1))
+        with self.assertRaises(ValueError):
+            calculateDTIALPS(dti_vol, synthetic.projArray, synthetic.assocArray, estimator=ROIEstimator(maxMD=0.0))
+
+        self.delayDisplay('Test passed')
+
+    def test_bootstrapDTIALPS(self):
+        """ Bootstrap confidence intervals must be reproducible from their seed and cover the index of noisy ROIs.
+        """
+        self.delayDisplay("Starting the bootstrap confidence interval test")
+
+        import tempfile
+        from DTI_ALPSLib import ALPSBootstrap, ProcessingProfile, ROIEstimator, bootstrapDTIALPS, calculateDTIALPS, syntheticDTI, writeNRRD
+
+        synthetic = syntheticDTI((20, 24, 22))
+        noise = 1.0+0.05*np.random.default_rng(0).standard_normal(synthetic.array.shape[:3])
+        dti_vol = (synthetic.array*noise[..., None, None]).astype(np.float32)
+        projROI, assocROI = synthetic.projArray != 0, synthetic.assocArray != 0
+
+        profile = ProcessingProfile()
+        interval = bootstrapDTIALPS(dti_vol, projROI, assocROI, ALPSBootstrap(1000, seed=7), profile=profile)
+        self.assertAlmostEqual(interval.index, calculateDTIALPS(dti_vol, synthetic.projArray, synthetic.assocArray), places=9)
+        self.assertLess(interval.lower, interval.index)
+        self.assertGreater(interval.upper, interval.index)
+        self.assertGreater(interval.standardError, 0.0)
+        self.assertEqual(profile.measures["dtiAlpsLower"], interval.lower)
+
+        # Same seed, same interval. A wider confidence level gives a wider interval
+        self.assertEqual(bootstrapDTIALPS(dti_vol, projROI, assocROI, ALPSBootstrap(1000, seed=7)).toDict(), interval.toDict())
+        wider = bootstrapDTIALPS(dti_vol, projROI, assocROI, ALPSBootstrap(1000, 0.99, seed=7))
+        self.assertLessEqual(wider.lower, interval.lower)
+        self.assertGreaterEqual(wider.upper, interval.upper)
+
+        # Robust estimates of each replicate, from the tensor diagonal as well
+        estimator = ROIEstimator("median")
+        diagonal = np.ascontiguousarray(np.diagonal(dti_vol, axis1=3, axis2=4))
+        robust = bootstrapDTIALPS(dti_vol, projROI, assocROI, ALPSBootstrap(500), estimator)
+        self.assertAlmostEqual(robust.index, calculateDTIALPS(dti_vol, synthetic.projArray, synthetic.assocArray, estimator=estimator))
+        self.assertEqual(bootstrapDTIALPS(diagonal, projROI, assocROI, ALPSBootstrap(500), estimator).toDict(), robust.toDict())
+
+        # Through the module logic
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {name: os.path.join(tempDir, f"{name}.nrrd") for name in ["dti", "proj", "assoc"]}
+            writeNRRD(paths["dti"], dti_vol, synthetic.ijkToRAS)
+            writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS)
+            writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS)
+            logic = DTI_ALPSLogic()
+            profile = logic.process(slicer.util.loadVolume(paths["dti"]), slicer.util.loadLabelVolume(paths["proj"]),
+                                    slicer.util.loadLabelVolume(paths["assoc"]), useCache=False, bootstrap=ALPSBootstrap(1000, seed=7))
+            self.assertAlmostEqual(profile.measures["dtiAlpsLower"], interval.lower, places=9)
+            self.assertAlmostEqual(profile.measures["dtiAlpsUpper"], interval.upper, places=9)
 
-        # Test algorithm with non-inverted threshold
-        logic.process(inputVolume, outputVolume, threshold, True)
-        outputScalarRange = outputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(outputScalarRange[0], inputScalarRange[0])
-        self.assertEqual(outputScalarRange[1], threshold)
-
-        # Test algorithm with inverted threshold
-        logic.process(inputVolume, outputVolume, threshold, False)
-        outputScalarRange = outputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(outputScalarRange[0], inputScalarRange[0])
-        self.assertEqual(outputScalarRange[1], inputScalarRange[1])
+        self.delayDisplay('Test passed')
+
+    def test_taskQueue(self):
+        """ Background tasks must run in submission order, report their stage and stop at the next stage once cancelled.
+        """
+        self.delayDisplay("Starting the background task queue test")
+
+        import tempfile
+        import threading
+        from DTI_ALPSLib import (TASK_CANCELLED, TASK_DONE, TASK_FAILED, ProcessingProfile, TaskQueue, calculateDTIALPSFromROIs,
+                                 syntheticDTI, writeNRRD)
+
+        synthetic = syntheticDTI((20, 24, 22))
+        projROI, assocROI = synthetic.projArray != 0, synthetic.assocArray != 0
+        taskQueue = TaskQueue()
+        started, release = threading.Event(), threading.Event()
+
+        def blocked(profile):
+            with profile.stage("waiting"):
+                started.set()
+                release.wait(10)
+            with profile.stage("reduction"):
+                return 1.0
+
+        def failing(profile):
+            raise ValueError("ROI is empty")
+
+        first = taskQueue.submit("first", blocked)
+        cancelled = taskQueue.submit("cancelled", lambda profile: calculateDTIALPSFromROIs(synthetic.array, projROI, assocROI, profile))
+        failed = taskQueue.submit("failed", failing)
+        done = taskQueue.submit("done", lambda profile: calculateDTIALPSFromROIs(synthetic.array, projROI, assocROI, profile))
+        cancelled.cancel()
+        self.assertTrue(started.wait(10))
+        self.assertEqual(first.stage, "waiting")
+        first.cancel()
+        release.set()
+        self.assertTrue(taskQueue.wait(10))
+
+        # The running task stops at its next stage, the queued cancelled task is never run
+        self.assertEqual([task.status for task in taskQueue.popFinished()], [TASK_CANCELLED, TASK_CANCELLED, TASK_FAILED, TASK_DONE])
+        self.assertEqual([record["name"] for record in first.profile.stages], ["waiting"])
+        self.assertEqual(cancelled.profile.stages, [])
+        self.assertIsInstance(failed.error, ValueError)
+        self.assertAlmostEqual(done.result, synthetic.expected, places=6)
+        self.assertEqual(taskQueue.popFinished(), [])
+        self.assertIsNone(ProcessingProfile().stageCallback)
+
+        # Through the module logic, from the bounding box copy of the inputs
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {name: os.path.join(tempDir, f"{name}.nrrd") for name in ["dti", "proj", "assoc"]}
+            writeNRRD(paths["dti"], synthetic.array, synthetic.ijkToRAS)
+            writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS)
+            writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS)
+            logic = DTI_ALPSLogic()
+            task = logic.submitProcess(taskQueue, slicer.util.loadVolume(paths["dti"]), slicer.util.loadLabelVolume(paths["proj"]),
+                                       slicer.util.loadLabelVolume(paths["assoc"]), useCache=False)
+            self.assertTrue(taskQueue.wait(10))
+            self.assertEqual(task.status, TASK_DONE)
+            self.assertAlmostEqual(task.result, synthetic.expected, places=6)
+
+        self.delayDisplay('Test passed')
+
+    def test_processScene(self):
+        """ The scene batch must pair the DTI volumes with their labels by name, or the default labels, and fill a results table.
+        """
+        self.delayDisplay("Starting the scene batch test")
+
+        import tempfile
+        from DTI_ALPSLib import syntheticDTI, writeNRRD
+
+        synthetic = syntheticDTI((20, 24, 22))
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {}
+            for name, array in [("subjectA", synthetic.array), ("subjectB", synthetic.array), ("subjectC", 2.0*synthetic.array),
+                                ("subjectA_proj", synthetic.projArray), ("subjectA_Assoc", synthetic.assocArray),
+                                ("proj", synthetic.projArray), ("assoc", synthetic.assocArray)]:
+                paths[name] = os.path.join(tempDir, f"{name}.nrrd")
+                writeNRRD(paths[name], array, synthetic.ijkToRAS)
+            dtiNodes = [slicer.util.loadVolume(paths[name]) for name in ["subjectA", "subjectB", "subjectC"]]
+            labelNodes = {name: slicer.util.loadLabelVolume(paths[name]) for name in ["subjectA_proj", "subjectA_Assoc", "proj", "assoc"]}
+
+            logic = DTI_ALPSLogic()
+            labelPairs = logic.sceneLabelPairs(dtiNodes, labelNodes["proj"], labelNodes["assoc"])
+            self.assertEqual([(projLabel.GetName(), assocLabel.GetName()) for _, projLabel, assocLabel, _ in labelPairs],
+                             [("subjectA_proj", "subjectA_Assoc"), ("proj", "assoc"), ("proj", "assoc")])
+            self.assertEqual(logic.sceneLabelPairs(dtiNodes[1:2]), [(dtiNodes[1], None, None, False)])
+
+            tableNode = logic.processScene(dtiNodes=dtiNodes+dtiNodes[1:2], defaultProjLabel=labelNodes["proj"],
+                                           defaultAssocLabel=labelNodes["assoc"], useCache=False)
+            table = tableNode.GetTable()
+            self.assertEqual(table.GetNumberOfRows(), 4)
+            for row in range(table.GetNumberOfRows()):
+                self.assertEqual(table.GetColumnByName("status").GetValue(row), "ok")
+                # Scaling the tensors does not change the index
+                self.assertAlmostEqual(table.GetColumnByName("dti_alps").GetValue(row), synthetic.expected, places=5)
+            self.assertEqual(table.GetColumnByName("proj_voxels").GetValue(0), np.count_nonzero(synthetic.projArray))
+
+            # Without labels, the volume is reported as failed
+            tableNode = logic.processScene(dtiNodes=dtiNodes[1:2], useCache=False)
+            self.assertEqual(tableNode.GetTable().GetColumnByName("status").GetValue(0), "failed")
+
+        self.delayDisplay('Test passed')
+
+    def test_orientROITensors(self):
+        """ The tensor axes projection must recover the index of tensors stored in a rotated measurement frame or an oblique image.
+        """
+        self.delayDisplay("Starting the tensor axes projection test")
+
+        import tempfile
+        from DTI_ALPSLib import (ProcessingProfile, calculateDTIALPSFromFiles, calculateDTIALPSFromROIs, orientROITensors, syntheticDTI,
+                                 tensorAxesMatrix, writeNRRD)
+
+        synthetic = syntheticDTI((20, 24, 22))
+        projROI, assocROI = synthetic.projArray != 0, synthetic.assocArray != 0
+        angle = np.radians(20.0)
+        rotation = np.array([[1.0, 0.0, 0.0], [0.0, np.cos(angle), -np.sin(angle)], [0.0, np.sin(angle), np.cos(angle)]])
+
+        # Tensors stored in a measurement frame rotated from RAS: D_frame = R^T D_RAS R
+        rotated = np.einsum("ai,kjlab,bc->kjlic", rotation, synthetic.array, rotation)
+        self.assertNotAlmostEqual(calculateDTIALPSFromROIs(rotated, projROI, assocROI), synthetic.expected, places=3)
+        profile = ProcessingProfile()
+        oriented, (compactProj, compactAssoc) = orientROITensors(rotated, [projROI, assocROI], tensorAxesMatrix("ras", rotation), profile=profile)
+        self.assertEqual(oriented.shape, (profile.counts["orientedVoxels"], 1, 1, 3))
+        self.assertAlmostEqual(calculateDTIALPSFromROIs(oriented, compactProj, compactAssoc), synthetic.expected, places=6)
+        # Label maps on another grid must be rejected, not read as flat voxel indices
+        with self.assertRaises(ValueError):
+            orientROITensors(rotated, [np.zeros((20, 24, 23), dtype=np.int16), assocROI], tensorAxesMatrix("ras", rotation))
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {name: os.path.join(tempDir, f"{name}.nrrd") for name in ["dti", "oblique", "proj", "assoc"]}
+            writeNRRD(paths["dti"], rotated, synthetic.ijkToRAS, measurementFrame=rotation)
+            writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS)
+            writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS)
+            for lazyLoading in [False, True]:
+                self.assertAlmostEqual(calculateDTIALPSFromFiles(paths["dti"], paths["proj"], paths["assoc"], lazyLoading=lazyLoading,
+                                                                 tensorAxes="ras"), synthetic.expected, places=5)
+
+            # Oblique image with the tensors along the image axes: the nearest image axes follow the head, not RAS
+            obliqueToRAS = synthetic.ijkToRAS.copy()
+            obliqueToRAS[:3, :3] = rotation @ synthetic.ijkToRAS[:3, :3]
+            writeNRRD(paths["oblique"], synthetic.array, obliqueToRAS, measurementFrame=rotation)
+            writeNRRD(paths["proj"], synthetic.projArray, obliqueToRAS)
+            writeNRRD(paths["assoc"], synthetic.assocArray, obliqueToRAS)
+            self.assertAlmostEqual(calculateDTIALPSFromFiles(paths["oblique"], paths["proj"], paths["assoc"], tensorAxes="image"),
+                                   synthetic.expected, places=5)
+            with self.assertRaises(ValueError):
+                calculateDTIALPSFromFiles(paths["oblique"], paths["proj"], paths["assoc"], tensorAxes="scanner")
+
+        self.delayDisplay('Test passed')
+
+    def test_prefetcher(self):
+        """ Prefetched subjects must be given in order, within the read-ahead depth and memory budget, with their read errors.
+        """
+        self.delayDisplay("Starting the subject prefetch test")
+
+        import tempfile
+        import threading
+        from DTI_ALPSLib import Prefetcher, calculateDTIALPSFromROIs, readDTIALPSInputs, syntheticDTI, writeNRRD
+
+        lock = threading.Lock()
+        loaded, peak = set(), [0]
+
+        def load(item):
+            if item == 3:
+                raise ValueError("Unreadable file")
+            with lock:
+                loaded.add(item)
+                peak[0] = max(peak[0], len(loaded))
+            return item*10
+
+        results = []
+        for item, future in Prefetcher(range(8), load, depth=2, maxBytes=300, sizeFunction=lambda item: 100):
+            try:
+                results.append(future.result())
+            except ValueError:
+                results.append(None)
+            with lock:
+                loaded.discard(item)
+        self.assertEqual(results, [0, 10, 20, None, 40, 50, 60, 70])
+        # The current item and two items ahead, within the 300 bytes budget
+        self.assertLessEqual(peak[0], 3)
+
+        # An item over the budget is loaded alone, once the items before it are processed
+        loaded.clear()
+        peak[0] = 0
+        sizes = {0: 100, 1: 1000, 2: 100}
+        for item, future in Prefetcher(range(3), load, depth=2, maxBytes=300, sizeFunction=sizes.get):
+            future.result()
+            with lock:
+                if item == 0:
+                    self.assertNotIn(1, loaded)
+                loaded.discard(item)
+        with self.assertRaises(ValueError):
+            Prefetcher(range(3), load, depth=0)
+
+        # The ROIs bounding box read by a prefetch thread gives the same index
+        synthetic = syntheticDTI((20, 24, 22))
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {name: os.path.join(tempDir, f"{name}.nrrd") for name in ["dti", "proj", "assoc"]}
+            writeNRRD(paths["dti"], synthetic.array, synthetic.ijkToRAS)
+            writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS)
+            writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS)
+            prefetcher = Prefetcher([paths["dti"]]*3, lambda path: readDTIALPSInputs(path, paths["proj"], paths["assoc"], lazyLoading=True))
+            for path, future in prefetcher:
+                dtiArray, projROI, assocROI = future.result()
+                self.assertLess(dtiArray.size, synthetic.array.size)
+                self.assertAlmostEqual(calculateDTIALPSFromROIs(dtiArray, projROI, assocROI), synthetic.expected, places=6)
+
+        self.delayDisplay('Test passed')
+
+    def test_ALPSService(self):
+        """ The service must calculate the posted jobs, reuse the result cache and reject invalid jobs without stopping.
+        """
+        self.delayDisplay("Starting the DTI-ALPS service test")
+
+        import json
+        import tempfile
+        import threading
+        import urllib.error
+        import urllib.request
+        from DTI_ALPSLib import ALPSService, ResultCache, syntheticDTI, writeNRRD
+
+        def post(url, payload):
+            request = urllib.request.Request(url+"/jobs", json.dumps(payload).encode("utf-8"), {"Content-Type": "application/json"})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return json.load(response)
+
+        synthetic = syntheticDTI((20, 24, 22))
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {name: os.path.join(tempDir, f"{name}.nrrd") for name in ["dti", "proj", "assoc"]}
+            writeNRRD(paths["dti"], synthetic.array, synthetic.ijkToRAS)
+            writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS)
+            writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS)
+
+            server = ALPSService(ResultCache(os.path.join(tempDir, "cache"))).createServer(port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = "http://{}:{}".format(*server.server_address[:2])
+            try:
+                job = {"subject": "sub-01", "dti": paths["dti"], "proj_label": paths["proj"], "assoc_label": paths["assoc"]}
+                record = post(url, job)
+                self.assertEqual(record["status"], "ok")
+                self.assertEqual(record["subject"], "sub-01")
+                self.assertAlmostEqual(record["dti_alps"], synthetic.expected, places=6)
+                self.assertFalse(record["cached"])
+                # A cached record keeps the ROI means and voxel counts of the calculation
+                cachedRecord = post(url, job)
+                self.assertTrue(cachedRecord["cached"])
+                for field in ["dti_alps", "proj_Dxx", "proj_Dyy", "assoc_Dxx", "assoc_Dzz", "proj_voxels", "assoc_voxels"]:
+                    self.assertEqual(cachedRecord[field], record[field])
+                self.assertEqual(post(url, dict(job, estimator="median", lazyLoading=True))["cached"], False)
+
+                # Invalid jobs are rejected, failed jobs are reported in their record
+                with self.assertRaises(urllib.error.HTTPError) as context:
+                    post(url, dict(job, unknownOption=1))
+                self.assertEqual(context.exception.code, 400)
+                for invalid in [{"bootstrap": "abc"}, {"bootstrap": True}, {"MNISpace": "yes"}, {"roiPairs": [1]}, {"dti": 3}]:
+                    with self.assertRaises(urllib.error.HTTPError) as context:
+                        post(url, dict(job, **invalid))
+                    self.assertEqual(context.exception.code, 400)
+                    self.assertIn("error", json.load(context.exception))
+                failed = post(url, dict(job, dti=os.path.join(tempDir, "missing.nrrd")))
+                self.assertEqual(failed["status"], "failed")
+
+                with urllib.request.urlopen(url+"/status", timeout=30) as response:
+                    status = json.load(response)
+                self.assertEqual((status["done"], status["failed"], status["running"]), (3, 1, 0))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        self.delayDisplay('Test passed')
+
+    def test_writeTensorDiagonal(self):
+        """ The compact tensor diagonal file must be a third of the tensors and give the same index, read whole or lazily.
+        """
+        self.delayDisplay("Starting the tensor diagonal file test")
+
+        import tempfile
+        from DTI_ALPSLib import (ROIEstimator, calculateDTIALPSFromFiles, readTensorDiagonal, readVolume, readVolumeHeader, syntheticDTI,
+                                 writeNRRD, writeTensorDiagonal)
+
+        synthetic = syntheticDTI((20, 24, 22))
+        dti_vol = synthetic.array.astype(np.float32)
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = {name: os.path.join(tempDir, f"{name}.nrrd") for name in ["dti", "proj", "assoc", "diagonal", "compressed"]}
+            writeNRRD(paths["dti"], dti_vol, synthetic.ijkToRAS, encoding="raw")
+            writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS)
+            writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS)
+
+            header = writeTensorDiagonal(paths["diagonal"], paths["dti"])
+            self.assertTrue(header.isTensorDiagonal)
+            self.assertEqual(header.nbytes*3, readVolumeHeader(paths["dti"]).nbytes)
+            np.testing.assert_array_equal(readVolume(paths["diagonal"]).array, np.diagonal(dti_vol, axis1=3, axis2=4))
+            np.testing.assert_allclose(readVolume(paths["diagonal"]).ijkToRAS, synthetic.ijkToRAS)
+            writeTensorDiagonal(paths["compressed"], paths["dti"], "gzip")
+            bounds = ((2, 9), (3, 11), (4, 10))
+            np.testing.assert_array_equal(readTensorDiagonal(paths["compressed"], bounds).array, readTensorDiagonal(paths["dti"], bounds).array)
+
+            estimator = ROIEstimator("median")
+            expected = calculateDTIALPSFromFiles(paths["dti"], paths["proj"], paths["assoc"], estimator=estimator)
+            for path in [paths["diagonal"], paths["compressed"]]:
+                for lazyLoading in [False, True]:
+                    self.assertAlmostEqual(calculateDTIALPSFromFiles(path, paths["proj"], paths["assoc"], lazyLoading=lazyLoading,
+                                                                     estimator=estimator), expected, places=9)
+
+            # The tensor axes projection and the FA exclusion need the full tensors
+            with self.assertRaises(ValueError):
+                calculateDTIALPSFromFiles(paths["diagonal"], paths["proj"], paths["assoc"], lazyLoading=True, tensorAxes="ras")
+            with self.assertRaises(ValueError):
+                calculateDTIALPSFromFiles(paths["diagonal"], paths["proj"], paths["assoc"], estimator=ROIEstimator(minFA=0.2))
+
+            # Exported from a DTI volume node
+            inputDTI = slicer.util.addVolumeFromArray(dti_vol, synthetic.ijkToRAS, "SyntheticDTI", "vtkMRMLDiffusionTensorVolumeNode")
+            DTI_ALPSLogic().exportTensorDiagonal(inputDTI, paths["diagonal"])
+            self.assertAlmostEqual(calculateDTIALPSFromFiles(paths["diagonal"], paths["proj"], paths["assoc"]), synthetic.expected, places=5)
+
+        self.delayDisplay('Test passed')
+
+    def test_longitudinal(self):
+        """ The sessions reduced together must give the indices of the sessions processed one at a time, and their change.
+        """
+        self.delayDisplay("Starting the longitudinal test")
+
+        import tempfile
+        from DTI_ALPSLib import (ROIEstimator, calculateDTIALPSFromFiles, calculateDTIALPSSessions, calculateDTIALPSSessionsFromFiles,
+                                 longitudinalChange, syntheticDTI, writeNRRD)
+
+        synthetic = syntheticDTI((20, 24, 22))
+        # The projection Dxx drops by 5% at each session
+        sessions = []
+        for number in range(3):
+            dti_vol = synthetic.array.astype(np.float32)
+            dti_vol[..., 0, 0] *= 1.0-0.05*number
+            sessions.append(dti_vol)
+        projROI, assocROI = synthetic.projArray != 0, synthetic.assocArray != 0
+        expected = [DTI_ALPSLogic().calculateDTIALPSFromROIs(dti_vol, projROI, assocROI) for dti_vol in sessions]
+
+        profiles = [ProcessingProfile() for _ in sessions]
+        indices = calculateDTIALPSSessions(sessions, projROI, assocROI, sessionProfiles=profiles)
+        np.testing.assert_allclose(indices, expected, rtol=1e-12)
+        diagonals = [np.diagonal(dti_vol, axis1=3, axis2=4) for dti_vol in sessions]
+        np.testing.assert_allclose(calculateDTIALPSSessions(diagonals, np.flatnonzero(projROI), np.flatnonzero(assocROI)), expected,
+                                   rtol=1e-12)
+        self.assertEqual(profiles[1].counts["projVoxels"], np.count_nonzero(projROI))
+        self.assertAlmostEqual(profiles[1].measures["projDxx"], float(np.mean(sessions[1][..., 0, 0][projROI], dtype=np.float64)))
+        estimator = ROIEstimator("median")
+        np.testing.assert_allclose(calculateDTIALPSSessions(sessions, projROI, assocROI, estimator=estimator),
+                                   [DTI_ALPSLogic().calculateDTIALPSFromROIs(dti_vol, projROI, assocROI, estimator=estimator)
+                                    for dti_vol in sessions], rtol=1e-12)
+        with self.assertRaises(ValueError):
+            calculateDTIALPSSessions([sessions[0], sessions[1][1:]], projROI, assocROI)
+
+        # Change metrics, sorted by session time and ignoring the failed sessions
+        change = longitudinalChange([expected[2], expected[0], np.nan, expected[1]], [4.0, 0.0, 1.0, 2.0])
+        self.assertEqual(change["sessions"], 3)
+        self.assertAlmostEqual(change["baseline_alps"], expected[0])
+        self.assertAlmostEqual(change["alps_change"], expected[2]-expected[0])
+        self.assertAlmostEqual(change["alps_percent_change"], 100.0*(expected[2]-expected[0])/expected[0])
+        self.assertAlmostEqual(change["alps_slope"], np.polyfit([0.0, 2.0, 4.0], expected, 1)[0])
+        self.assertEqual(change["time_span"], 4.0)
+        self.assertTrue(np.isnan(longitudinalChange(expected[:1])["alps_slope"]))
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = [os.path.join(tempDir, f"ses-{number}.nrrd") for number in range(len(sessions))]
+            for path, dti_vol in zip(paths, sessions):
+                writeNRRD(path, dti_vol, synthetic.ijkToRAS)
+            projPath, assocPath = os.path.join(tempDir, "proj.nrrd"), os.path.join(tempDir, "assoc.nrrd")
+            writeNRRD(projPath, synthetic.projArray, synthetic.ijkToRAS)
+            writeNRRD(assocPath, synthetic.assocArray, synthetic.ijkToRAS)
+
+            for lazyLoading in [False, True]:
+                for tensorAxes in ["tensor", "ras"]:
+                    profile = ProcessingProfile()
+                    indices = calculateDTIALPSSessionsFromFiles(paths, projPath, assocPath, lazyLoading=lazyLoading, profile=profile,
+                                                                tensorAxes=tensorAxes)
+                    np.testing.assert_allclose(indices, [calculateDTIALPSFromFiles(path, projPath, assocPath, lazyLoading=lazyLoading,
+                                                                                   tensorAxes=tensorAxes) for path in paths], rtol=1e-9)
+                    # The labels are read and checked once, the sessions are reduced together
+                    stageNames = [stage["name"] for stage in profile.stages]
+                    self.assertEqual((stageNames.count("readLabels"), stageNames.count("checkLabelSpace")), (1, 1))
+                    self.assertEqual((stageNames.count("readDTI"), stageNames.count("reduction")), (3, 1))
+
+            # A session outside the label space is rejected
+            shiftedIJKToRAS = synthetic.ijkToRAS.copy()
+            shiftedIJKToRAS[:3, 3] += 10.0
+            writeNRRD(paths[2], sessions[2], shiftedIJKToRAS)
+            with self.assertRaises(ValueError):
+                calculateDTIALPSSessionsFromFiles(paths, projPath, assocPath)
+
+        # Session volumes of the scene
+        inputDTIs = [slicer.util.addVolumeFromArray(dti_vol, synthetic.ijkToRAS, f"Session{number}", "vtkMRMLDiffusionTensorVolumeNode")
+                     for number, dti_vol in enumerate(sessions)]
+        inputProjLabel = slicer.util.addVolumeFromArray(synthetic.projArray, synthetic.ijkToRAS, "SessionProj", "vtkMRMLLabelMapVolumeNode")
+        inputAssocLabel = slicer.util.addVolumeFromArray(synthetic.assocArray, synthetic.ijkToRAS, "SessionAssoc", "vtkMRMLLabelMapVolumeNode")
+        indices, change = DTI_ALPSLogic().processSessions(inputDTIs, inputProjLabel, inputAssocLabel, times=[0.0, 1.0, 2.0])
+        np.testing.assert_allclose(indices, expected, rtol=1e-6)
+        self.assertAlmostEqual(change["alps_change"], expected[2]-expected[0], places=6)
 
         self.delayDisplay('Test passed')
@@ -0,0 +1,117 @@
+"""
+Core DTI-ALPS computation, importable without the Slicer application.
+The DTI_ALPS Slicer module and the runDTIALPS.py script are thin wrappers around this package.
+"""
+
+from .alps import (
+    DIAGONAL_COMPONENTS,
+    alpsIndex,
+    calculateDTIALPS,
+    calculateDTIALPSFromROIs,
+    calculateDTIALPSMultiROI,
+    checkMNISpace,
+    combineLabelStats,
+    cropROI,
+    defaultROIPairs,
+    isVoxelIndices,
+    parseROIPairs,
+    reduceLabelDiagonal,
+    reduceROIDiagonal,
+    roiBounds,
+    roiVoxelIndices,
+    spaceMismatches,
+)
+from .bootstrap import (
+    BOOTSTRAP_CHUNK_BYTES,
+    BOOTSTRAP_MEASURES,
+    DEFAULT_CONFIDENCE,
+    DEFAULT_REPLICATES,
+    ALPSBootstrap,
+    BootstrapInterval,
+    bootstrapDTIALPS,
+)
+from .cache import ResultCache
+from .longitudinal import CHANGE_FIELDS, calculateDTIALPSSessions, longitudinalChange, reduceSessionsDiagonal
+from .maps import MAP_NAMES, calculateALPSMaps, defaultMapSlices, ratioMapSlabs
+from .mni import (
+    MNI_ASSOCIATION_LABEL,
+    MNI_HEMISPHERE_PAIRS,
+    MNI_LABELS_DIR,
+    MNI_PROJECTION_LABEL,
+    MNI_ROI_INDEX_VERSION,
+    MNIROIIndex,
+    loadMNIROIIndex,
+    mniHemisphereLabels,
+    mniLabelPath,
+    mniSpaceMismatches,
+    readMNILabels,
+)
+from .orientation import TENSOR_AXES, nearestImageAxes, orientROITensors, tensorAxesMatrix
+from .pipeline import (
+    calculateDTIALPSFromDWI,
+    calculateDTIALPSFromFiles,
+    calculateDTIALPSMultiROIFromFiles,
+    calculateDTIALPSSessionsFromFiles,
+    readDTIALPSInputs,
+    writeALPSMapsFromFiles,
+)
+from .prefetch import DEFAULT_PREFETCH_BYTES, DEFAULT_PREFETCH_DEPTH, Prefetcher
+from .profiling import ProcessingCancelled, ProcessingProfile, peakRSSBytes
+from .results import (
+    RESULT_FIELDS,
+    RESULT_FORMATS,
+    RESULT_TEXT_FIELDS,
+    ResultSink,
+    latestRecords,
+    readResultRecords,
+    resultFormat,
+    resultRecord,
+)
+from .robust import ESTIMATOR_METHODS, MAD_SCALE, ROIEstimator, diffusionMeasures
+from .service import DEFAULT_SERVICE_HOST, DEFAULT_SERVICE_PORT, JOB_DEFAULTS, ALPSJob, ALPSService
+from .synthetic import SYNTHETIC_SHAPES, SyntheticDTI, syntheticDTI, syntheticDWI
+from .tasks import (
+    TASK_CANCELLED,
+    TASK_DONE,
+    TASK_FAILED,
+    TASK_FINISHED_STATUSES,
+    TASK_QUEUED,
+    TASK_RUNNING,
+    ProcessingTask,
+    TaskQueue,
+)
+from .tensorfit import (
+    GradientTable,
+    fitROITensorDiagonal,
+    fitTensors,
+    nrrdGradientKeyValues,
+    readDWIHeader,
+    readFSLGradients,
+    readGradientTable,
+    readNRRDGradients,
+)
+from .volumeio import (
+    TENSOR_DIAGONAL_KIND,
+    NRRDSlabWriter,
+    Volume,
+    VolumeHeader,
+    iterTensorDiagonalSlabs,
+    iterVolumeComponentSlabs,
+    readNIfTI,
+    readNRRD,
+    readTensorDiagonal,
+    readTensors,
+    readVolume,
+    readVolumeComponents,
+    readVolumeHeader,
+    writeNRRD,
+    writeTensorDiagonal,
+)
+from .warp import (
+    MNITransform,
+    affineMNITransform,
+    displacementFieldMNITransform,
+    readITKAffineTransform,
+    readMNITransform,
+    warpMNILabels,
+)
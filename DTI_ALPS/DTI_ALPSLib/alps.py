@@ -0,0 +1,354 @@
+"""
+DTI-ALPS index calculation on plain numpy arrays.
+
+All the arrays follow the slicer.util.arrayFromVolume axis order, i.e. the scalar volumes are
+(K, J, I) and the tensor volumes are (K, J, I, 3, 3).
+"""
+
+import numpy as np
+
+from .profiling import ProcessingProfile
+
+
+# Position of the tensor diagonal components in the 3x3 tensor matrix
+DIAGONAL_COMPONENTS = {
+    "Dxx": 0,
+    "Dyy": 1,
+    "Dzz": 2,
+}
+
+
+def isVoxelIndices(roi):
+    """
+    True for a ROI given as flat voxel indices (1-D integer array), False for a mask or label array (any nonzero voxel
+    being part of the ROI).
+    """
+    roi = np.asarray(roi)
+    return roi.ndim == 1 and np.issubdtype(roi.dtype, np.integer)
+
+
+def _roiMask(shape, roi):
+    if roi.shape != tuple(shape):
+        raise ValueError(f"ROI shape {roi.shape} does not match the DTI image shape {tuple(shape)}")
+    return roi if roi.dtype == bool else roi != 0
+
+
+def roiVoxelIndices(shape, roi):
+    """
+    Flat voxel indices of a ROI given as a boolean mask or label array with the image shape (K, J, I), any nonzero voxel
+    being part of the ROI, or as flat voxel indices (1-D integer array).
+    """
+    roi = np.asarray(roi)
+    if isVoxelIndices(roi):
+        indices = roi.astype(np.intp, copy=False)
+    else:
+        indices = np.flatnonzero(_roiMask(shape, roi))
+
+    if indices.size == 0:
+        raise ValueError("ROI is empty, the DTI-ALPS index can not be calculated")
+    return indices
+
+
+def reduceROIDiagonal(dtiArray, roi, components=("Dxx", "Dyy", "Dzz")):
+    """
+    Sum, count and mean of the tensor diagonal components inside a ROI, in one vectorized pass.
+    Only the requested diagonal entries are gathered, the full 3x3 tensors are never copied.
+    :param dtiArray: Tensor array with shape (K, J, I, 3, 3), or tensor diagonal array with shape (K, J, I, 3)
+    :param roi: Boolean mask with shape (K, J, I) or flat voxel indices into the (K, J, I) grid
+    :param components: Diagonal component names to be reduced (Dxx, Dyy and/or Dzz)
+    :return: dict mapping each component to {"diff_value": sum, "points": count, "mean": mean}
+    """
+    indices = roiVoxelIndices(dtiArray.shape[:3], roi)
+
+    # Flat (voxels, 3) view of the diagonal or (voxels, 3, 3) view of the tensor array, no copy for C-contiguous arrays
+    isDiagonal = dtiArray.ndim == 4
+    tensors = dtiArray.reshape(-1, 3) if isDiagonal else dtiArray.reshape(-1, 3, 3)
+
+    stats = {}
+    for component in components:
+        axis = DIAGONAL_COMPONENTS[component]
+        values = tensors[indices, axis] if isDiagonal else tensors[indices, axis, axis]
+        # Accumulate in double precision to avoid drifting on large ROIs
+        diff_value = float(np.add.reduce(values, dtype=np.float64))
+        stats[component] = {
+            "diff_value": diff_value,
+            "points": int(indices.size),
+            "mean": diff_value/indices.size
+        }
+
+    return stats
+
+
+def alpsIndex(projStats, assocStats, statistic="mean"):
+    """
+    DTI-ALPS index from the per-ROI diagonal statistics given by reduceROIDiagonal.
+    :param statistic: Statistic used for each component, e.g. estimate for the DTI_ALPSLib.robust.ROIEstimator statistics
+    """
+    mean_numerator = (projStats["Dxx"][statistic]+assocStats["Dxx"][statistic])/2.0
+    mean_denominator = (projStats["Dyy"][statistic]+assocStats["Dzz"][statistic])/2.0
+
+    return mean_numerator/mean_denominator
+
+
+def calculateDTIALPS(dtiArray, projArray, assocArray, profile=None, estimator=None):
+    """
+    DTI-ALPS index: mean(Dxx-proj, Dxx-assoc)/mean(Dyy-proj, Dzz-assoc)
+    Any nonzero voxel in the label arrays is part of the ROI.
+    Recall that the diffusion tensor ir represented as:
+    D = [ Dxx Dxy Dxz
+          Dyx Dyy Dyz
+          Dzx Dzy Dzz ]
+    :param dtiArray: Tensor array with shape (K, J, I, 3, 3)
+    :param projArray: Label array that defines the Projection area
+    :param assocArray: Label array that defines the Association area
+    :param profile: ProcessingProfile where the reduction stage is recorded
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given
+    """
+    return calculateDTIALPSFromROIs(dtiArray, projArray != 0, assocArray != 0, profile, estimator)
+
+
+def calculateDTIALPSFromROIs(dtiArray, projROI, assocROI, profile=None, estimator=None):
+    """
+    DTI-ALPS index from the Projection and Association ROIs given as boolean masks or flat voxel indices.
+    :param profile: ProcessingProfile where the reduction stage, the ROI voxel counts and the ROI means
+                    (projDxx, projDyy, assocDxx and assocDzz measures) are recorded. With an estimator, the ROI estimates,
+                    their standard deviations (projDxxSD, ...) and the excluded voxel counts (projExcluded, assocExcluded) are recorded
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given
+    """
+    profile = profile or ProcessingProfile()
+    with profile.stage("reduction"):
+        if estimator is None:
+            proj_stats = reduceROIDiagonal(dtiArray, projROI, ("Dxx", "Dyy"))
+            assoc_stats = reduceROIDiagonal(dtiArray, assocROI, ("Dxx", "Dzz"))
+        else:
+            proj_stats = estimator.reduce(dtiArray, projROI, ("Dxx", "Dyy"))
+            assoc_stats = estimator.reduce(dtiArray, assocROI, ("Dxx", "Dzz"))
+    statistic = "mean" if estimator is None else "estimate"
+    for roi, stats in (("proj", proj_stats), ("assoc", assoc_stats)):
+        profile.count(roi+"Voxels", stats["Dxx"]["points"])
+        if estimator is not None:
+            profile.count(roi+"Excluded", stats["Dxx"]["excluded"])
+        for component, values in stats.items():
+            profile.measure(roi+component, values[statistic])
+            if estimator is not None:
+                profile.measure(roi+component+"SD", values["sd"])
+
+    return alpsIndex(proj_stats, assoc_stats, statistic)
+
+
+def reduceLabelDiagonal(dtiArray, labelArray, components=("Dxx", "Dyy", "Dzz")):
+    """
+    Sum, count and mean of the tensor diagonal components for every nonzero label value of a multi-valued label map.
+    The labelled voxels are gathered once and grouped by label value with a bincount reduction.
+    :param dtiArray: Tensor array with shape (K, J, I, 3, 3), or tensor diagonal array with shape (K, J, I, 3)
+    :param labelArray: Integer label map with shape (K, J, I)
+    :return: dict mapping each label value to the reduceROIDiagonal statistics of its voxels
+    """
+    labelArray = np.asarray(labelArray)
+    if labelArray.shape != dtiArray.shape[:3]:
+        raise ValueError(f"Label shape {labelArray.shape} does not match the DTI image shape {dtiArray.shape[:3]}")
+
+    indices = np.flatnonzero(labelArray)
+    if indices.size == 0:
+        raise ValueError("ROI is empty, the DTI-ALPS index can not be calculated")
+
+    labels, groups = np.unique(labelArray.ravel()[indices], return_inverse=True)
+    points = np.bincount(groups, minlength=labels.size)
+
+    isDiagonal = dtiArray.ndim == 4
+    tensors = dtiArray.reshape(-1, 3) if isDiagonal else dtiArray.reshape(-1, 3, 3)
+
+    sums = {}
+    for component in components:
+        axis = DIAGONAL_COMPONENTS[component]
+        values = tensors[indices, axis] if isDiagonal else tensors[indices, axis, axis]
+        sums[component] = np.bincount(groups, weights=values.astype(np.float64), minlength=labels.size)
+
+    stats = {}
+    for group, label in enumerate(labels.tolist()):
+        stats[label] = {
+            component: {
+                "diff_value": float(sums[component][group]),
+                "points": int(points[group]),
+                "mean": float(sums[component][group])/points[group]
+            }
+            for component in components
+        }
+
+    return stats
+
+
+def combineLabelStats(labelStats, labels):
+    """
+    Merge the reduceLabelDiagonal statistics of several label values (e.g. left and right for a bilateral ROI).
+    """
+    labels = [labels] if np.isscalar(labels) else list(labels)
+    missing = [label for label in labels if label not in labelStats]
+    if missing:
+        raise ValueError(f"Label values {missing} are not present in the label map")
+
+    stats = {}
+    for component in labelStats[labels[0]]:
+        diff_value = sum(labelStats[label][component]["diff_value"] for label in labels)
+        points = sum(labelStats[label][component]["points"] for label in labels)
+        stats[component] = {
+            "diff_value": diff_value,
+            "points": points,
+            "mean": diff_value/points
+        }
+
+    return stats
+
+
+def defaultROIPairs(projLabels, assocLabels):
+    """
+    One ROI pair for each label value present in both label maps, plus all the labels together when there are several.
+    """
+    pairs = [(str(label), label, label) for label in sorted(set(projLabels) & set(assocLabels))]
+    if len(pairs) != 1:
+        pairs.append(("all", sorted(projLabels), sorted(assocLabels)))
+    return pairs
+
+
+def parseROIPairs(texts):
+    """
+    Parse ROI pairs given as NAME=PROJ:ASSOC, where several label values are joined by + (e.g. bilateral=1+2:1+2).
+    """
+    pairs = []
+    for text in texts:
+        name, _, labels = text.partition("=")
+        proj, _, assoc = labels.partition(":")
+        if not name or not proj or not assoc:
+            raise ValueError(f"Invalid ROI pair '{text}', the expected format is NAME=PROJ:ASSOC (e.g. left=1:1 or bilateral=1+2:1+2)")
+        pairs.append((name, [int(label) for label in proj.split("+")], [int(label) for label in assoc.split("+")]))
+    return pairs
+
+
+def calculateDTIALPSMultiROI(dtiArray, projArray, assocArray, roiPairs=None, profile=None, estimator=None):
+    """
+    DTI-ALPS indices for several ROI definitions (e.g. left, right and bilateral) in a single pass.
+    :param dtiArray: Tensor array with shape (K, J, I, 3, 3), or tensor diagonal array with shape (K, J, I, 3)
+    :param projArray: Multi-valued label map that defines the Projection areas
+    :param assocArray: Multi-valued label map that defines the Association areas
+    :param roiPairs: List of (name, projection label values, association label values), see defaultROIPairs if not given
+    :param profile: ProcessingProfile where the reduction stage and the ROI voxel counts are recorded
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given. Robust statistics
+                      can not be merged across label values, thus the voxels of each ROI pair are reduced separately
+    :return: dict mapping each ROI pair name to its DTI-ALPS index
+    """
+    profile = profile or ProcessingProfile()
+    if estimator is not None:
+        return _calculateDTIALPSMultiROIEstimator(dtiArray, projArray, assocArray, roiPairs, profile, estimator)
+
+    with profile.stage("reduction"):
+        proj_stats = reduceLabelDiagonal(dtiArray, projArray, ("Dxx", "Dyy"))
+        assoc_stats = reduceLabelDiagonal(dtiArray, assocArray, ("Dxx", "Dzz"))
+    profile.count("projVoxels", sum(stats["Dxx"]["points"] for stats in proj_stats.values()))
+    profile.count("assocVoxels", sum(stats["Dxx"]["points"] for stats in assoc_stats.values()))
+
+    if roiPairs is None:
+        roiPairs = defaultROIPairs(proj_stats, assoc_stats)
+
+    return {name: alpsIndex(combineLabelStats(proj_stats, projLabels), combineLabelStats(assoc_stats, assocLabels))
+            for name, projLabels, assocLabels in roiPairs}
+
+
+def _calculateDTIALPSMultiROIEstimator(dtiArray, projArray, assocArray, roiPairs, profile, estimator):
+    for labelArray in (projArray, assocArray):
+        if labelArray.shape != dtiArray.shape[:3]:
+            raise ValueError(f"Label shape {labelArray.shape} does not match the DTI image shape {dtiArray.shape[:3]}")
+
+    def pairROI(labelArray, presentLabels, labels):
+        labels = [labels] if np.isscalar(labels) else list(labels)
+        missing = [label for label in labels if label not in presentLabels]
+        if missing:
+            raise ValueError(f"Label values {missing} are not present in the label map")
+        return np.isin(labelArray, labels)
+
+    with profile.stage("reduction"):
+        projLabels = np.unique(projArray[projArray != 0]).tolist()
+        assocLabels = np.unique(assocArray[assocArray != 0]).tolist()
+        if roiPairs is None:
+            roiPairs = defaultROIPairs(projLabels, assocLabels)
+
+        indices = {}
+        for name, projPairLabels, assocPairLabels in roiPairs:
+            proj_stats = estimator.reduce(dtiArray, pairROI(projArray, projLabels, projPairLabels), ("Dxx", "Dyy"))
+            assoc_stats = estimator.reduce(dtiArray, pairROI(assocArray, assocLabels, assocPairLabels), ("Dxx", "Dzz"))
+            indices[name] = alpsIndex(proj_stats, assoc_stats, "estimate")
+    profile.count("projVoxels", int(np.count_nonzero(projArray)))
+    profile.count("assocVoxels", int(np.count_nonzero(assocArray)))
+
+    return indices
+
+
+def roiBounds(shape, *rois):
+    """
+    Voxel bounding box covering all the ROIs (masks, label arrays or flat voxel indices into the shape grid).
+    :return: ((k0, k1), (j0, j1), (i0, i1)) voxel ranges
+    """
+    lower = np.array(shape)
+    upper = np.zeros(3, dtype=int)
+    for roi in rois:
+        roi = np.asarray(roi)
+        points = np.unravel_index(roi, shape) if isVoxelIndices(roi) else np.nonzero(_roiMask(shape, roi))
+        if points[0].size == 0:
+            raise ValueError("ROI is empty, the DTI-ALPS index can not be calculated")
+        lower = np.minimum(lower, [axis.min() for axis in points])
+        upper = np.maximum(upper, [axis.max()+1 for axis in points])
+
+    return tuple((int(start), int(stop)) for start, stop in zip(lower, upper))
+
+
+def cropROI(roi, shape, bounds):
+    """
+    Flat voxel indices of a ROI (mask, label array or flat voxel indices into the shape grid) in the bounding box grid.
+    """
+    roi = np.asarray(roi)
+    points = np.unravel_index(roi, shape) if isVoxelIndices(roi) else np.nonzero(_roiMask(shape, roi))
+    starts = [start for start, _ in bounds]
+    sizes = [stop-start for start, stop in bounds]
+
+    return np.ravel_multi_index(tuple(axis-start for axis, start in zip(points, starts)), sizes)
+
+
+def checkMNISpace(dtiShape, referenceShape):
+    """
+    Compare the image size to ensure the same image space.
+    DTI has a 3x3 matrix at the final part, thus only the first 3 dimensions are compared.
+    """
+    return tuple(dtiShape[:3]) == tuple(referenceShape[:3])
+
+
+# Tolerances (mm) of the image space comparison. The origin may differ by less than half a 2 mm voxel,
+# which is the rounding found between MNI 2 mm template releases.
+SPACING_TOLERANCE = 1e-3
+DIRECTION_TOLERANCE = 1e-3
+ORIGIN_TOLERANCE = 1.0
+
+
+def spaceMismatches(dtiShape, dtiIJKToRAS, referenceShape, referenceIJKToRAS):
+    """
+    Compare the image grid (dimensions, spacing, axis directions and origin) with a reference image space,
+    using the image headers only.
+    :param dtiShape: Image shape (K, J, I), the tensor dimensions are ignored
+    :param dtiIJKToRAS: 4x4 IJK to RAS matrix of the image, only the dimensions are compared if None
+    :return: list describing each mismatch, empty if the image is in the reference space
+    """
+    mismatches = []
+    if not checkMNISpace(dtiShape, referenceShape):
+        mismatches.append(f"dimensions {tuple(dtiShape[:3])[::-1]} instead of {tuple(referenceShape[:3])[::-1]} (IJK)")
+    if dtiIJKToRAS is None or referenceIJKToRAS is None:
+        return mismatches
+
+    dtiIJKToRAS, referenceIJKToRAS = np.asarray(dtiIJKToRAS, dtype=float), np.asarray(referenceIJKToRAS, dtype=float)
+    spacing, referenceSpacing = np.linalg.norm(dtiIJKToRAS[:3, :3], axis=0), np.linalg.norm(referenceIJKToRAS[:3, :3], axis=0)
+    if not np.allclose(spacing, referenceSpacing, rtol=0.0, atol=SPACING_TOLERANCE):
+        mismatches.append(f"spacing {(np.round(spacing, 4)+0.0).tolist()} mm instead of {(np.round(referenceSpacing, 4)+0.0).tolist()} mm")
+    elif not np.allclose(dtiIJKToRAS[:3, :3]/spacing, referenceIJKToRAS[:3, :3]/referenceSpacing, rtol=0.0, atol=DIRECTION_TOLERANCE):
+        mismatches.append(f"IJK to RAS directions {(np.round(dtiIJKToRAS[:3, :3]/spacing, 4)+0.0).tolist()} "
+                          f"instead of {(np.round(referenceIJKToRAS[:3, :3]/referenceSpacing, 4)+0.0).tolist()}")
+    if not np.allclose(dtiIJKToRAS[:3, 3], referenceIJKToRAS[:3, 3], rtol=0.0, atol=ORIGIN_TOLERANCE):
+        mismatches.append(f"origin {(np.round(dtiIJKToRAS[:3, 3], 3)+0.0).tolist()} mm instead of {(np.round(referenceIJKToRAS[:3, 3], 3)+0.0).tolist()} mm (RAS)")
+
+    return mismatches
@@ -0,0 +1,164 @@
+"""
+Bootstrap confidence intervals of the DTI-ALPS index, by resampling the ROI voxels.
+
+The Projection and Association voxels are resampled independently (with replacement, keeping the ROI sizes), and
+the index is recalculated for each replicate. The replicates are drawn in chunks of whole-array operations, each chunk
+gathering a (replicates, voxels, components) batch of resampled values that is reduced at once (sorted first for the
+robust estimates, see DTI_ALPSLib.robust). Each chunk has its own seed spawned from the bootstrap seed, thus the
+replicates do not depend on the number of processes used.
+"""
+
+import concurrent.futures
+
+import numpy as np
+
+from .alps import DIAGONAL_COMPONENTS, roiVoxelIndices
+from .profiling import ProcessingProfile
+
+
+DEFAULT_REPLICATES = 2000
+DEFAULT_CONFIDENCE = 0.95
+
+# Profile measures of the confidence interval recorded by bootstrapDTIALPS
+BOOTSTRAP_MEASURES = ("dtiAlpsLower", "dtiAlpsUpper", "dtiAlpsSE")
+
+# Memory bound of the resampled values of a chunk of replicates
+BOOTSTRAP_CHUNK_BYTES = 32*1024*1024
+
+
+def _roiDiagonalValues(dtiArray, roi, components):
+    indices = roiVoxelIndices(dtiArray.shape[:3], roi)
+    tensors = dtiArray.reshape(-1, 3) if dtiArray.ndim == 4 else np.diagonal(dtiArray.reshape(-1, 3, 3), axis1=1, axis2=2)
+    return tensors[indices][:, [DIAGONAL_COMPONENTS[component] for component in components]].astype(np.float64)
+
+
+def _resampledEstimates(values, replicates, rng, estimator):
+    """
+    Location estimates (replicates, components) of the ROI values (voxels, components) resampled with replacement.
+    """
+    points = values.shape[0]
+    samples = values[rng.integers(0, points, size=(replicates, points))]
+    if estimator is None or estimator.method == "mean":
+        return samples.mean(axis=1)
+    return estimator.locate(np.sort(samples, axis=1), axis=1)
+
+
+def _bootstrapChunk(projValues, assocValues, replicates, seedSequence, estimator):
+    rng = np.random.default_rng(seedSequence)
+    proj = _resampledEstimates(projValues, replicates, rng, estimator)
+    assoc = _resampledEstimates(assocValues, replicates, rng, estimator)
+    return (proj[:, 0]+assoc[:, 0])/(proj[:, 1]+assoc[:, 1])
+
+
+class BootstrapInterval:
+    """
+    Bootstrap percentile confidence interval of the DTI-ALPS index.
+
+    index - DTI-ALPS index of the original ROI voxels
+    lower, upper - Confidence interval bounds
+    standardError - Standard deviation of the replicates
+    confidence - Confidence level of the interval
+    replicates - Number of bootstrap replicates
+    """
+
+    def __init__(self, index, lower, upper, standardError, confidence, replicates):
+        self.index = index
+        self.lower = lower
+        self.upper = upper
+        self.standardError = standardError
+        self.confidence = confidence
+        self.replicates = replicates
+
+    def toDict(self):
+        return {"index": self.index, "lower": self.lower, "upper": self.upper, "standardError": self.standardError,
+                "confidence": self.confidence, "replicates": self.replicates}
+
+
+class ALPSBootstrap:
+    """
+    Bootstrap resampling of the ROI voxels for the confidence interval of the DTI-ALPS index.
+
+    replicates - Number of bootstrap replicates
+    confidence - Confidence level of the percentile interval
+    seed - Seed of the replicates, the same seed always gives the same interval
+    processes - Number of worker processes sharing the chunks of replicates (1 to resample in the calling process).
+                The processes are started with the current Python interpreter, thus from plain Python scripts only
+    """
+
+    def __init__(self, replicates=DEFAULT_REPLICATES, confidence=DEFAULT_CONFIDENCE, seed=0, processes=1):
+        if replicates < 2:
+            raise ValueError(f"At least 2 bootstrap replicates are required, {replicates} given")
+        if not 0.0 < confidence < 1.0:
+            raise ValueError(f"Confidence level {confidence} must be in (0, 1)")
+        self.replicates = int(replicates)
+        self.confidence = float(confidence)
+        self.seed = seed
+        self.processes = max(1, int(processes or 1))
+
+    @property
+    def parameters(self):
+        """
+        Bootstrap parameters (JSON serializable), e.g. for the result cache key. The processes do not change the result.
+        """
+        return {"replicates": self.replicates, "confidence": self.confidence, "seed": self.seed}
+
+    def chunkReplicates(self, points):
+        """
+        Replicates per chunk, so that the resampled values of a chunk stay around BOOTSTRAP_CHUNK_BYTES.
+        """
+        return max(1, min(self.replicates, BOOTSTRAP_CHUNK_BYTES//(max(points, 1)*3*8)))
+
+    def interval(self, projValues, assocValues, estimator=None):
+        """
+        Confidence interval of the DTI-ALPS index from the ROI values.
+        :param projValues: Dxx and Dyy of the Projection voxels with shape (voxels, 2)
+        :param assocValues: Dxx and Dzz of the Association voxels with shape (voxels, 2)
+        :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator) applied to each replicate, ROI means if not given
+        """
+        chunkSize = self.chunkReplicates(max(projValues.shape[0], assocValues.shape[0]))
+        sizes = [min(chunkSize, self.replicates-start) for start in range(0, self.replicates, chunkSize)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(sizes))
+        arguments = [(projValues, assocValues, size, seed, estimator) for size, seed in zip(sizes, seeds)]
+
+        if self.processes > 1 and len(sizes) > 1:
+            with concurrent.futures.ProcessPoolExecutor(min(self.processes, len(sizes))) as executor:
+                chunks = list(executor.map(_bootstrapChunk, *zip(*arguments)))
+        else:
+            chunks = [_bootstrapChunk(*chunkArguments) for chunkArguments in arguments]
+        indices = np.concatenate(chunks)
+
+        if estimator is None:
+            proj, assoc = projValues.mean(axis=0), assocValues.mean(axis=0)
+        else:
+            proj, assoc = estimator.locate(np.sort(projValues, axis=0)), estimator.locate(np.sort(assocValues, axis=0))
+        lower, upper = np.quantile(indices, [(1.0-self.confidence)/2.0, (1.0+self.confidence)/2.0])
+        return BootstrapInterval(float((proj[0]+assoc[0])/(proj[1]+assoc[1])), float(lower), float(upper),
+                                 float(indices.std(ddof=1)), self.confidence, self.replicates)
+
+
+def bootstrapDTIALPS(dtiArray, projROI, assocROI, bootstrap=None, estimator=None, profile=None):
+    """
+    Bootstrap confidence interval of the DTI-ALPS index from the Projection and Association ROIs.
+    :param dtiArray: Tensor array with shape (K, J, I, 3, 3), or tensor diagonal array with shape (K, J, I, 3)
+    :param projROI, assocROI: Boolean masks or flat voxel indices of the ROIs
+    :param bootstrap: ALPSBootstrap parameters, the defaults if not given
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), the excluded voxels are removed before resampling
+    :param profile: ProcessingProfile where the bootstrap stage and the interval measures (dtiAlpsLower, dtiAlpsUpper,
+                    dtiAlpsSE) are recorded
+    :return: BootstrapInterval
+    """
+    bootstrap = bootstrap or ALPSBootstrap()
+    profile = profile or ProcessingProfile()
+    with profile.stage("bootstrap"):
+        if estimator is None:
+            projValues = _roiDiagonalValues(dtiArray, projROI, ("Dxx", "Dyy"))
+            assocValues = _roiDiagonalValues(dtiArray, assocROI, ("Dxx", "Dzz"))
+        else:
+            projValues = estimator.roiValues(dtiArray, projROI, ("Dxx", "Dyy"))[0]
+            assocValues = estimator.roiValues(dtiArray, assocROI, ("Dxx", "Dzz"))[0]
+        interval = bootstrap.interval(projValues, assocValues, estimator)
+    profile.measure("dtiAlpsLower", interval.lower)
+    profile.measure("dtiAlpsUpper", interval.upper)
+    profile.measure("dtiAlpsSE", interval.standardError)
+
+    return interval
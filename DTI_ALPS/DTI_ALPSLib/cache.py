@@ -0,0 +1,215 @@
+"""
+Content-addressed on-disk cache of DTI-ALPS results.
+
+Results are keyed on the SHA-256 of the input files (or the MNI ROI index version for the standard MNI labels)
+and of the calculation parameters, so that unchanged subjects are not recalculated. File hashes are memoized
+by path, size and modification time, thus an unchanged subject is resolved without reading its images.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from .mni import MNI_ROI_INDEX_VERSION
+from .volumeio import isNRRD, readNRRDVolumeHeader
+
+
+# Increase whenever the calculation changes in a way that invalidates previously cached results
+CACHE_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dti-alps")
+DEFAULT_CACHE_MAX_BYTES = 64*1024*1024
+
+HASH_CHUNK_BYTES = 8*1024*1024
+
+
+def _writeJSON(path, value):
+    # Write and rename, so that concurrent readers (e.g. batch workers) never see a partial entry
+    fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(value, f)
+    os.replace(tempPath, path)
+
+
+def _readJSON(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ResultCache:
+    """
+    On-disk DTI-ALPS result cache with size-bounded, least recently used eviction.
+
+    directory - Cache folder (DTI_ALPS_CACHE_DIR environment variable or ~/.cache/dti-alps by default)
+    maxBytes - Maximum size of the cached results, the least recently used results are evicted beyond it
+    """
+
+    def __init__(self, directory=None, maxBytes=DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory or os.environ.get("DTI_ALPS_CACHE_DIR") or DEFAULT_CACHE_DIR
+        self.maxBytes = maxBytes
+        self.resultsDir = os.path.join(self.directory, "results")
+        self.hashesDir = os.path.join(self.directory, "hashes")
+        os.makedirs(self.resultsDir, exist_ok=True)
+        os.makedirs(self.hashesDir, exist_ok=True)
+
+    def fileHash(self, path):
+        """
+        SHA-256 of a file content, memoized by path, size and modification time.
+        The detached data file of a NRRD header is hashed together with the header.
+        """
+        paths = [os.path.realpath(path)]
+        if isNRRD(path):
+            dataPath = os.path.realpath(readNRRDVolumeHeader(path).dataPath)
+            if dataPath != paths[0]:
+                paths.append(dataPath)
+
+        stats = [(os.stat(filePath).st_size, os.stat(filePath).st_mtime_ns) for filePath in paths]
+        memoPath = os.path.join(self.hashesDir, hashlib.sha1(paths[0].encode("utf-8")).hexdigest()+".json")
+        memo = _readJSON(memoPath)
+        if memo and memo.get("paths") == paths and [tuple(stat) for stat in memo.get("stats", [])] == stats:
+            return memo["sha256"]
+
+        digest = hashlib.sha256()
+        for filePath in paths:
+            with open(filePath, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                    digest.update(chunk)
+
+        _writeJSON(memoPath, {"paths": paths, "stats": stats, "sha256": digest.hexdigest()})
+        return digest.hexdigest()
+
+    def resultKey(self, dtiPath, projLabelPath=None, assocLabelPath=None, MNISpace=False, **parameters):
+        """
+        Cache key of a DTI-ALPS calculation.
+        :param parameters: Any other calculation parameter that changes the result (JSON serializable)
+        """
+        inputs = {
+            "version": CACHE_VERSION,
+            "dti": self.fileHash(dtiPath),
+            "MNISpace": bool(MNISpace),
+            "parameters": parameters,
+        }
+        if MNISpace or (projLabelPath is None and assocLabelPath is None):
+            # Standard MNI labels, in MNI space or warped to the native space (the transform is given in the parameters)
+            inputs["labels"] = f"MNI-ROI-index-v{MNI_ROI_INDEX_VERSION}"
+        else:
+            inputs["labels"] = [self.fileHash(projLabelPath), self.fileHash(assocLabelPath)]
+
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def calculationKey(self, dtiPath, projLabelPath=None, assocLabelPath=None, MNISpace=False, isDWI=False, fitRegion="roi",
+                       fitMethod="wls", gradientPaths=None, mniTransformPath=None, estimator=None, bootstrap=None, tensorAxes="tensor",
+                       multiROI=False, roiPairs=None):
+        """
+        Cache key of a DTI-ALPS calculation from its options, shared by the Slicer module, the scripts and the service so
+        that they reuse each other's results. Each option is only part of the key when it is not the default.
+        :param gradientPaths: DWI input only, gradient files (e.g. FSL bvals and bvecs) given apart from the DWI file
+        :param mniTransformPath: Subject to MNI transform warping the standard MNI labels, used in place of the label files
+        :param estimator: ROIEstimator, plain ROI means if None
+        :param bootstrap: ALPSBootstrap, no confidence interval if None
+        :param roiPairs: ROI pairs as given on the command line (e.g. ["left:1:1", ...])
+        """
+        parameters = {}
+        if isDWI:
+            parameters["DWI"] = {"fitRegion": fitRegion, "fitMethod": fitMethod}
+            gradients = [self.fileHash(path) for path in gradientPaths or [] if path]
+            if gradients:
+                parameters["DWI"]["gradients"] = gradients
+        if mniTransformPath:
+            parameters["MNITransform"] = self.fileHash(mniTransformPath)
+        if estimator is not None:
+            parameters["estimator"] = estimator.parameters
+        if bootstrap is not None:
+            parameters["bootstrap"] = bootstrap.parameters
+        if tensorAxes != "tensor":
+            parameters["tensorAxes"] = tensorAxes
+        if multiROI:
+            parameters["multiROI"] = True
+        if roiPairs:
+            parameters["roiPairs"] = list(roiPairs)
+
+        return self.resultKey(dtiPath, projLabelPath, assocLabelPath, MNISpace, **parameters)
+
+    def _resultPath(self, key):
+        return os.path.join(self.resultsDir, key+".json")
+
+    def get(self, key):
+        """
+        Cached result of the key, or None if it is not cached.
+        """
+        entry = _readJSON(self._resultPath(key))
+        if entry is None:
+            return None
+        # Mark as recently used for the eviction
+        try:
+            os.utime(self._resultPath(key))
+        except OSError:
+            pass
+        return entry["result"]
+
+    def put(self, key, result):
+        """
+        Cache a (JSON serializable) result and evict the least recently used results beyond maxBytes.
+        """
+        _writeJSON(self._resultPath(key), {"result": result})
+        self.evict()
+
+    def putResult(self, key, index, profile):
+        """
+        Cache a DTI-ALPS index along with the measures and counts of its ProcessingProfile (ROI means, voxel counts, bootstrap
+        confidence interval), so that the result table record of a cached result is complete.
+        The format of the cached results is shared by the Slicer module, the scripts and the service, see getResult.
+        :param index: DTI-ALPS index, or dict mapping each ROI pair name to its index
+        """
+        self.put(key, {"dti_alps": index, "measures": dict(profile.measures), "counts": dict(profile.counts)})
+
+    def getResult(self, key, profile):
+        """
+        DTI-ALPS index cached by putResult, or None if it is not cached. The cached measures and counts are restored in the profile.
+        """
+        cached = self.get(key)
+        if cached is None:
+            return None
+        for name, value in cached["measures"].items():
+            profile.measure(name, value)
+        for name, value in cached["counts"].items():
+            profile.count(name, value)
+        return cached["dti_alps"]
+
+    def getOrCompute(self, key, compute, refresh=False):
+        """
+        Cached result of the key, or compute and cache it. With refresh, the result is always recomputed.
+        """
+        if not refresh:
+            result = self.get(key)
+            if result is not None:
+                return result
+
+        result = compute()
+        self.put(key, result)
+        return result
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.resultsDir):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        totalBytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            totalBytes -= size
+
+    def clear(self):
+        for entry in os.scandir(self.resultsDir):
+            os.remove(entry.path)
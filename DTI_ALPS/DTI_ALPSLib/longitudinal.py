@@ -0,0 +1,111 @@
+"""
+Longitudinal DTI-ALPS index of a subject scanned at several sessions (timepoints).
+
+The sessions sharing a space (same grid and geometry, e.g. resampled to MNI or to a subject template) share their ROIs:
+the ROI voxel indices are computed once, the ROI diagonal values of all the sessions are gathered in a single
+(sessions, voxels, components) stack and reduced at once. The index change of the subject along the sessions is
+summarized by longitudinalChange.
+"""
+
+import numpy as np
+
+from .alps import DIAGONAL_COMPONENTS, calculateDTIALPSFromROIs, roiVoxelIndices
+from .profiling import ProcessingProfile
+
+
+# Fields of the per-subject change table, see longitudinalChange
+CHANGE_FIELDS = [
+    "subject", "sessions", "baseline_alps", "last_alps", "alps_change", "alps_percent_change", "alps_slope", "time_span",
+    "status", "error",
+]
+
+
+def reduceSessionsDiagonal(dtiArrays, roi, components=("Dxx", "Dyy", "Dzz")):
+    """
+    ROI means of the tensor diagonal components of several sessions on the same grid, in one stacked reduction.
+    :param dtiArrays: Tensor arrays with shape (K, J, I, 3, 3) or tensor diagonal arrays with shape (K, J, I, 3), one per session
+    :param roi: Boolean mask with shape (K, J, I) or flat voxel indices into the (K, J, I) grid, shared by the sessions
+    :return: (means, points), means with shape (sessions, components) in the components order and points the ROI voxel count
+    """
+    shape = dtiArrays[0].shape[:3]
+    for dtiArray in dtiArrays[1:]:
+        if dtiArray.shape[:3] != shape:
+            raise ValueError(f"Session image shape {dtiArray.shape[:3]} does not match the first session shape {shape}")
+    indices = roiVoxelIndices(shape, roi)
+    axes = [DIAGONAL_COMPONENTS[component] for component in components]
+
+    # (sessions, voxels, components) stack of the requested diagonal entries only
+    voxels = indices[:, np.newaxis]
+    values = np.stack([dtiArray.reshape(-1, 3)[voxels, axes] if dtiArray.ndim == 4
+                       else dtiArray.reshape(-1, 3, 3)[voxels, axes, axes] for dtiArray in dtiArrays])
+    # Accumulate in double precision to avoid drifting on large ROIs
+    return np.add.reduce(values, axis=1, dtype=np.float64)/indices.size, int(indices.size)
+
+
+def calculateDTIALPSSessions(dtiArrays, projROI, assocROI, profile=None, estimator=None, sessionProfiles=None):
+    """
+    DTI-ALPS index of several sessions on the same grid, sharing the Projection and Association ROIs.
+    :param dtiArrays: Tensor arrays with shape (K, J, I, 3, 3) or tensor diagonal arrays with shape (K, J, I, 3), one per session
+    :param projROI: Projection ROI as a boolean mask or flat voxel indices, shared by the sessions
+    :param assocROI: Association ROI as a boolean mask or flat voxel indices, shared by the sessions
+    :param profile: ProcessingProfile where the reduction stage is recorded
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given. The estimators
+                      exclude voxels per session, thus each session is reduced in turn
+    :param sessionProfiles: One ProcessingProfile per session where the ROI voxel counts and means are recorded
+                            (see DTI_ALPSLib.alps.calculateDTIALPSFromROIs)
+    :return: numpy array of the session indices
+    """
+    if len(dtiArrays) == 0:
+        raise ValueError("No session given, the DTI-ALPS index can not be calculated")
+    profile = profile or ProcessingProfile()
+    sessionProfiles = sessionProfiles or [ProcessingProfile() for _ in dtiArrays]
+    if len(sessionProfiles) != len(dtiArrays):
+        raise ValueError(f"{len(sessionProfiles)} session profiles given for {len(dtiArrays)} sessions")
+
+    if estimator is not None:
+        return np.array([calculateDTIALPSFromROIs(dtiArray, projROI, assocROI, sessionProfile, estimator)
+                         for dtiArray, sessionProfile in zip(dtiArrays, sessionProfiles)])
+
+    with profile.stage("reduction"):
+        projMeans, projPoints = reduceSessionsDiagonal(dtiArrays, projROI, ("Dxx", "Dyy"))
+        assocMeans, assocPoints = reduceSessionsDiagonal(dtiArrays, assocROI, ("Dxx", "Dzz"))
+    for sessionProfile, (projDxx, projDyy), (assocDxx, assocDzz) in zip(sessionProfiles, projMeans, assocMeans):
+        sessionProfile.count("projVoxels", projPoints)
+        sessionProfile.count("assocVoxels", assocPoints)
+        for name, value in (("projDxx", projDxx), ("projDyy", projDyy), ("assocDxx", assocDxx), ("assocDzz", assocDzz)):
+            sessionProfile.measure(name, float(value))
+
+    return ((projMeans[:, 0]+assocMeans[:, 0])/2.0)/((projMeans[:, 1]+assocMeans[:, 1])/2.0)
+
+
+def longitudinalChange(indices, times=None):
+    """
+    Change of the DTI-ALPS index of a subject along its sessions.
+    :param indices: Session indices, NaN for the failed sessions (ignored)
+    :param times: Session times (e.g. years from the first scan), the session order 0, 1, ... if not given
+    :return: dict with the CHANGE_FIELDS change metrics: number of sessions, baseline (earliest) and last index, absolute and
+             percent change from the baseline, least-squares slope of the index per time unit (NaN with less than 2 times)
+             and time span
+    """
+    indices = np.asarray(indices, dtype=np.float64).ravel()
+    times = np.arange(indices.size, dtype=np.float64) if times is None else np.asarray(times, dtype=np.float64).ravel()
+    if times.size != indices.size:
+        raise ValueError(f"{times.size} session times given for {indices.size} sessions")
+    valid = np.isfinite(indices) & np.isfinite(times)
+    if not valid.any():
+        raise ValueError("No valid session, the DTI-ALPS index change can not be calculated")
+
+    order = np.argsort(times[valid], kind="stable")
+    indices, times = indices[valid][order], times[valid][order]
+    baseline, last = float(indices[0]), float(indices[-1])
+    slope = float(np.polyfit(times, indices, 1)[0]) if np.ptp(times) > 0 else float("nan")
+
+    return {
+        "sessions": int(indices.size),
+        "baseline_alps": baseline,
+        "last_alps": last,
+        "alps_change": last-baseline,
+        "alps_percent_change": 100.0*(last-baseline)/baseline,
+        "alps_slope": slope,
+        "time_span": float(times[-1]-times[0]),
+    }
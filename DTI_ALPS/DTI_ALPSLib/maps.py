@@ -0,0 +1,82 @@
+"""
+Voxelwise diffusivity ratio maps, for the quality control of the DTI-ALPS ROIs placement.
+
+- projectionRatio: Dxx/Dyy inside the Projection ROI
+- associationRatio: Dxx/Dzz inside the Association ROI
+- alpsRatio: Dxx/mean(Dyy, Dzz) in the whole volume, the voxelwise analogue of the DTI-ALPS index
+
+The maps are zero outside their ROI and where the denominator is not positive (e.g. background). They are computed
+with whole-array operations over slabs along K, so that the temporaries stay bounded for high resolution images.
+"""
+
+import numpy as np
+
+from .profiling import ProcessingProfile
+from .volumeio import STREAM_SLAB_BYTES
+
+
+MAP_NAMES = ("projectionRatio", "associationRatio", "alpsRatio")
+
+
+def _ratio(numerator, denominator, mask=None):
+    valid = denominator > 0
+    if mask is not None:
+        valid &= mask
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=valid)
+
+
+def ratioMapSlabs(diagonal, projArray=None, assocArray=None, dtype=np.float32):
+    """
+    Ratio maps of a slab of the tensor diagonal.
+    :param diagonal: Tensor diagonal slab with shape (k, J, I, 3)
+    :param projArray, assocArray: Label slabs with shape (k, J, I), the corresponding map is skipped if not given
+    :return: dict mapping each map name (see MAP_NAMES) to its (k, J, I) slab
+    """
+    dxx, dyy, dzz = (diagonal[..., axis].astype(np.float64) for axis in range(3))
+    maps = {}
+    if projArray is not None:
+        maps["projectionRatio"] = _ratio(dxx, dyy, projArray != 0).astype(dtype)
+    if assocArray is not None:
+        maps["associationRatio"] = _ratio(dxx, dzz, assocArray != 0).astype(dtype)
+    maps["alpsRatio"] = _ratio(dxx, (dyy+dzz)/2.0).astype(dtype)
+    return maps
+
+
+def defaultMapSlices(shape):
+    """
+    K slices per slab, so that the float64 temporaries of a slab stay around STREAM_SLAB_BYTES.
+    """
+    return max(1, STREAM_SLAB_BYTES//(int(shape[1])*int(shape[2])*8*8))
+
+
+def calculateALPSMaps(dtiArray, projArray=None, assocArray=None, slabSlices=None, dtype=np.float32, profile=None):
+    """
+    Voxelwise ratio maps of a tensor array (see the module documentation), computed slab by slab along K.
+    :param dtiArray: Tensor array with shape (K, J, I, 3, 3), or tensor diagonal array with shape (K, J, I, 3)
+    :param projArray, assocArray: Label arrays, the corresponding map is skipped if not given
+    :param slabSlices: Number of K slices of each slab (see defaultMapSlices)
+    :param profile: ProcessingProfile where the ratioMaps stage is recorded
+    :return: dict mapping each map name to its (K, J, I) array
+    """
+    shape = dtiArray.shape[:3]
+    for labelArray in (projArray, assocArray):
+        if labelArray is not None and labelArray.shape != shape:
+            raise ValueError(f"Label shape {labelArray.shape} does not match the DTI image shape {shape}")
+
+    profile = profile or ProcessingProfile()
+    slabSlices = slabSlices or defaultMapSlices(shape)
+    maps = {}
+    with profile.stage("ratioMaps") as stage:
+        for k in range(0, shape[0], slabSlices):
+            slab = dtiArray[k:k+slabSlices]
+            diagonal = slab if slab.ndim == 4 else np.diagonal(slab, axis1=3, axis2=4)
+            slabMaps = ratioMapSlabs(diagonal,
+                                     None if projArray is None else projArray[k:k+slabSlices],
+                                     None if assocArray is None else assocArray[k:k+slabSlices], dtype)
+            for name, slabMap in slabMaps.items():
+                if name not in maps:
+                    maps[name] = np.zeros(shape, dtype=dtype)
+                maps[name][k:k+slabSlices] = slabMap
+        stage["bytes"] = sum(array.nbytes for array in maps.values())
+
+    return maps
@@ -0,0 +1,130 @@
+"""
+Standard Projection and Association labels in the MNI 2 mm space, shipped at Resources/MNI.
+"""
+
+import os
+
+import numpy as np
+
+from .alps import spaceMismatches
+from .volumeio import readVolume
+
+
+MNI_LABELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Resources", "MNI")
+
+MNI_PROJECTION_LABEL = "Projection-label-2mm-MNI"
+MNI_ASSOCIATION_LABEL = "Association-label-2mm-MNI"
+
+# Precomputed voxel index of the MNI labels. Increase the version whenever the labels or the file layout change,
+# outdated index files are then ignored and the index is rebuilt from the labels.
+MNI_ROI_INDEX_VERSION = 1
+MNI_ROI_INDEX_PATH = os.path.join(MNI_LABELS_DIR, "MNI-ROI-index.npz")
+
+# Label values and ROI pairs of the MNI labels split by hemisphere (left is RAS x < 0)
+MNI_LEFT_LABEL = 1
+MNI_RIGHT_LABEL = 2
+MNI_HEMISPHERE_PAIRS = [
+    ("left", [MNI_LEFT_LABEL], [MNI_LEFT_LABEL]),
+    ("right", [MNI_RIGHT_LABEL], [MNI_RIGHT_LABEL]),
+    ("bilateral", [MNI_LEFT_LABEL, MNI_RIGHT_LABEL], [MNI_LEFT_LABEL, MNI_RIGHT_LABEL]),
+]
+
+_mniROIIndex = None
+
+
+def mniLabelPath(labelName):
+    return os.path.join(MNI_LABELS_DIR, labelName+".nii.gz")
+
+
+def readMNILabels():
+    """
+    Read the standard MNI Projection and Association labels.
+    """
+    return readVolume(mniLabelPath(MNI_PROJECTION_LABEL)), readVolume(mniLabelPath(MNI_ASSOCIATION_LABEL))
+
+
+class MNIROIIndex:
+    """
+    Flat voxel indices of the standard MNI labels, in the (K, J, I) grid of the MNI 2 mm space.
+
+    shape - MNI 2 mm image shape (K, J, I)
+    ijkToRAS - 4x4 IJK to RAS matrix of the MNI 2 mm space
+    projection - Flat voxel indices of the Projection label
+    association - Flat voxel indices of the Association label
+    """
+
+    def __init__(self, shape, ijkToRAS, projection, association, version=MNI_ROI_INDEX_VERSION):
+        self.shape = tuple(int(size) for size in shape)
+        self.ijkToRAS = ijkToRAS
+        self.projection = projection
+        self.association = association
+        self.version = version
+
+
+def buildMNIROIIndex():
+    """
+    Build the MNI ROI index by scanning the standard MNI labels.
+    """
+    projLabel, assocLabel = readMNILabels()
+    return MNIROIIndex(projLabel.shape, projLabel.ijkToRAS,
+                       np.flatnonzero(projLabel.array).astype(np.int32),
+                       np.flatnonzero(assocLabel.array).astype(np.int32))
+
+
+def writeMNIROIIndex(path=MNI_ROI_INDEX_PATH):
+    """
+    Write the MNI ROI index file shipped next to the MNI labels, e.g. from the module folder:
+    python -c "from DTI_ALPSLib.mni import writeMNIROIIndex; writeMNIROIIndex()"
+    """
+    index = buildMNIROIIndex()
+    np.savez(path, version=index.version, shape=np.array(index.shape), ijkToRAS=index.ijkToRAS,
+             projection=index.projection, association=index.association)
+
+
+def readMNIROIIndex(path=MNI_ROI_INDEX_PATH):
+    """
+    Read the MNI ROI index file, returns None if it is missing or outdated.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if int(data["version"]) != MNI_ROI_INDEX_VERSION:
+            return None
+        return MNIROIIndex(data["shape"], data["ijkToRAS"], data["projection"], data["association"], int(data["version"]))
+
+
+def loadMNIROIIndex():
+    """
+    MNI ROI index, loaded once per process. Falls back to scanning the labels if the index file is not usable.
+    """
+    global _mniROIIndex
+    if _mniROIIndex is None:
+        _mniROIIndex = readMNIROIIndex() or buildMNIROIIndex()
+    return _mniROIIndex
+
+
+def mniSpaceMismatches(shape, ijkToRAS=None, mniIndex=None):
+    """
+    Compare an image grid with the MNI 2 mm space from its header only (see DTI_ALPSLib.alps.spaceMismatches).
+    :return: list describing each mismatch, empty if the image is in the MNI 2 mm space
+    """
+    mniIndex = mniIndex or loadMNIROIIndex()
+    return spaceMismatches(shape, ijkToRAS, mniIndex.shape, mniIndex.ijkToRAS)
+
+
+def mniHemisphereLabels(mniIndex=None):
+    """
+    Projection and Association label maps of the standard MNI labels, split in left and right hemispheres
+    (see MNI_HEMISPHERE_PAIRS).
+    """
+    mniIndex = mniIndex or loadMNIROIIndex()
+
+    labelArrays = []
+    for roi in (mniIndex.projection, mniIndex.association):
+        k, j, i = np.unravel_index(roi, mniIndex.shape)
+        x = (mniIndex.ijkToRAS @ np.vstack([i, j, k, np.ones(roi.size)]))[0]
+        labelArray = np.zeros(mniIndex.shape, dtype=np.uint8)
+        labelArray.flat[roi] = np.where(x < 0, MNI_LEFT_LABEL, MNI_RIGHT_LABEL)
+        labelArrays.append(labelArray)
+
+    return tuple(labelArrays)
@@ -0,0 +1,90 @@
+"""
+Directional diffusivities along anatomical axes, for tensors whose frame is not aligned with the head (oblique
+acquisition, head tilt, rotated measurement frame), without reorienting or resampling the tensor volume.
+
+By default (tensor axes), Dxx, Dyy and Dzz are the tensor diagonal as stored, i.e. the diffusivities along the axes of the
+tensor (measurement) frame. Otherwise, the diffusivity along each unit axis u is u^T D u, with the axes brought to the
+tensor frame by the measurement frame:
+- ras: the scanner RAS axes (x right-left, y anterior-posterior, z superior-inferior)
+- image: the image axes (IJK to RAS directions) nearest to the RAS axes, which follow the head in an acquisition
+  planned along the anatomy
+Only the ROI voxels are projected, with one einsum over their (voxels, 3, 3) tensors, into a compact array of the union of
+the ROIs which the DTI-ALPS functions take in place of the tensor volume.
+"""
+
+import numpy as np
+
+from .alps import isVoxelIndices, roiVoxelIndices
+from .profiling import ProcessingProfile
+
+
+TENSOR_AXES = ("tensor", "ras", "image")
+
+
+def nearestImageAxes(ijkToRAS):
+    """
+    Unit directions (RAS) of the image axes nearest to the R, A and S axes, as the columns of a 3x3 matrix.
+    """
+    directions = np.asarray(ijkToRAS, dtype=np.float64)[:3, :3]
+    directions = directions/np.linalg.norm(directions, axis=0)
+    order = np.argmax(np.abs(directions), axis=1)
+    if len(set(order.tolist())) != 3:
+        raise ValueError("The image axes are too oblique (45 degrees) to be matched with the RAS axes")
+    return directions[:, order]
+
+
+def tensorAxesMatrix(axes="ras", measurementFrame=None, ijkToRAS=None):
+    """
+    Directions of Dxx, Dyy and Dzz in the tensor frame, as the columns of a 3x3 matrix.
+    :param axes: tensor, ras or image (see TENSOR_AXES)
+    :param measurementFrame: 3x3 matrix mapping the tensor frame to RAS (identity if not given)
+    :param ijkToRAS: 4x4 IJK to RAS matrix, required for the image axes
+    """
+    if axes not in TENSOR_AXES:
+        raise ValueError(f"Unknown tensor axes '{axes}', expected one of {', '.join(TENSOR_AXES)}")
+    if axes == "tensor":
+        return np.eye(3)
+    if axes == "image" and ijkToRAS is None:
+        raise ValueError("The image tensor axes require the IJK to RAS matrix")
+
+    frame = np.eye(3) if measurementFrame is None else np.asarray(measurementFrame, dtype=np.float64)
+    directions = np.eye(3) if axes == "ras" else nearestImageAxes(ijkToRAS)
+    # u^T (M D M^T) u = (M^T u)^T D (M^T u), with M mapping the tensor frame to RAS
+    return frame.T @ directions
+
+
+def orientROITensors(dtiArray, rois, axesMatrix, full=False, profile=None):
+    """
+    Tensors of the ROI voxels along the given axes, in a compact volume covering the union of the ROIs.
+    :param dtiArray: Tensor array with shape (K, J, I, 3, 3)
+    :param rois: ROIs as boolean masks or label arrays with shape (K, J, I), or flat voxel indices into the (K, J, I) grid
+    :param axesMatrix: Directions of Dxx, Dyy and Dzz in the tensor frame (see tensorAxesMatrix)
+    :param full: Give the full rotated tensors (e.g. for the FA voxel exclusion) instead of their diagonal
+    :param profile: ProcessingProfile where the projection stage is recorded
+    :return: (array, rois), the array with shape (voxels, 1, 1, 3), or (voxels, 1, 1, 3, 3) with full, and the ROIs in the
+             same form as given (masks, label arrays or flat indices) on its (voxels, 1, 1) grid
+    """
+    if dtiArray.ndim != 5:
+        raise ValueError("The tensor axes projection requires the full tensors, not only the tensor diagonal")
+
+    profile = profile or ProcessingProfile()
+    shape = dtiArray.shape[:3]
+    with profile.stage("orientTensors") as stage:
+        gridROIs = [np.asarray(roi) for roi in rois]
+        # roiVoxelIndices checks that the masks and label arrays are on the DTI grid
+        voxels = np.unique(np.concatenate([roiVoxelIndices(shape, roi) for roi in gridROIs]).astype(np.int64))
+
+        tensors = dtiArray.reshape(-1, 3, 3)[voxels].astype(np.float64)
+        axesMatrix = np.asarray(axesMatrix, dtype=np.float64)
+        if full:
+            oriented = np.einsum("ia,nij,jb->nab", axesMatrix, tensors, axesMatrix, optimize=True)
+        else:
+            oriented = np.einsum("ia,nij,ja->na", axesMatrix, tensors, axesMatrix, optimize=True)
+        oriented = oriented.reshape((voxels.size, 1, 1)+oriented.shape[1:])
+
+        compactROIs = [np.searchsorted(voxels, roi) if isVoxelIndices(roi) else roi.reshape(-1)[voxels].reshape(voxels.size, 1, 1)
+                       for roi in gridROIs]
+        stage["bytes"] = tensors.nbytes
+    profile.count("orientedVoxels", voxels.size)
+
+    return oriented, compactROIs
@@ -0,0 +1,361 @@
+"""
+DTI-ALPS index calculation from image files, without the Slicer application.
+"""
+
+import contextlib
+
+import numpy as np
+
+from .alps import calculateDTIALPSFromROIs, calculateDTIALPSMultiROI, cropROI, roiBounds, spaceMismatches
+from .bootstrap import bootstrapDTIALPS
+from .longitudinal import calculateDTIALPSSessions
+from .maps import defaultMapSlices, ratioMapSlabs
+from .mni import MNI_HEMISPHERE_PAIRS, loadMNIROIIndex, mniHemisphereLabels, mniSpaceMismatches
+from .orientation import orientROITensors, tensorAxesMatrix
+from .profiling import ProcessingProfile
+from .tensorfit import fitROITensorDiagonal, readDWIHeader, readGradientTable
+from .volumeio import (NRRDSlabWriter, iterTensorDiagonalSlabs, readTensorDiagonal, readTensors, readVolume, readVolumeComponents,
+                       readVolumeHeader)
+from .warp import readMNITransform, warpMNILabels
+
+
+def _checkLabelInputs(projLabelPath, assocLabelPath, MNISpace, mniTransformPath, inputName="DTI"):
+    if MNISpace and mniTransformPath:
+        raise ValueError("The MNI space and MNI transform options cannot be used together")
+    if not MNISpace and not mniTransformPath and (not projLabelPath or not assocLabelPath):
+        raise ValueError(f"Input {inputName}, Projection and/or Association labels are not valid")
+
+
+def _readLabelArrays(header, projLabelPath, assocLabelPath, mniTransformPath, profile):
+    """
+    Label arrays read from the label files, or the standard MNI labels warped to the image grid (see DTI_ALPSLib.warp).
+    """
+    if mniTransformPath:
+        with profile.stage("warpLabels") as stage:
+            projArray, assocArray = warpMNILabels(header.shape, header.ijkToRAS, readMNITransform(mniTransformPath))
+    else:
+        with profile.stage("readLabels") as stage:
+            projArray, assocArray = readVolume(projLabelPath).array, readVolume(assocLabelPath).array
+    stage["bytes"] = projArray.nbytes+assocArray.nbytes
+    return projArray, assocArray
+
+
+def _cropROIs(shape, rois):
+    """
+    ROIs bounding box, and the ROIs (masks, label arrays or flat voxel indices) cropped to it.
+    """
+    bounds = roiBounds(shape, *[roi != 0 if roi.shape == tuple(shape) else roi for roi in rois])
+    (k0, k1), (j0, j1), (i0, i1) = bounds
+    return bounds, [roi[k0:k1, j0:j1, i0:i1] if roi.shape == tuple(shape) else cropROI(roi, shape, bounds) for roi in rois]
+
+
+def _readROITensors(dtiHeader, rois, lazyLoading, tensorAxes, estimator, profile, bounds=None):
+    """
+    Tensors (or their diagonal) of the DTI file for the ROIs, along the tensor axes (see DTI_ALPSLib.orientation).
+    With lazyLoading, only the ROIs bounding box is read.
+    :param bounds: ROIs bounding box with lazyLoading, the rois being already cropped to it (see _cropROIs)
+    :return: (dtiArray, rois) with the ROIs on the grid of the returned array
+    """
+    axesMatrix = None if tensorAxes == "tensor" else tensorAxesMatrix(tensorAxes, dtiHeader.measurementFrame, dtiHeader.ijkToRAS)
+    with profile.stage("readDTI") as stage:
+        if lazyLoading:
+            if bounds is None:
+                bounds, rois = _cropROIs(dtiHeader.shape, rois)
+            # The axes projection requires the full tensors, otherwise the tensor diagonal is enough
+            dtiArray = (readTensorDiagonal(dtiHeader, bounds) if axesMatrix is None else readTensors(dtiHeader, bounds)).array
+        else:
+            dtiArray = readVolume(dtiHeader).array
+        stage["bytes"] = dtiArray.nbytes
+
+    if axesMatrix is not None:
+        full = estimator is not None and estimator.minFA is not None
+        dtiArray, rois = orientROITensors(dtiArray, rois, axesMatrix, full, profile)
+    return dtiArray, rois
+
+
+def readDTIALPSInputs(dtiPath, projLabelPath=None, assocLabelPath=None, MNISpace=False, lazyLoading=False, profile=None,
+                      mniTransformPath=None, estimator=None, tensorAxes="tensor"):
+    """
+    Read the DTI and label files (NRRD or NIfTI) of one DTI-ALPS calculation, e.g. in a prefetch thread
+    (see DTI_ALPSLib.prefetch), the parameters being those of calculateDTIALPSFromFiles.
+    :return: (dtiArray, projROI, assocROI), the ROIs on the grid of dtiArray
+    """
+    _checkLabelInputs(projLabelPath, assocLabelPath, MNISpace, mniTransformPath)
+
+    profile = profile or ProcessingProfile()
+    with profile.stage("readHeader"):
+        dtiHeader = readVolumeHeader(dtiPath)
+    if not dtiHeader.isTensor:
+        raise ValueError(f"Input DTI image is not a tensor volume: {dtiPath}")
+
+    if MNISpace:
+        # The MNI labels are never read, their precomputed voxel index is used instead
+        with profile.stage("checkMNISpace"):
+            mniIndex = loadMNIROIIndex()
+            mismatches = mniSpaceMismatches(dtiHeader.shape, dtiHeader.ijkToRAS, mniIndex)
+        if mismatches:
+            raise ValueError(f"Input DTI image is not in MNI space: {'; '.join(mismatches)}. "
+                             "Please resample the input DTI image to MNI before calling this option.")
+        projROI, assocROI = mniIndex.projection, mniIndex.association
+    else:
+        projArray, assocArray = _readLabelArrays(dtiHeader, projLabelPath, assocLabelPath, mniTransformPath, profile)
+        projROI, assocROI = projArray != 0, assocArray != 0
+
+    dtiArray, (projROI, assocROI) = _readROITensors(dtiHeader, [projROI, assocROI], lazyLoading, tensorAxes, estimator, profile)
+    return dtiArray, projROI, assocROI
+
+
+def calculateDTIALPSFromFiles(dtiPath, projLabelPath=None, assocLabelPath=None, MNISpace=False, lazyLoading=False, profile=None,
+                              mniTransformPath=None, estimator=None, bootstrap=None, tensorAxes="tensor"):
+    """
+    Read the DTI and label files (NRRD or NIfTI) and calculate the DTI-ALPS index.
+    :param dtiPath: DTI volume to be the source of DTI-ALPS index calculation
+    :param projLabelPath: The Projection ROI area (not used if MNISpace is True)
+    :param assocLabelPath: The Association ROI area (not used if MNISpace is True)
+    :param MNISpace: Informs if the input volume is in MNI space (2 mm) to use standard Proj/Assoc labels
+    :param lazyLoading: Read only the tensor diagonal inside the ROIs bounding box, instead of the whole tensor volume
+    :param profile: ProcessingProfile where the per-stage timings are recorded
+    :param mniTransformPath: Subject to MNI transform (see DTI_ALPSLib.warp.readMNITransform). The standard MNI labels
+                             are warped to the native DTI space in place of the label files
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given
+    :param bootstrap: ALPSBootstrap parameters of the index confidence interval, recorded in the profile measures
+                      (see DTI_ALPSLib.bootstrap.bootstrapDTIALPS). No interval if not given
+    :param tensorAxes: Axes of Dxx, Dyy and Dzz: tensor (the stored tensor diagonal), ras or image, projecting the ROI tensors
+                       with the measurement frame and the image directions (see DTI_ALPSLib.orientation)
+    """
+    profile = profile or ProcessingProfile()
+    dtiArray, projROI, assocROI = readDTIALPSInputs(dtiPath, projLabelPath, assocLabelPath, MNISpace, lazyLoading, profile,
+                                                    mniTransformPath, estimator, tensorAxes)
+
+    index = calculateDTIALPSFromROIs(dtiArray, projROI, assocROI, profile, estimator)
+    if bootstrap is not None:
+        bootstrapDTIALPS(dtiArray, projROI, assocROI, bootstrap, estimator, profile)
+    return index
+
+
+def calculateDTIALPSMultiROIFromFiles(dtiPath, projLabelPath=None, assocLabelPath=None, MNISpace=False, roiPairs=None,
+                                      lazyLoading=False, profile=None, mniTransformPath=None, estimator=None, tensorAxes="tensor"):
+    """
+    Read the DTI and multi-valued label files (NRRD or NIfTI) and calculate the DTI-ALPS index of several ROI pairs
+    in a single pass (see DTI_ALPSLib.alps.calculateDTIALPSMultiROI).
+    In MNI space, or warped to the native space with mniTransformPath, the standard MNI labels are split in left and
+    right hemispheres (see MNI_HEMISPHERE_PAIRS).
+    :param profile: ProcessingProfile where the per-stage timings are recorded
+    :param mniTransformPath: Subject to MNI transform, the standard MNI labels are warped to the native DTI space
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given
+    :param tensorAxes: Axes of Dxx, Dyy and Dzz: tensor, ras or image (see DTI_ALPSLib.orientation)
+    :return: dict mapping each ROI pair name to its DTI-ALPS index
+    """
+    _checkLabelInputs(projLabelPath, assocLabelPath, MNISpace, mniTransformPath)
+
+    profile = profile or ProcessingProfile()
+    with profile.stage("readHeader"):
+        dtiHeader = readVolumeHeader(dtiPath)
+    if not dtiHeader.isTensor:
+        raise ValueError(f"Input DTI image is not a tensor volume: {dtiPath}")
+
+    if MNISpace:
+        with profile.stage("checkMNISpace"):
+            mniIndex = loadMNIROIIndex()
+            mismatches = mniSpaceMismatches(dtiHeader.shape, dtiHeader.ijkToRAS, mniIndex)
+        if mismatches:
+            raise ValueError(f"Input DTI image is not in MNI space: {'; '.join(mismatches)}. "
+                             "Please resample the input DTI image to MNI before calling this option.")
+        projArray, assocArray = mniHemisphereLabels(mniIndex)
+        roiPairs = roiPairs or MNI_HEMISPHERE_PAIRS
+    else:
+        projArray, assocArray = _readLabelArrays(dtiHeader, projLabelPath, assocLabelPath, mniTransformPath, profile)
+        if mniTransformPath:
+            roiPairs = roiPairs or MNI_HEMISPHERE_PAIRS
+
+    dtiArray, (projArray, assocArray) = _readROITensors(dtiHeader, [projArray, assocArray], lazyLoading, tensorAxes, estimator, profile)
+
+    return calculateDTIALPSMultiROI(dtiArray, projArray, assocArray, roiPairs, profile, estimator)
+
+
+def calculateDTIALPSSessionsFromFiles(dtiPaths, projLabelPath=None, assocLabelPath=None, MNISpace=False, lazyLoading=False,
+                                      profile=None, estimator=None, tensorAxes="tensor", sessionProfiles=None):
+    """
+    Read the DTI files (NRRD or NIfTI) of the sessions of a subject and calculate their DTI-ALPS indices
+    (see DTI_ALPSLib.longitudinal.calculateDTIALPSSessions). The sessions are grouped by space (same grid and geometry):
+    the labels are read once, and the space is checked and the ROIs (and their bounding box) computed once per space.
+    :param dtiPaths: DTI volumes of the sessions
+    :param projLabelPath: The Projection ROI area shared by the sessions, all of them in its space (not used if MNISpace is True)
+    :param assocLabelPath: The Association ROI area shared by the sessions (not used if MNISpace is True)
+    :param MNISpace: Informs if the sessions are in MNI space (2 mm) to use standard Proj/Assoc labels
+    :param lazyLoading: Read only the tensor diagonal inside the ROIs bounding box, instead of the whole tensor volumes
+    :param profile: ProcessingProfile where the per-stage timings of the whole subject are recorded
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given
+    :param tensorAxes: Axes of Dxx, Dyy and Dzz: tensor, ras or image (see DTI_ALPSLib.orientation)
+    :param sessionProfiles: One ProcessingProfile per session where the ROI voxel counts and means are recorded
+    :return: numpy array of the session indices
+    """
+    _checkLabelInputs(projLabelPath, assocLabelPath, MNISpace, None)
+
+    profile = profile or ProcessingProfile()
+    sessionProfiles = sessionProfiles or [ProcessingProfile() for _ in dtiPaths]
+    with profile.stage("readHeader"):
+        dtiHeaders = [readVolumeHeader(dtiPath) for dtiPath in dtiPaths]
+    for dtiPath, dtiHeader in zip(dtiPaths, dtiHeaders):
+        if not dtiHeader.isTensor:
+            raise ValueError(f"Input DTI image is not a tensor volume: {dtiPath}")
+
+    # Sessions sharing a space, the first session of each space being its reference
+    spaces = []
+    for number, dtiHeader in enumerate(dtiHeaders):
+        space = next((sessions for sessions in spaces
+                      if not spaceMismatches(dtiHeader.shape, dtiHeader.ijkToRAS, dtiHeaders[sessions[0]].shape,
+                                             dtiHeaders[sessions[0]].ijkToRAS)), None)
+        if space is None:
+            spaces.append([number])
+        else:
+            space.append(number)
+
+    if MNISpace:
+        mniIndex = loadMNIROIIndex()
+        labelGeometry = (mniIndex.shape, mniIndex.ijkToRAS)
+        projROI, assocROI = mniIndex.projection, mniIndex.association
+    else:
+        with profile.stage("readLabels") as stage:
+            projLabel, assocLabel = readVolume(projLabelPath), readVolume(assocLabelPath)
+            stage["bytes"] = projLabel.array.nbytes+assocLabel.array.nbytes
+        labelGeometry = (projLabel.shape, projLabel.ijkToRAS)
+        projROI, assocROI = projLabel.array != 0, assocLabel.array != 0
+
+    indices = np.empty(len(dtiPaths))
+    for sessions in spaces:
+        dtiHeader = dtiHeaders[sessions[0]]
+        with profile.stage("checkMNISpace" if MNISpace else "checkLabelSpace"):
+            mismatches = spaceMismatches(dtiHeader.shape, dtiHeader.ijkToRAS, *labelGeometry)
+        if mismatches:
+            raise ValueError(f"Input DTI image is not in the {'MNI' if MNISpace else 'label'} space: {'; '.join(mismatches)} "
+                             f"({dtiPaths[sessions[0]]})")
+
+        rois, bounds = [projROI, assocROI], None
+        if lazyLoading:
+            bounds, rois = _cropROIs(dtiHeader.shape, rois)
+        dtiArrays = []
+        for number in sessions:
+            dtiArray, sessionROIs = _readROITensors(dtiHeaders[number], rois, lazyLoading, tensorAxes, estimator, profile, bounds)
+            dtiArrays.append(dtiArray)
+        # The sessions ROIs are the same, including the compact ROIs of the tensor axes projection
+        indices[sessions] = calculateDTIALPSSessions(dtiArrays, *sessionROIs, profile, estimator,
+                                                     [sessionProfiles[number] for number in sessions])
+
+    return indices
+
+
+def calculateDTIALPSFromDWI(dwiPath, projLabelPath=None, assocLabelPath=None, MNISpace=False, bvalsPath=None, bvecsPath=None,
+                            multiROI=False, roiPairs=None, fitRegion="roi", method="wls", profile=None, mniTransformPath=None,
+                            estimator=None, bootstrap=None, tensorAxes="tensor"):
+    """
+    Read the raw DWI and label files (NRRD or NIfTI) and calculate the DTI-ALPS index, fitting the diffusion tensors
+    only inside the ROIs (see DTI_ALPSLib.tensorfit). Only the ROIs bounding box of the DWI file is read.
+    :param dwiPath: DWI volume, with the gradients in its header (NRRD DWMRI fields) or in the bvals/bvecs files
+    :param bvalsPath, bvecsPath: FSL gradient table files
+    :param multiROI: Calculate the index of several ROI pairs (see calculateDTIALPSMultiROIFromFiles), implied by roiPairs
+    :param fitRegion: roi to fit only the ROI voxels, or bounds to fit every voxel of their bounding box
+    :param method: ols or wls tensor fitting
+    :param mniTransformPath: Subject to MNI transform, the standard MNI labels are warped to the native DWI space
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), without the FA exclusion (only the tensor diagonal is fitted)
+    :param bootstrap: ALPSBootstrap parameters of the index confidence interval (single ROI pair only), recorded in the profile measures
+    :param tensorAxes: Axes of Dxx, Dyy and Dzz (see DTI_ALPSLib.orientation). The tensors are fitted with the gradients in
+                       the RAS frame, thus tensor and ras are the same, and image projects the fitted tensors on the image axes
+    :return: DTI-ALPS index, or dict mapping each ROI pair name to its DTI-ALPS index with multiROI
+    """
+    _checkLabelInputs(projLabelPath, assocLabelPath, MNISpace, mniTransformPath, "DWI")
+    if bootstrap is not None and (multiROI or roiPairs):
+        raise ValueError("The bootstrap confidence interval is calculated for a single ROI pair, not with multiple ROI pairs")
+
+    profile = profile or ProcessingProfile()
+    with profile.stage("readHeader"):
+        dwiHeader = readDWIHeader(dwiPath)
+        gradients = readGradientTable(dwiPath, bvalsPath, bvecsPath, dwiHeader)
+
+    if MNISpace:
+        with profile.stage("checkMNISpace"):
+            mniIndex = loadMNIROIIndex()
+            mismatches = mniSpaceMismatches(dwiHeader.shape, dwiHeader.ijkToRAS, mniIndex)
+        if mismatches:
+            raise ValueError(f"Input DWI image is not in MNI space: {'; '.join(mismatches)}. "
+                             "Please resample the input DWI image to MNI before calling this option.")
+        projArray, assocArray = mniHemisphereLabels(mniIndex)
+        if multiROI or roiPairs:
+            roiPairs = roiPairs or MNI_HEMISPHERE_PAIRS
+    else:
+        projArray, assocArray = _readLabelArrays(dwiHeader, projLabelPath, assocLabelPath, mniTransformPath, profile)
+        if mniTransformPath and (multiROI or roiPairs):
+            roiPairs = roiPairs or MNI_HEMISPHERE_PAIRS
+        if projArray.shape != dwiHeader.shape or assocArray.shape != dwiHeader.shape:
+            raise ValueError(f"Label shapes {projArray.shape} and {assocArray.shape} do not match the DWI image shape {dwiHeader.shape}")
+
+    with profile.stage("readDWI") as stage:
+        bounds = roiBounds(dwiHeader.shape, projArray != 0, assocArray != 0)
+        signals = readVolumeComponents(dwiHeader, bounds=bounds).array
+        (k0, k1), (j0, j1), (i0, i1) = bounds
+        projArray, assocArray = projArray[k0:k1, j0:j1, i0:i1], assocArray[k0:k1, j0:j1, i0:i1]
+        stage["bytes"] = signals.nbytes
+
+    # The gradients, thus the fitted tensors, are in the RAS frame
+    axesMatrix = tensorAxesMatrix(tensorAxes, ijkToRAS=dwiHeader.ijkToRAS)
+    diagonal, projArray, assocArray = fitROITensorDiagonal(signals, gradients, projArray, assocArray, fitRegion, method, profile,
+                                                           axesMatrix)
+
+    if multiROI or roiPairs:
+        return calculateDTIALPSMultiROI(diagonal, projArray, assocArray, roiPairs, profile, estimator)
+    index = calculateDTIALPSFromROIs(diagonal, projArray != 0, assocArray != 0, profile, estimator)
+    if bootstrap is not None:
+        bootstrapDTIALPS(diagonal, projArray != 0, assocArray != 0, bootstrap, estimator, profile)
+    return index
+
+
+def writeALPSMapsFromFiles(dtiPath, outputPrefix, projLabelPath=None, assocLabelPath=None, MNISpace=False, mniTransformPath=None,
+                           slabSlices=None, encoding="gzip", profile=None):
+    """
+    Write the voxelwise ratio maps of a DTI file (see DTI_ALPSLib.maps) as NRRD files named OUTPUTPREFIX-MAPNAME.nrrd.
+    The tensor diagonal is read, and the maps are computed and written, slab by slab along K, thus neither the tensor
+    volume nor the maps are ever held in memory at once. Without labels (or MNISpace or mniTransformPath), only the
+    alpsRatio map is written.
+    :param slabSlices: Number of K slices of each slab (see DTI_ALPSLib.maps.defaultMapSlices)
+    :param encoding: raw or gzip NRRD encoding of the maps
+    :return: dict mapping each map name to its file path
+    """
+    if MNISpace and mniTransformPath:
+        raise ValueError("The MNI space and MNI transform options cannot be used together")
+
+    profile = profile or ProcessingProfile()
+    with profile.stage("readHeader"):
+        dtiHeader = readVolumeHeader(dtiPath)
+    if not dtiHeader.isTensor:
+        raise ValueError(f"Input DTI image is not a tensor volume: {dtiPath}")
+
+    projArray, assocArray = None, None
+    if MNISpace:
+        with profile.stage("checkMNISpace"):
+            mismatches = mniSpaceMismatches(dtiHeader.shape, dtiHeader.ijkToRAS)
+        if mismatches:
+            raise ValueError(f"Input DTI image is not in MNI space: {'; '.join(mismatches)}. "
+                             "Please resample the input DTI image to MNI before calling this option.")
+        projArray, assocArray = mniHemisphereLabels()
+    elif mniTransformPath or (projLabelPath and assocLabelPath):
+        projArray, assocArray = _readLabelArrays(dtiHeader, projLabelPath, assocLabelPath, mniTransformPath, profile)
+        if projArray.shape != dtiHeader.shape or assocArray.shape != dtiHeader.shape:
+            raise ValueError(f"Label shapes {projArray.shape} and {assocArray.shape} do not match the DTI image shape {dtiHeader.shape}")
+
+    names = [name for name, labelArray in [("projectionRatio", projArray), ("associationRatio", assocArray), ("alpsRatio", True)]
+             if labelArray is not None]
+    paths = {name: f"{outputPrefix}-{name}.nrrd" for name in names}
+    slabSlices = slabSlices or defaultMapSlices(dtiHeader.shape)
+
+    with profile.stage("ratioMaps") as stage, contextlib.ExitStack() as openFiles:
+        writers = [openFiles.enter_context(NRRDSlabWriter(paths[name], dtiHeader.shape, np.float32, dtiHeader.ijkToRAS, encoding))
+                   for name in names]
+        for k, diagonal in iterTensorDiagonalSlabs(dtiHeader, slabSlices):
+            stage["bytes"] += diagonal.nbytes
+            slabMaps = ratioMapSlabs(diagonal,
+                                     None if projArray is None else projArray[k:k+diagonal.shape[0]],
+                                     None if assocArray is None else assocArray[k:k+diagonal.shape[0]])
+            for name, writer in zip(names, writers):
+                writer.write(slabMaps[name])
+
+    return paths
@@ -0,0 +1,78 @@
+"""
+Read-ahead of the next subjects of a cohort, so that reading (and decompressing) their files overlaps the calculation
+of the current one.
+
+The items are loaded by a bounded thread pool, in order, and handed to the caller one at a time. The gzip and bzip2
+decompression and the numpy array operations release the GIL, thus the loading threads run alongside the calculation.
+The memory is bounded by back-pressure: the expected size of each item is estimated before loading it (e.g. from its
+file headers), and the next item is only started when the items loaded ahead, plus the current one, fit in the budget.
+"""
+
+import collections
+import concurrent.futures
+
+
+DEFAULT_PREFETCH_DEPTH = 2
+DEFAULT_PREFETCH_BYTES = 4*1024*1024*1024
+
+
+class Prefetcher:
+    """
+    Iterable of (item, future) in the items order, the future giving the return value (or raising the exception) of
+    loadFunction(item). While the caller processes an item, the next ones are loaded in the background.
+
+    depth - Maximum number of items loaded ahead of the current one
+    maxBytes - Memory budget of the current item and of the items loaded ahead, estimated by sizeFunction(item) before
+               loading. An item larger than the budget is only loaded once the items before it are processed (no budget if None)
+    workers - Number of loading threads (depth by default)
+    """
+
+    def __init__(self, items, loadFunction, depth=DEFAULT_PREFETCH_DEPTH, maxBytes=DEFAULT_PREFETCH_BYTES, sizeFunction=None,
+                 workers=None):
+        if depth < 1:
+            raise ValueError(f"At least 1 item must be loaded ahead, {depth} given")
+        self.items = list(items)
+        self.loadFunction = loadFunction
+        self.depth = int(depth)
+        self.maxBytes = maxBytes
+        self.sizeFunction = sizeFunction
+        self.workers = max(1, int(workers or depth))
+
+    def _itemBytes(self, item):
+        if self.sizeFunction is None:
+            return 0
+        try:
+            return int(self.sizeFunction(item))
+        except Exception:
+            # The error is reported by the loading of the item
+            return 0
+
+    def __iter__(self):
+        pending = collections.deque(self.items)
+        loading = collections.deque()
+        nextBytes = None
+        with concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="DTI-ALPS prefetch") as executor:
+            try:
+                while pending or loading:
+                    if not loading:
+                        item = pending.popleft()
+                        loading.append((item, nextBytes if nextBytes is not None else self._itemBytes(item),
+                                        executor.submit(self.loadFunction, item)))
+                        nextBytes = None
+                    item, currentBytes, future = loading.popleft()
+
+                    # Load ahead while the current item and the loading ones fit in the memory budget
+                    while pending and len(loading) < self.depth:
+                        if nextBytes is None:
+                            nextBytes = self._itemBytes(pending[0])
+                        loadedBytes = currentBytes+sum(size for _, size, _ in loading)
+                        if self.maxBytes is not None and loadedBytes+nextBytes > self.maxBytes:
+                            break
+                        nextItem = pending.popleft()
+                        loading.append((nextItem, nextBytes, executor.submit(self.loadFunction, nextItem)))
+                        nextBytes = None
+
+                    yield item, future
+            finally:
+                for _, _, future in loading:
+                    future.cancel()
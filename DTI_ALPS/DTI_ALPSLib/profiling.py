@@ -0,0 +1,127 @@
+"""
+Per-stage timing and memory instrumentation of the DTI-ALPS calculation.
+
+A ProcessingProfile is filled along the calculation (file reading, MNI space check, array access, ROI reduction,
+cache access) and can be printed or appended to a JSON-lines file, so that many runs can be aggregated.
+"""
+
+import contextlib
+import json
+import os
+import socket
+import sys
+import time
+
+
+def peakRSSBytes():
+    """
+    Peak resident set size of the current process in bytes, or None if it is not available on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    if resource is not None:
+        maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes
+        return int(maxRSS) if sys.platform == "darwin" else int(maxRSS)*1024
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return int(getattr(memory, "peak_wset", memory.rss))
+
+
+class ProcessingCancelled(Exception):
+    """
+    Raised by a stage callback to stop the calculation at the start of its next stage (see ProcessingProfile.stageCallback).
+    """
+
+
+class ProcessingProfile:
+    """
+    Per-stage durations, bytes loaded, ROI voxel counts and peak memory of one DTI-ALPS calculation.
+
+    stages - List of {"name", "seconds", "bytes", "peakRSSBytes"} in execution order. peakRSSBytes is the
+             process peak at the end of the stage, thus the stage where it increases is the one that allocated it
+    counts - Voxel counts (e.g. projVoxels, assocVoxels)
+    measures - ROI measurements (e.g. projDxx, the mean Dxx of the Projection ROI)
+    metadata - Free fields stored with the profile (e.g. input paths and options)
+    stageCallback - Function called with the stage name when a stage starts, e.g. to report the progress of a background
+                    calculation. It may raise ProcessingCancelled to stop the calculation
+    """
+
+    stageCallback = None
+
+    def __init__(self, **metadata):
+        self.metadata = metadata
+        self.stages = []
+        self.counts = {}
+        self.measures = {}
+        self.startTime = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time a stage. The yielded record can be updated inside the block, e.g. record["bytes"] += array.nbytes
+        """
+        if self.stageCallback is not None:
+            self.stageCallback(name)
+        record = {"name": name, "seconds": 0.0, "bytes": 0}
+        startTime = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter()-startTime
+            record["peakRSSBytes"] = peakRSSBytes()
+            self.stages.append(record)
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0)+int(value)
+
+    def measure(self, name, value):
+        self.measures[name] = float(value)
+
+    @property
+    def totalSeconds(self):
+        return sum(record["seconds"] for record in self.stages)
+
+    @property
+    def bytesLoaded(self):
+        return sum(record["bytes"] for record in self.stages)
+
+    def toDict(self):
+        return {
+            "timestamp": self.startTime,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            **self.metadata,
+            "total_seconds": self.totalSeconds,
+            "bytes_loaded": self.bytesLoaded,
+            "peak_rss_bytes": peakRSSBytes(),
+            "counts": dict(self.counts),
+            "measures": dict(self.measures),
+            "stages": [dict(record) for record in self.stages],
+        }
+
+    def writeJSONLine(self, path):
+        """
+        Append the profile as one JSON line. A single write call is used, so that concurrent runs do not interleave.
+        """
+        line = json.dumps(self.toDict())+"\n"
+        with open(path, "a") as f:
+            f.write(line)
+
+    def summary(self):
+        lines = [f"{'Stage':<20} {'Time (ms)':>10} {'Loaded (MiB)':>13} {'Peak RSS (MiB)':>15}"]
+        for record in self.stages:
+            peak = record["peakRSSBytes"]
+            lines.append(f"{record['name']:<20} {record['seconds']*1000:10.2f} {record['bytes']/2**20:13.1f} "
+                         f"{peak/2**20 if peak is not None else float('nan'):15.1f}")
+        lines.append(f"{'total':<20} {self.totalSeconds*1000:10.2f} {self.bytesLoaded/2**20:13.1f}")
+        lines += [f"{name}: {value}" for name, value in self.counts.items()]
+        lines += [f"{name}: {value:.6g}" for name, value in self.measures.items()]
+        return "\n".join(lines)
@@ -0,0 +1,238 @@
+"""
+Streaming DTI-ALPS result tables, written one record per subject as the results complete.
+
+CSV and JSON-lines tables are appended and synced to disk after each record, thus an interrupted cohort run keeps
+every finished subject and is resumed from the table itself (the checkpoint). Parquet tables are spooled to a
+JSON-lines file along the run and written when the sink is closed (the pyarrow package is required).
+"""
+
+import csv
+import io
+import json
+import os
+
+from .profiling import peakRSSBytes
+
+
+RESULT_FORMATS = ("csv", "jsonl", "parquet")
+
+# process_peak_rss_bytes is the peak memory of the whole process when the record is written, not of the subject alone: it
+# only grows along a batch or service run, the subject that raised it is the first record with the new value
+RESULT_FIELDS = [
+    "subject", "dti", "proj_label", "assoc_label", "dti_alps", "dti_alps_ci_lower", "dti_alps_ci_upper", "dti_alps_se",
+    "status", "error", "cached",
+    "proj_Dxx", "proj_Dyy", "assoc_Dxx", "assoc_Dzz", "proj_Dxx_sd", "proj_Dyy_sd", "assoc_Dxx_sd", "assoc_Dzz_sd",
+    "proj_voxels", "assoc_voxels", "proj_excluded", "assoc_excluded", "seconds", "process_peak_rss_bytes",
+]
+
+# Result fields holding text, the others are numbers (empty when not available)
+RESULT_TEXT_FIELDS = ("subject", "dti", "proj_label", "assoc_label", "status", "error", "cached")
+
+# Result fields taken from the ProcessingProfile measures and counts (the SD and excluded voxels are given by the ROI estimators
+# only, the confidence interval by the bootstrap only)
+PROFILE_MEASURE_FIELDS = {
+    "dtiAlpsLower": "dti_alps_ci_lower", "dtiAlpsUpper": "dti_alps_ci_upper", "dtiAlpsSE": "dti_alps_se",
+    "projDxx": "proj_Dxx", "projDyy": "proj_Dyy", "assocDxx": "assoc_Dxx", "assocDzz": "assoc_Dzz",
+    "projDxxSD": "proj_Dxx_sd", "projDyySD": "proj_Dyy_sd", "assocDxxSD": "assoc_Dxx_sd", "assocDzzSD": "assoc_Dzz_sd",
+}
+PROFILE_COUNT_FIELDS = {
+    "projVoxels": "proj_voxels", "assocVoxels": "assoc_voxels", "projExcluded": "proj_excluded", "assocExcluded": "assoc_excluded",
+}
+
+
+def resultFormat(path):
+    """
+    Result table format from the file extension (CSV by default).
+    """
+    lowerPath = path.lower()
+    if lowerPath.endswith(".parquet"):
+        return "parquet"
+    if lowerPath.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "csv"
+
+
+def resultRecord(subject, dti_alps=None, profile=None, status="ok", error="", cached=False, **fields):
+    """
+    One result table record.
+    :param subject: Subject name
+    :param dti_alps: DTI-ALPS index, or dict mapping each ROI pair name to its index (dti_alps_NAME fields)
+    :param profile: ProcessingProfile of the calculation, the ROI means (or estimates), SDs, voxel counts and duration are taken from it
+    :return: dict of the RESULT_FIELDS, with process_peak_rss_bytes the peak memory of the process so far (see peakRSSBytes)
+    :param fields: Any other field, e.g. the input paths (dti, proj_label, assoc_label)
+    """
+    record = dict.fromkeys(RESULT_FIELDS, "")
+    record.update(subject=subject, status=status, error=str(error).replace("\n", " "), cached=bool(cached),
+                  process_peak_rss_bytes=peakRSSBytes(), **fields)
+    if isinstance(dti_alps, dict):
+        record.update({f"dti_alps_{name}": index for name, index in dti_alps.items()})
+    elif dti_alps is not None:
+        record["dti_alps"] = dti_alps
+
+    if profile is not None:
+        record["seconds"] = profile.totalSeconds
+        record.update({field: profile.measures[name] for name, field in PROFILE_MEASURE_FIELDS.items() if name in profile.measures})
+        record.update({field: profile.counts[name] for name, field in PROFILE_COUNT_FIELDS.items() if name in profile.counts})
+
+    return record
+
+
+def _readRecordLines(path):
+    """
+    Records of a CSV or JSON-lines table. A partial last line (interrupted write) is dropped from the file.
+    """
+    if not os.path.exists(path):
+        return []
+
+    with open(path, "rb") as f:
+        content = f.read()
+    if content and not content.endswith(b"\n"):
+        with open(path, "r+b") as f:
+            f.truncate(content.rfind(b"\n")+1)
+        content = content[:content.rfind(b"\n")+1]
+
+    text = content.decode("utf-8")
+    if resultFormat(path) == "csv":
+        return list(csv.DictReader(io.StringIO(text, newline="")))
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _importPyArrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet result tables require the pyarrow package, use a .csv or .jsonl table instead")
+    return pyarrow
+
+
+def readResultRecords(path):
+    """
+    Records of a result table (.csv, .jsonl or .parquet), in writing order.
+    """
+    if resultFormat(path) == "parquet":
+        if not os.path.exists(path):
+            return []
+        return _importPyArrow().parquet.read_table(path).to_pylist()
+    return _readRecordLines(path)
+
+
+def latestRecords(records):
+    """
+    Last record of each subject, in the order of their first record (e.g. a failed subject retried when resuming).
+    """
+    latest = {}
+    for record in records:
+        latest[record["subject"]] = record
+    return list(latest.values())
+
+
+class ResultSink:
+    """
+    Append-only result table, written one record at a time.
+
+    path - Result table (.csv, .jsonl or .parquet, see resultFormat)
+    fields - Columns of a new CSV table. The fields of a record missing from the CSV columns (e.g. the dti_alps_NAME indices
+             of a multi-ROI record) are appended as new columns. JSON-lines and Parquet tables keep every field
+    resume - Keep the records of an existing table, so that finishedSubjects can be skipped, instead of starting a new table
+    records - Records of the table, including the ones written before resuming
+    """
+
+    def __init__(self, path, fields=None, resume=False):
+        self.path = path
+        self.format = resultFormat(path)
+        if self.format == "parquet":
+            _importPyArrow()
+        # Parquet files can not be appended, their records are spooled to a JSON-lines file until the sink is closed
+        self.spoolPath = path+".partial.jsonl" if self.format == "parquet" else path
+
+        if not resume:
+            for filePath in {self.path, self.spoolPath}:
+                if os.path.exists(filePath):
+                    os.remove(filePath)
+        elif self.format == "parquet" and not os.path.exists(self.spoolPath):
+            for record in readResultRecords(self.path):
+                self._append(json.dumps(record, default=str)+"\n")
+        self.records = _readRecordLines(self.spoolPath)
+
+        self.fields = list(fields or RESULT_FIELDS)
+        if self.format == "csv":
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, newline="") as f:
+                    self.fields = next(csv.reader(f))
+            else:
+                self._append(self._csvLine(self.fields))
+
+    @property
+    def finishedSubjects(self):
+        """
+        Subjects whose last record succeeded, they do not need to be processed again when resuming.
+        """
+        return {record["subject"] for record in latestRecords(self.records) if record.get("status") == "ok"}
+
+    def _csvLine(self, values):
+        line = io.StringIO()
+        csv.writer(line, lineterminator="\n").writerow(values)
+        return line.getvalue()
+
+    def _append(self, text):
+        # A single write call in append mode, so that concurrent writers (e.g. batch workers) do not interleave
+        fd = os.open(self.spoolPath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, text.encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _extendCSVFields(self, fields):
+        """
+        Append columns to the CSV table, rewriting its previous rows with the new columns empty. The table is rewritten,
+        thus the writers sharing a table (e.g. the batch workers) must only write the fields of its columns.
+        """
+        records = _readRecordLines(self.spoolPath)
+        self.fields += fields
+        tempPath = self.spoolPath+".tmp"
+        with open(tempPath, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields, extrasaction="ignore", lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(records)
+        os.replace(tempPath, self.spoolPath)
+
+    def write(self, record):
+        if self.format == "csv":
+            newFields = [field for field, value in record.items() if field not in self.fields and value not in ("", None)]
+            if newFields:
+                self._extendCSVFields(newFields)
+            self._append(self._csvLine([record.get(field, "") for field in self.fields]))
+        else:
+            self._append(json.dumps(record, default=str)+"\n")
+        self.records.append(record)
+
+    def compact(self):
+        """
+        Rewrite the table with the last record of each subject only, e.g. after failed subjects were retried.
+        """
+        records = latestRecords(_readRecordLines(self.spoolPath))
+        tempPath = self.spoolPath+".tmp"
+        with open(tempPath, "w", newline="") as f:
+            if self.format == "csv":
+                writer = csv.DictWriter(f, fieldnames=self.fields, extrasaction="ignore", lineterminator="\n")
+                writer.writeheader()
+                writer.writerows(records)
+            else:
+                f.writelines(json.dumps(record, default=str)+"\n" for record in records)
+        os.replace(tempPath, self.spoolPath)
+        self.records = records
+
+    def close(self):
+        """
+        Write the Parquet table from the spooled records. CSV and JSON-lines tables are always up to date.
+        """
+        if self.format != "parquet":
+            return
+        pyarrow = _importPyArrow()
+        # Empty fields (e.g. the index of a failed subject) are written as nulls, so that each column has a single type
+        records = [{field: (None if value == "" else value) for field, value in record.items()}
+                   for record in latestRecords(_readRecordLines(self.spoolPath))]
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(records), self.path)
+        os.remove(self.spoolPath)
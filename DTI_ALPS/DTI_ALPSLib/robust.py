@@ -0,0 +1,148 @@
+"""
+Robust ROI statistics of the tensor diagonal, which limit the weight of partial volume voxels (e.g. CSF) in the
+DTI-ALPS index.
+
+The ROI voxels are gathered once as a (voxels, components) matrix, and every statistic is then computed on it with
+whole-array operations:
+- Voxel exclusion: mean diffusivity above maxMD, fractional anisotropy below minFA, then values farther than
+  madThreshold scaled MADs from the median in any component (the same voxels are kept for all the components)
+- Location estimate of each component: mean, trimmed mean or median of the kept voxels, with their SD, median and MAD
+"""
+
+import numpy as np
+
+from .alps import DIAGONAL_COMPONENTS, roiVoxelIndices
+
+
+ESTIMATOR_METHODS = ("mean", "trimmed", "median")
+
+# MAD scale giving the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+
+
+def diffusionMeasures(tensors):
+    """
+    Mean diffusivity and fractional anisotropy of tensors with shape (..., 3, 3), from the tensor invariants
+    (no eigen decomposition): FA = sqrt(3/2) |D - MD I| / |D| with the Frobenius norm.
+    :return: (md, fa) arrays with shape (...)
+    """
+    tensors = np.asarray(tensors, dtype=np.float64)
+    md = np.trace(tensors, axis1=-2, axis2=-1)/3.0
+    deviatoric = tensors-md[..., None, None]*np.eye(3)
+    norm = np.sqrt(np.einsum("...ij,...ij->...", tensors, tensors))
+    deviatoricNorm = np.sqrt(np.einsum("...ij,...ij->...", deviatoric, deviatoric))
+    fa = np.sqrt(1.5)*np.divide(deviatoricNorm, norm, out=np.zeros_like(norm), where=norm > 0)
+    return md, fa
+
+
+class ROIEstimator:
+    """
+    ROI statistic used for the DTI-ALPS index in place of the plain ROI means.
+
+    method - Location estimate of each diagonal component: mean, trimmed (trimmed mean) or median
+    trimFraction - Fraction of the sorted values cut at each end for the trimmed mean
+    madThreshold - Exclude the voxels farther than madThreshold scaled MADs (MAD_SCALE MAD) from the median, disabled if None
+    maxMD - Exclude the voxels with a mean diffusivity above maxMD (tensor units, e.g. 0.002 for CSF in mm2/s), disabled if None
+    minFA - Exclude the voxels with a fractional anisotropy below minFA, disabled if None. The full tensors are required
+    """
+
+    def __init__(self, method="mean", trimFraction=0.1, madThreshold=None, maxMD=None, minFA=None):
+        if method not in ESTIMATOR_METHODS:
+            raise ValueError(f"Unknown ROI estimator '{method}', expected one of {', '.join(ESTIMATOR_METHODS)}")
+        if not 0.0 <= trimFraction < 0.5:
+            raise ValueError(f"Trim fraction {trimFraction} must be in [0, 0.5)")
+        if madThreshold is not None and madThreshold <= 0:
+            raise ValueError(f"MAD threshold {madThreshold} must be positive")
+        self.method = method
+        self.trimFraction = float(trimFraction)
+        self.madThreshold = madThreshold
+        self.maxMD = maxMD
+        self.minFA = minFA
+
+    @property
+    def parameters(self):
+        """
+        Estimator parameters (JSON serializable), e.g. for the result cache key.
+        """
+        parameters = {"method": self.method, "madThreshold": self.madThreshold, "maxMD": self.maxMD, "minFA": self.minFA}
+        if self.method == "trimmed":
+            parameters["trimFraction"] = self.trimFraction
+        return parameters
+
+    def roiValues(self, dtiArray, roi, components=("Dxx", "Dyy", "Dzz")):
+        """
+        Tensor diagonal components of the ROI voxels kept after the voxel exclusion.
+        :param dtiArray: Tensor array with shape (K, J, I, 3, 3), or tensor diagonal array with shape (K, J, I, 3) (no minFA)
+        :param roi: Boolean mask with shape (K, J, I) or flat voxel indices into the (K, J, I) grid
+        :return: (values, excluded) with the float64 values of the kept voxels (voxels, components) and the excluded voxel count
+        """
+        indices = roiVoxelIndices(dtiArray.shape[:3], roi)
+        isDiagonal = dtiArray.ndim == 4
+        if self.minFA is not None and isDiagonal:
+            raise ValueError("The FA voxel exclusion requires the full tensors, not only the tensor diagonal (e.g. lazy loading or DWI input)")
+
+        tensors = dtiArray.reshape(-1, 3) if isDiagonal else dtiArray.reshape(-1, 3, 3)
+        roiTensors = tensors[indices]
+        diagonal = (roiTensors if isDiagonal else np.diagonal(roiTensors, axis1=1, axis2=2)).astype(np.float64)
+        values = diagonal[:, [DIAGONAL_COMPONENTS[component] for component in components]]
+
+        keep = np.ones(indices.size, dtype=bool)
+        if self.maxMD is not None:
+            keep &= diagonal.mean(axis=1) <= self.maxMD
+        if self.minFA is not None:
+            keep &= diffusionMeasures(roiTensors)[1] >= self.minFA
+        if self.madThreshold is not None and keep.any():
+            median = np.median(values[keep], axis=0)
+            mad = np.median(np.abs(values[keep]-median), axis=0)
+            # Components without spread (MAD 0) do not reject any voxel
+            limit = np.where(mad > 0, self.madThreshold*MAD_SCALE*mad, np.inf)
+            keep &= np.all(np.abs(values-median) <= limit, axis=1)
+        if not keep.any():
+            raise ValueError("All the ROI voxels were excluded, the DTI-ALPS index can not be calculated")
+
+        return values[keep], int(indices.size-np.count_nonzero(keep))
+
+    def locate(self, sortedValues, axis=0):
+        """
+        Location estimate (method) of values sorted along the given axis, e.g. (voxels, components) or
+        (replicates, voxels, components) for a batch of bootstrap samples.
+        """
+        points = sortedValues.shape[axis]
+        if self.method == "median":
+            return np.median(sortedValues, axis=axis)
+        if self.method == "trimmed":
+            cut = int(self.trimFraction*points)
+            return np.take(sortedValues, np.arange(cut, points-cut), axis=axis).mean(axis=axis)
+        return sortedValues.mean(axis=axis)
+
+    def reduce(self, dtiArray, roi, components=("Dxx", "Dyy", "Dzz")):
+        """
+        Robust statistics of the tensor diagonal components inside a ROI, in one vectorized pass.
+        :param dtiArray: Tensor array with shape (K, J, I, 3, 3), or tensor diagonal array with shape (K, J, I, 3) (no minFA)
+        :param roi: Boolean mask with shape (K, J, I) or flat voxel indices into the (K, J, I) grid
+        :return: dict mapping each component to {"diff_value": sum, "points": kept voxels, "mean": mean, "estimate": location
+                 estimate, "sd": standard deviation, "median": median, "mad": MAD, "excluded": excluded voxels}
+        """
+        values, excluded = self.roiValues(dtiArray, roi, components)
+        kept = np.sort(values, axis=0)
+        points = kept.shape[0]
+        sums = kept.sum(axis=0)
+        median = np.median(kept, axis=0)
+        estimate = self.locate(kept)
+        sd = kept.std(axis=0, ddof=1) if points > 1 else np.zeros(len(components))
+        mad = np.median(np.abs(kept-median), axis=0)
+
+        stats = {}
+        for column, component in enumerate(components):
+            stats[component] = {
+                "diff_value": float(sums[column]),
+                "points": int(points),
+                "mean": float(sums[column])/points,
+                "estimate": float(estimate[column]),
+                "sd": float(sd[column]),
+                "median": float(median[column]),
+                "mad": float(mad[column]),
+                "excluded": excluded,
+            }
+
+        return stats
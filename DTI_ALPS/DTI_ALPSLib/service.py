@@ -0,0 +1,245 @@
+"""
+Long-running DTI-ALPS service, calculating the index of the jobs posted to a local HTTP endpoint.
+
+The service runs the core package in a single process started once, thus a job pays neither the interpreter (or Slicer)
+startup nor the MNI ROI index loading, which are kept warm. A job is a JSON object with the input paths and the options
+of the runDTIALPS.py script (see JOB_DEFAULTS), and the response is its result table record as JSON
+(see DTI_ALPSLib.results.resultRecord). Endpoints:
+- POST /jobs: calculate one job, the response is sent once it is done
+- GET /status: number of jobs done, failed and running, and the service uptime
+The results are shared with the runDTIALPS.py script through the result cache (see DTI_ALPSLib.cache).
+"""
+
+import http.server
+import json
+import os
+import threading
+import time
+
+from .alps import parseROIPairs
+from .bootstrap import ALPSBootstrap
+from .mni import loadMNIROIIndex
+from .orientation import TENSOR_AXES
+from .pipeline import calculateDTIALPSFromDWI, calculateDTIALPSFromFiles, calculateDTIALPSMultiROIFromFiles
+from .profiling import ProcessingProfile
+from .results import resultRecord
+from .robust import ESTIMATOR_METHODS, ROIEstimator
+from .volumeio import readVolumeHeader
+
+
+DEFAULT_SERVICE_HOST = "127.0.0.1"
+DEFAULT_SERVICE_PORT = 8765
+
+# Job fields and their defaults, named after the runDTIALPS.py options (the inputs after the result table fields)
+JOB_DEFAULTS = {
+    "subject": None, "dti": None, "proj_label": None, "assoc_label": None, "MNISpace": False, "MNITransform": None,
+    "bvals": None, "bvecs": None, "multiLabel": False, "roiPairs": None, "lazyLoading": False, "tensorAxes": "tensor",
+    "fitRegion": "roi", "fitMethod": "wls", "estimator": "mean", "trimFraction": 0.1, "madThreshold": None, "maxMD": None,
+    "minFA": None, "bootstrap": None, "confidence": 0.95, "seed": 0, "refresh": False,
+}
+
+# JSON types of the job fields, the fields with a None default may also be null
+JOB_TYPES = {
+    "subject": str, "dti": str, "proj_label": str, "assoc_label": str, "MNISpace": bool, "MNITransform": str, "bvals": str,
+    "bvecs": str, "multiLabel": bool, "roiPairs": (str, list), "lazyLoading": bool, "tensorAxes": str, "fitRegion": str,
+    "fitMethod": str, "estimator": str, "trimFraction": (int, float), "madThreshold": (int, float), "maxMD": (int, float),
+    "minFA": (int, float), "bootstrap": int, "confidence": (int, float), "seed": int, "refresh": bool,
+}
+
+
+class ALPSJob:
+    """
+    One DTI-ALPS calculation of the service, with the fields of JOB_DEFAULTS as attributes.
+
+    estimator - ROIEstimator of the estimator options, None for the plain ROI means
+    bootstrap - ALPSBootstrap of the bootstrap options, None without confidence interval
+    """
+
+    def __init__(self, **fields):
+        unknown = sorted(set(fields)-set(JOB_DEFAULTS))
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(unknown)}")
+        for name, default in JOB_DEFAULTS.items():
+            value = fields.get(name, default)
+            # bool is an int subclass, a true or false is not a number of the job
+            if not (value is None and default is None) and (not isinstance(value, JOB_TYPES[name]) or
+                                                            (isinstance(value, bool) and JOB_TYPES[name] is not bool)):
+                raise TypeError(f"Invalid job field {name}: {json.dumps(value)}")
+            setattr(self, name, value)
+        if isinstance(self.roiPairs, list) and not all(isinstance(pair, str) for pair in self.roiPairs):
+            raise TypeError(f"Invalid job field roiPairs: {json.dumps(self.roiPairs)}, expected NAME=PROJ:ASSOC texts")
+
+        if not self.dti:
+            raise ValueError("The job has no dti input")
+        if self.MNISpace and self.MNITransform:
+            raise ValueError("MNISpace and MNITransform cannot be used together")
+        if not self.MNISpace and not self.MNITransform and (not self.proj_label or not self.assoc_label):
+            raise ValueError("Projection and Association labels are required without MNISpace or MNITransform")
+        if self.tensorAxes not in TENSOR_AXES:
+            raise ValueError(f"Unknown tensor axes '{self.tensorAxes}', expected one of {', '.join(TENSOR_AXES)}")
+        if self.estimator not in ESTIMATOR_METHODS:
+            raise ValueError(f"Unknown estimator '{self.estimator}', expected one of {', '.join(ESTIMATOR_METHODS)}")
+        self.subject = self.subject or os.path.basename(self.dti)
+
+        if isinstance(self.roiPairs, str):
+            self.roiPairs = self.roiPairs.split()
+        self.multiROI = bool(self.multiLabel or self.roiPairs)
+        self.roiPairValues = parseROIPairs(self.roiPairs) if self.roiPairs else None
+
+        hasEstimator = self.estimator != "mean" or any(getattr(self, name) is not None for name in ["madThreshold", "maxMD", "minFA"])
+        self.estimator = ROIEstimator(self.estimator, self.trimFraction, self.madThreshold, self.maxMD, self.minFA) if hasEstimator else None
+        if self.bootstrap and self.multiROI:
+            raise ValueError("The bootstrap is calculated for a single ROI pair, not with multiLabel or roiPairs")
+        self.bootstrap = ALPSBootstrap(self.bootstrap, self.confidence, self.seed) if self.bootstrap else None
+
+    @property
+    def inputs(self):
+        return {"dti": self.dti, "proj_label": self.proj_label or "", "assoc_label": self.assoc_label or ""}
+
+    @property
+    def isDWI(self):
+        if self.bvals or self.bvecs:
+            return True
+        header = readVolumeHeader(self.dti)
+        return header.componentAxis is not None and not header.isTensor
+
+    def cacheKey(self, resultCache, isDWI):
+        """
+        Result cache key, the same as the runDTIALPS.py script for the same inputs and options.
+        """
+        return resultCache.calculationKey(self.dti, self.proj_label, self.assoc_label, self.MNISpace, isDWI, self.fitRegion,
+                                          self.fitMethod, [self.bvals, self.bvecs], self.MNITransform, self.estimator, self.bootstrap,
+                                          self.tensorAxes, self.multiROI, self.roiPairs)
+
+    def run(self, resultCache=None, profile=None):
+        """
+        Calculate the DTI-ALPS index with the core package, or take it from the result cache.
+        :return: Result table record, with status failed and the error message if the calculation failed
+        """
+        profile = profile or ProcessingProfile()
+        try:
+            isDWI = self.isDWI
+            cacheKey = None
+            if resultCache is not None:
+                with profile.stage("cacheLookup"):
+                    cacheKey = self.cacheKey(resultCache, isDWI)
+                    cached = None if self.refresh else resultCache.getResult(cacheKey, profile)
+                if cached is not None:
+                    return resultRecord(self.subject, cached, profile, cached=True, **self.inputs)
+
+            if isDWI:
+                index = calculateDTIALPSFromDWI(self.dti, self.proj_label, self.assoc_label, self.MNISpace, self.bvals, self.bvecs,
+                                                self.multiROI, self.roiPairValues, self.fitRegion, self.fitMethod, profile,
+                                                self.MNITransform, self.estimator, self.bootstrap, self.tensorAxes)
+            elif self.multiROI:
+                index = calculateDTIALPSMultiROIFromFiles(self.dti, self.proj_label, self.assoc_label, self.MNISpace, self.roiPairValues,
+                                                          self.lazyLoading, profile, self.MNITransform, self.estimator, self.tensorAxes)
+            else:
+                index = calculateDTIALPSFromFiles(self.dti, self.proj_label, self.assoc_label, self.MNISpace, self.lazyLoading, profile,
+                                                  self.MNITransform, self.estimator, self.bootstrap, self.tensorAxes)
+
+            if cacheKey:
+                with profile.stage("cacheStore"):
+                    resultCache.putResult(cacheKey, index, profile)
+            return resultRecord(self.subject, index, profile, **self.inputs)
+        except Exception as error:
+            # A failed job is reported in its record, the service keeps running
+            return resultRecord(self.subject, profile=profile, status="failed", error=error, **self.inputs)
+
+
+class ALPSService:
+    """
+    Job runner of the DTI-ALPS service, shared by the HTTP request threads.
+
+    resultCache - ResultCache shared with the runDTIALPS.py script, None to always calculate
+    jobs - Maximum number of jobs calculated at the same time, the other requests wait for their turn
+    """
+
+    def __init__(self, resultCache=None, jobs=1):
+        self.resultCache = resultCache
+        self.jobs = max(1, int(jobs))
+        self.startTime = time.time()
+        self.done, self.failed, self.running = 0, 0, 0
+        self._slots = threading.Semaphore(self.jobs)
+        self._lock = threading.Lock()
+        # Keep the MNI ROI index loaded for the MNI space and MNI transform jobs
+        loadMNIROIIndex()
+
+    def submit(self, payload):
+        """
+        Calculate one job.
+        :param payload: Job fields (see JOB_DEFAULTS)
+        :return: Result table record
+        :raises TypeError: if a job field has not the type of JOB_TYPES
+        :raises ValueError: if the job fields are not valid
+        """
+        job = ALPSJob(**payload)
+        with self._slots:
+            with self._lock:
+                self.running += 1
+            try:
+                record = job.run(self.resultCache)
+            finally:
+                with self._lock:
+                    self.running -= 1
+        with self._lock:
+            if record["status"] == "ok":
+                self.done += 1
+            else:
+                self.failed += 1
+        return record
+
+    def status(self):
+        with self._lock:
+            return {"status": "ok", "done": self.done, "failed": self.failed, "running": self.running, "jobs": self.jobs,
+                    "uptime_seconds": time.time()-self.startTime}
+
+    def createServer(self, host=DEFAULT_SERVICE_HOST, port=DEFAULT_SERVICE_PORT, verbose=False):
+        """
+        HTTP server of the service, run with its serve_forever method. Each request is handled in its own thread.
+        :param port: TCP port, 0 to pick a free one (see server_address)
+        """
+        server = http.server.ThreadingHTTPServer((host, port), _ServiceRequestHandler)
+        server.daemon_threads = True
+        server.service = self
+        server.verbose = verbose
+        return server
+
+
+class _ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def _sendJSON(self, code, value):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self._sendJSON(200, self.server.service.status())
+        else:
+            self._sendJSON(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._sendJSON(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            if not isinstance(payload, dict):
+                raise ValueError("The job must be a JSON object")
+            record = self.server.service.submit(payload)
+        except (TypeError, ValueError) as error:
+            self._sendJSON(400, {"error": str(error)})
+            return
+        except Exception as error:
+            # Answer the unexpected errors instead of dropping the connection, the service keeps running
+            self._sendJSON(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        self._sendJSON(200, record)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
@@ -0,0 +1,118 @@
+"""
+Synthetic tensor volumes and ROI masks with a known analytic DTI-ALPS index, for tests and benchmarks.
+"""
+
+import numpy as np
+
+from .tensorfit import GradientTable
+
+
+# Image shapes (K, J, I) of the synthetic volumes
+SYNTHETIC_SHAPES = {
+    "mni2mm": (91, 109, 91),
+    "mni1mm": (182, 218, 182),
+    "native-highres": (160, 256, 256),
+}
+
+# Diagonal diffusivities (mm2/s) assigned to the ROI voxels
+SYNTHETIC_DIFFUSIVITIES = {
+    "projDxx": 1.2e-3,
+    "projDyy": 0.6e-3,
+    "assocDxx": 1.1e-3,
+    "assocDzz": 0.7e-3,
+}
+
+
+class SyntheticDTI:
+    """
+    Synthetic tensor volume with Projection and Association labels.
+
+    array - Tensor array (K, J, I, 3, 3)
+    projArray, assocArray - Label arrays (K, J, I), left ROIs are labelled 1 and right ROIs are labelled 2
+    ijkToRAS - 4x4 IJK to RAS matrix
+    expected - Analytic DTI-ALPS index of the ROIs (both hemispheres)
+    """
+
+    def __init__(self, array, projArray, assocArray, ijkToRAS, expected):
+        self.array = array
+        self.projArray = projArray
+        self.assocArray = assocArray
+        self.ijkToRAS = ijkToRAS
+        self.expected = expected
+
+
+def _boxes(shape, centerK, centerJ, offsetI, halfSize):
+    # Box ROI in each hemisphere, mirrored along I
+    (K, J, I) = shape
+    boxes = []
+    for label, centerI in [(1, I//2+offsetI), (2, I//2-offsetI)]:
+        boxes.append((label, tuple(slice(center-halfSize, center+halfSize+1) for center in (centerK, centerJ, centerI))))
+    return boxes
+
+
+def syntheticDTI(shape, seed=0, spacing=None, projROI=None, assocROI=None, diffusivities=None, dtype=np.float32, ijkToRAS=None):
+    """
+    Random tensor field whose Projection and Association ROIs have constant diagonal diffusivities
+    (see SYNTHETIC_DIFFUSIVITIES), so that the DTI-ALPS index is known analytically.
+    :param shape: Image shape (K, J, I), or a SYNTHETIC_SHAPES name
+    :param spacing: Voxel size (mm), derived from the MNI 2 mm field of view if not given
+    :param projROI, assocROI: Flat voxel indices of the ROIs (e.g. the MNI ROI index), box ROIs if not given
+    :param ijkToRAS: 4x4 IJK to RAS matrix (e.g. the MNI ROI index geometry), centered axis-aligned grid if not given
+    """
+    shape = SYNTHETIC_SHAPES.get(shape, shape)
+    diffusivities = dict(SYNTHETIC_DIFFUSIVITIES, **(diffusivities or {}))
+    rng = np.random.default_rng(seed)
+
+    # Background: random symmetric tensors with realistic diffusivities
+    array = np.empty(tuple(shape)+(3, 3), dtype=dtype)
+    for row in range(3):
+        array[..., row, row] = rng.uniform(0.3e-3, 1.5e-3, size=shape).astype(dtype)
+        for column in range(row+1, 3):
+            array[..., row, column] = rng.uniform(-0.1e-3, 0.1e-3, size=shape).astype(dtype)
+            array[..., column, row] = array[..., row, column]
+
+    projArray = np.zeros(shape, dtype=np.uint8)
+    assocArray = np.zeros(shape, dtype=np.uint8)
+    if projROI is not None and assocROI is not None:
+        projArray.flat[projROI] = 1
+        assocArray.flat[assocROI] = 1
+    else:
+        halfSize = max(1, min(shape)//40)
+        for label, box in _boxes(shape, shape[0]//2, shape[1]//2, shape[2]//5, halfSize):
+            projArray[box] = label
+        for label, box in _boxes(shape, shape[0]//2, shape[1]//2, shape[2]//5+2*halfSize+2, halfSize):
+            assocArray[box] = label
+
+    projMask, assocMask = projArray != 0, assocArray != 0
+    array[projMask, 0, 0] = diffusivities["projDxx"]
+    array[projMask, 1, 1] = diffusivities["projDyy"]
+    array[assocMask, 0, 0] = diffusivities["assocDxx"]
+    array[assocMask, 2, 2] = diffusivities["assocDzz"]
+
+    # Analytic index of the values as stored (rounded to the array precision)
+    stored = {name: float(dtype(value)) for name, value in diffusivities.items()}
+    expected = (stored["projDxx"]+stored["assocDxx"])/(stored["projDyy"]+stored["assocDzz"])
+
+    if ijkToRAS is None:
+        if spacing is None:
+            spacing = 2.0*91/shape[2]
+        ijkToRAS = np.diag([spacing, spacing, spacing, 1.0])
+        ijkToRAS[:3, 3] = -spacing*np.array(shape[::-1])/2
+
+    return SyntheticDTI(array, projArray, assocArray, ijkToRAS, expected)
+
+
+def syntheticDWI(synthetic, bValue=1000.0, directions=30, b0Volumes=2, s0=1000.0, seed=0, dtype=np.float32):
+    """
+    Noise-free DWI signals of a synthetic tensor volume, S = S0 exp(-b g^T D g), with random gradient directions.
+    :param synthetic: SyntheticDTI with the tensors in the RAS frame
+    :return: (signals with shape (K, J, I, N), GradientTable)
+    """
+    rng = np.random.default_rng(seed)
+    bvecs = rng.normal(size=(directions, 3))
+    bvecs /= np.linalg.norm(bvecs, axis=1, keepdims=True)
+    gradients = GradientTable(np.r_[np.zeros(b0Volumes), np.full(directions, bValue)], np.r_[np.zeros((b0Volumes, 3)), bvecs])
+
+    diffusivity = np.einsum("na,kjiab,nb->kjin", gradients.bvecs, synthetic.array.astype(np.float64), gradients.bvecs)
+    signals = s0*np.exp(-gradients.bvals*diffusivity)
+    return signals.astype(dtype), gradients
@@ -0,0 +1,153 @@
+"""
+Background processing queue, so that a GUI stays responsive while DTI-ALPS indices are calculated.
+
+The tasks are run one at a time, in submission order, by a single background thread. They are plain functions of a
+ProcessingProfile, which must not access the Slicer scene (only the main thread may), and they are cancelled at their
+next processing stage (see ProcessingProfile.stageCallback). The caller collects the finished tasks from its own thread,
+e.g. from a timer, with TaskQueue.popFinished.
+"""
+
+import collections
+import threading
+
+from .profiling import ProcessingCancelled, ProcessingProfile
+
+
+TASK_QUEUED = "queued"
+TASK_RUNNING = "running"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+TASK_CANCELLED = "cancelled"
+
+TASK_FINISHED_STATUSES = (TASK_DONE, TASK_FAILED, TASK_CANCELLED)
+
+
+class ProcessingTask:
+    """
+    One queued calculation.
+
+    name - Task name (e.g. the DTI volume name)
+    function - Function of the task profile returning the task result
+    profile - ProcessingProfile filled by the function
+    status - queued, running, done, failed or cancelled
+    stage - Name of the last processing stage started by the function
+    result - Return value of the function once done
+    error - Exception raised by the function once failed
+    """
+
+    def __init__(self, name, function, profile=None):
+        self.name = name
+        self.function = function
+        self.profile = profile or ProcessingProfile()
+        self.status = TASK_QUEUED
+        self.stage = ""
+        self.result = None
+        self.error = None
+        self._cancelEvent = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in TASK_FINISHED_STATUSES
+
+    def cancel(self):
+        """
+        Request the cancellation, effective at the next processing stage of a running task.
+        """
+        self._cancelEvent.set()
+
+    def _enterStage(self, name):
+        if self._cancelEvent.is_set():
+            raise ProcessingCancelled(f"{self.name} was cancelled")
+        self.stage = name
+
+    def run(self):
+        if self._cancelEvent.is_set():
+            self.status = TASK_CANCELLED
+            return
+        self.status = TASK_RUNNING
+        self.profile.stageCallback = self._enterStage
+        try:
+            self.result = self.function(self.profile)
+            self.status = TASK_DONE
+        except ProcessingCancelled:
+            self.status = TASK_CANCELLED
+        except Exception as error:
+            self.error = error
+            self.status = TASK_FAILED
+        finally:
+            self.profile.stageCallback = None
+
+
+class TaskQueue:
+    """
+    First-in first-out queue of ProcessingTask run by a single background (daemon) thread, started with the first task.
+
+    tasks - Every task submitted and not collected yet by popFinished, in submission order
+    """
+
+    def __init__(self):
+        self.tasks = []
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, name, function, profile=None):
+        """
+        Queue a function of a ProcessingProfile, see ProcessingTask.
+        :return: ProcessingTask
+        """
+        task = ProcessingTask(name, function, profile)
+        with self._condition:
+            self.tasks.append(task)
+            self._pending.append(task)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._runTasks, name="DTI-ALPS tasks", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+        return task
+
+    def _runTasks(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                task = self._pending[0]
+            task.run()
+            with self._condition:
+                self._pending.popleft()
+                self._condition.notify_all()
+
+    @property
+    def runningTask(self):
+        with self._condition:
+            return next((task for task in self._pending if task.status == TASK_RUNNING), None)
+
+    @property
+    def idle(self):
+        with self._condition:
+            return not self._pending
+
+    def cancelAll(self):
+        """
+        Cancel the running task (at its next processing stage) and all the queued tasks.
+        """
+        with self._condition:
+            for task in self._pending:
+                task.cancel()
+
+    def wait(self, timeout=None):
+        """
+        Block until every submitted task is finished, e.g. in scripts and tests.
+        :return: False if the timeout expired before
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending, timeout)
+
+    def popFinished(self):
+        """
+        Finished tasks not collected yet, in submission order. They are removed from tasks.
+        """
+        with self._condition:
+            finished = [task for task in self.tasks if task.finished]
+            self.tasks = [task for task in self.tasks if not task.finished]
+        return finished
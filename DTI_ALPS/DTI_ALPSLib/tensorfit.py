@@ -0,0 +1,202 @@
+"""
+Diffusion tensor estimation from DWI signals, restricted to the DTI-ALPS ROIs.
+
+The tensors are fitted with a log-linear least squares model, solved for all the voxels at once (batched), and
+expressed in the RAS frame, so that Dxx, Dyy and Dzz are along the right-left, anterior-posterior and
+superior-inferior axes. Only the ROI voxels (or their bounding box) are fitted, the whole-brain fit is never needed.
+"""
+
+import numpy as np
+
+from .alps import roiBounds
+from .profiling import ProcessingProfile
+from .volumeio import isNRRD, readNRRDKeyValues, readVolumeHeader
+
+
+# Fitted region: only the ROI voxels, or every voxel of the ROIs bounding box
+FIT_REGIONS = ("roi", "bounds")
+FIT_METHODS = ("ols", "wls")
+
+
+class GradientTable:
+    """
+    Diffusion weighting of each DWI volume.
+
+    bvals - b-values (s/mm2) with shape (N,)
+    bvecs - Unit gradient directions in the RAS frame with shape (N, 3), zero for b0 volumes
+    """
+
+    def __init__(self, bvals, bvecs):
+        self.bvals = np.asarray(bvals, dtype=np.float64)
+        self.bvecs = np.asarray(bvecs, dtype=np.float64)
+        if self.bvecs.shape != (self.bvals.size, 3):
+            raise ValueError(f"Gradient table mismatch: {self.bvals.size} b-values and {self.bvecs.shape[0]} gradient directions")
+
+    def __len__(self):
+        return self.bvals.size
+
+
+def _unitVectors(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def readFSLGradients(bvalsPath, bvecsPath, ijkToRAS):
+    """
+    Read FSL bvals/bvecs files. FSL gradient directions are given along the image axes, with the first axis
+    flipped for images stored with a positive determinant (neurological order).
+    :param ijkToRAS: 4x4 IJK to RAS matrix of the DWI image
+    """
+    bvals = np.loadtxt(bvalsPath, dtype=np.float64).ravel()
+    bvecs = np.loadtxt(bvecsPath, dtype=np.float64)
+    if bvecs.ndim != 2 or 3 not in bvecs.shape:
+        raise ValueError(f"Invalid bvecs file {bvecsPath}, 3 rows (or 3 columns) are expected")
+    if bvecs.shape[0] == 3:
+        # FSL layout is 3 rows, one column per volume
+        bvecs = bvecs.T
+
+    directions = np.asarray(ijkToRAS, dtype=np.float64)[:3, :3]
+    directions = directions/np.linalg.norm(directions, axis=0)
+    bvecs = _unitVectors(bvecs)
+    if np.linalg.det(directions) > 0:
+        bvecs[:, 0] = -bvecs[:, 0]
+
+    return GradientTable(bvals, bvecs @ directions.T)
+
+
+def readNRRDGradients(path, measurementFrame=None):
+    """
+    Read the DWMRI gradients of a NRRD DWI file. The b-value of each volume is scaled by its squared gradient norm.
+    :param measurementFrame: 3x3 matrix mapping the gradients frame to RAS (see VolumeHeader.measurementFrame)
+    """
+    keyValues = readNRRDKeyValues(path)
+    if "DWMRI_b-value" not in keyValues:
+        raise ValueError(f"{path} has no DWMRI gradients, give the bvals and bvecs files")
+
+    bValue = float(keyValues["DWMRI_b-value"])
+    gradients = []
+    while f"DWMRI_gradient_{len(gradients):04d}" in keyValues:
+        gradients.append([float(value) for value in keyValues[f"DWMRI_gradient_{len(gradients):04d}"].split()])
+    gradients = np.array(gradients, dtype=np.float64).reshape(-1, 3)
+
+    frame = np.eye(3) if measurementFrame is None else np.asarray(measurementFrame, dtype=np.float64)
+    return GradientTable(bValue*np.sum(gradients**2, axis=1), _unitVectors(gradients) @ frame.T)
+
+
+def nrrdGradientKeyValues(gradients):
+    """
+    NRRD DWMRI key/value pairs of a gradient table (see DTI_ALPSLib.volumeio.writeNRRD), the inverse of readNRRDGradients.
+    """
+    bValue = float(gradients.bvals.max())
+    scales = np.sqrt(gradients.bvals/bValue) if bValue > 0 else np.zeros_like(gradients.bvals)
+    keyValues = {"modality": "DWMRI", "DWMRI_b-value": repr(bValue)}
+    for number, gradient in enumerate(gradients.bvecs*scales[:, None]):
+        keyValues[f"DWMRI_gradient_{number:04d}"] = " ".join(repr(float(value)) for value in gradient)
+    return keyValues
+
+
+def readDWIHeader(path):
+    """
+    Voxel data layout and geometry of a DWI file (NRRD or 4D NIfTI), without reading the voxel data.
+    """
+    header = readVolumeHeader(path)
+    if header.componentAxis is None or (isNRRD(path) and header.isTensor):
+        raise ValueError(f"Input image is not a DWI volume: {path}")
+    # NIfTI has no tensor kind, thus a DWI with 6 or 9 volumes must not be read as a tensor volume
+    header.tensorKind = None
+    return header
+
+
+def readGradientTable(dwiPath, bvalsPath=None, bvecsPath=None, header=None):
+    """
+    Gradient table of a DWI file, from the FSL bvals/bvecs files if given, or from the NRRD DWMRI header fields.
+    """
+    header = header or readDWIHeader(dwiPath)
+    if bvalsPath or bvecsPath:
+        if not bvalsPath or not bvecsPath:
+            raise ValueError("Both bvals and bvecs files are required")
+        return readFSLGradients(bvalsPath, bvecsPath, header.ijkToRAS)
+    if isNRRD(dwiPath):
+        return readNRRDGradients(dwiPath, header.measurementFrame)
+    raise ValueError(f"Gradient table of {dwiPath} not found, give the bvals and bvecs files")
+
+
+def tensorDesignMatrix(gradients):
+    """
+    Log-linear tensor model: ln(S) = ln(S0) - b g^T D g, with the unknowns (ln(S0), Dxx, Dxy, Dxz, Dyy, Dyz, Dzz).
+    """
+    b, (x, y, z) = gradients.bvals, gradients.bvecs.T
+    return np.stack([np.ones_like(b), -b*x*x, -2*b*x*y, -2*b*x*z, -b*y*y, -2*b*y*z, -b*z*z], axis=1)
+
+
+def fitTensors(signals, gradients, method="wls"):
+    """
+    Fit the diffusion tensor of many voxels at once.
+    :param signals: DWI signals with shape (voxels, N)
+    :param method: ols (ordinary least squares) or wls (weighted least squares, one iteration over the ols fit)
+    :return: Tensor array with shape (voxels, 3, 3), zero for voxels without signal
+    """
+    if method not in FIT_METHODS:
+        raise ValueError(f"Unknown tensor fitting method '{method}', expected one of {FIT_METHODS}")
+
+    design = tensorDesignMatrix(gradients)
+    signals = np.asarray(signals, dtype=np.float64)
+    if signals.shape[-1] != design.shape[0]:
+        raise ValueError(f"DWI has {signals.shape[-1]} volumes but the gradient table has {design.shape[0]} entries")
+    if np.linalg.matrix_rank(design) < design.shape[1]:
+        raise ValueError("Gradient table does not allow a tensor fit (at least one b0 and 6 non-collinear directions are needed)")
+
+    # Non-positive signals are clamped before the logarithm, voxels without any signal are left empty
+    maxSignal = signals.max(axis=-1, keepdims=True)
+    valid = maxSignal[:, 0] > 0
+    logSignals = np.log(np.maximum(signals[valid], maxSignal[valid]*1e-6))
+
+    coefficients = logSignals @ np.linalg.pinv(design).T
+    if method == "wls":
+        # Weights are the squared predicted signals, the normal equations of all the voxels are solved in one batch
+        weights = np.exp(2*(coefficients @ design.T))
+        normal = np.einsum("ni,vn,nj->vij", design, weights, design)
+        rhs = np.einsum("ni,vn,vn->vi", design, weights, logSignals)
+        coefficients = np.linalg.solve(normal, rhs[..., None])[..., 0]
+
+    xx, xy, xz, yy, yz, zz = (coefficients[:, n] for n in range(1, 7))
+    tensors = np.zeros((signals.shape[0], 3, 3))
+    tensors[valid] = np.stack([np.stack([xx, xy, xz], -1), np.stack([xy, yy, yz], -1), np.stack([xz, yz, zz], -1)], axis=-2)
+    return tensors
+
+
+def fitROITensorDiagonal(signals, gradients, projArray, assocArray, fitRegion="roi", method="wls", profile=None, axesMatrix=None):
+    """
+    Fit the tensors inside the ROIs bounding box only, and keep their diagonal.
+    :param signals: DWI array with shape (K, J, I, N)
+    :param projArray, assocArray: Label arrays with shape (K, J, I)
+    :param fitRegion: roi to fit only the ROI voxels, or bounds to fit every voxel of their bounding box
+    :param profile: ProcessingProfile where the fitting stage and the fitted voxel count are recorded
+    :param axesMatrix: Directions (gradients frame) of Dxx, Dyy and Dzz as columns, the gradients frame axes if not given
+                       (see DTI_ALPSLib.orientation.tensorAxesMatrix)
+    :return: (diagonal, projArray, assocArray) cropped to the ROIs bounding box, the diagonal with shape (k, j, i, 3)
+    """
+    if fitRegion not in FIT_REGIONS:
+        raise ValueError(f"Unknown fitting region '{fitRegion}', expected one of {FIT_REGIONS}")
+    if signals.shape[:3] != projArray.shape or signals.shape[:3] != assocArray.shape:
+        raise ValueError(f"Label shapes {projArray.shape} and {assocArray.shape} do not match the DWI image shape {signals.shape[:3]}")
+
+    profile = profile or ProcessingProfile()
+    (k0, k1), (j0, j1), (i0, i1) = roiBounds(projArray.shape, projArray != 0, assocArray != 0)
+    signals = signals[k0:k1, j0:j1, i0:i1]
+    projArray, assocArray = projArray[k0:k1, j0:j1, i0:i1], assocArray[k0:k1, j0:j1, i0:i1]
+
+    with profile.stage("fitTensors"):
+        if fitRegion == "roi":
+            mask = (projArray != 0) | (assocArray != 0)
+        else:
+            mask = np.ones(projArray.shape, dtype=bool)
+        tensors = fitTensors(signals[mask], gradients, method)
+        diagonal = np.zeros(projArray.shape+(3,))
+        if axesMatrix is None:
+            diagonal[mask] = np.diagonal(tensors, axis1=1, axis2=2)
+        else:
+            diagonal[mask] = np.einsum("ia,nij,ja->na", axesMatrix, tensors, axesMatrix, optimize=True)
+    profile.count("fittedVoxels", tensors.shape[0])
+
+    return diagonal, projArray, assocArray
@@ -0,0 +1,782 @@
+"""
+Minimal NRRD and NIfTI-1 readers, so that the DTI-ALPS index can be calculated without the Slicer application.
+
+The voxel arrays are returned in the same axis order given by slicer.util.arrayFromVolume, i.e. (K, J, I) for
+scalar volumes, (K, J, I, 3, 3) for tensor volumes and (K, J, I, N) for other multi-component volumes (e.g. DWI),
+and the geometry is given as an IJK to RAS matrix.
+"""
+
+import bz2
+import gzip
+import os
+import re
+import struct
+
+import numpy as np
+
+
+NRRD_TYPES = {
+    "int8": "i1", "signed char": "i1", "char": "i1", "int8_t": "i1",
+    "uint8": "u1", "unsigned char": "u1", "uchar": "u1", "uint8_t": "u1",
+    "int16": "i2", "short": "i2", "short int": "i2", "signed short": "i2", "signed short int": "i2", "int16_t": "i2",
+    "uint16": "u2", "ushort": "u2", "unsigned short": "u2", "unsigned short int": "u2", "uint16_t": "u2",
+    "int32": "i4", "int": "i4", "signed int": "i4", "int32_t": "i4",
+    "uint32": "u4", "uint": "u4", "unsigned int": "u4", "uint32_t": "u4",
+    "int64": "i8", "longlong": "i8", "long long": "i8", "long long int": "i8", "signed long long": "i8",
+    "signed long long int": "i8", "int64_t": "i8",
+    "uint64": "u8", "ulonglong": "u8", "unsigned long long": "u8", "unsigned long long int": "u8", "uint64_t": "u8",
+    "float": "f4", "double": "f8",
+}
+
+# NRRD type written for each numpy type
+NRRD_WRITE_TYPES = {"i1": "int8", "u1": "uint8", "i2": "int16", "u2": "uint16", "i4": "int32", "u4": "uint32",
+                    "i8": "int64", "u8": "uint64", "f4": "float", "f8": "double"}
+
+NIFTI_TYPES = {
+    2: "u1", 4: "i2", 8: "i4", 16: "f4", 64: "f8",
+    256: "i1", 512: "u2", 768: "u4", 1024: "i8", 1280: "u8",
+}
+
+NIFTI_INTENT_SYMMATRIX = 1005
+
+# Number of stored components for each NRRD tensor kind
+NRRD_TENSOR_KINDS = {
+    "3d-matrix": 9,
+    "3d-symmetric-matrix": 6,
+    "3d-masked-symmetric-matrix": 7,
+    "3d-diagonal-matrix": 3,
+}
+
+# Tensor kind of the compact tensor diagonal files (see writeTensorDiagonal)
+TENSOR_DIAGONAL_KIND = "3d-diagonal-matrix"
+
+# Stored channels of the tensor diagonal (Dxx, Dyy, Dzz) for each tensor components layout
+TENSOR_DIAGONAL_CHANNELS = {
+    "3d-matrix": [0, 4, 8],
+    "3d-symmetric-matrix": [0, 3, 5],
+    "3d-masked-symmetric-matrix": [1, 4, 6],
+    "nifti-symmetric-matrix": [0, 2, 5],
+    "3d-diagonal-matrix": [0, 1, 2],
+}
+
+LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0])
+
+# Maximum size of the decompressed slabs kept in memory when streaming compressed tensor data
+STREAM_SLAB_BYTES = 64*1024*1024
+
+
+class _Geometry:
+
+    @property
+    def spacing(self):
+        return np.linalg.norm(self.ijkToRAS[:3, :3], axis=0)
+
+    @property
+    def origin(self):
+        return self.ijkToRAS[:3, 3]
+
+
+class Volume(_Geometry):
+    """
+    Voxel array and geometry of an image read from disk.
+
+    array - Voxel array, (K, J, I) for scalar volumes, (K, J, I, 3, 3) for tensor volumes,
+            (K, J, I, 3) for the tensor diagonal only (Dxx, Dyy, Dzz) or (K, J, I, N) for multi-component volumes
+    ijkToRAS - 4x4 matrix mapping the voxel IJK coordinates to RAS
+    measurementFrame - 3x3 matrix mapping the tensor frame to the RAS frame (identity when not given)
+    """
+
+    def __init__(self, array, ijkToRAS, measurementFrame=None):
+        self.array = array
+        self.ijkToRAS = ijkToRAS
+        self.measurementFrame = np.eye(3) if measurementFrame is None else measurementFrame
+
+    @property
+    def shape(self):
+        return self.array.shape[:3]
+
+    @property
+    def isTensor(self):
+        return self.array.ndim == 5
+
+
+class VolumeHeader(_Geometry):
+    """
+    Voxel data layout and geometry of an image file, read without touching the voxel data.
+
+    dataPath - File holding the voxel data
+    fileOffset - Byte offset in the file where the (possibly compressed) data stream starts
+    streamOffset - Byte offset of the voxel data in the (decompressed) data stream
+    encoding - raw, gzip, bzip2 or ascii
+    dtype - Voxel data type, with byte order
+    diskShape - Voxel data shape in storage order (slowest axis first)
+    componentAxis - Position of the tensor (or DWI) components axis in diskShape (None for scalar volumes)
+    tensorKind - Tensor components layout (see TENSOR_DIAGONAL_CHANNELS), None for scalar volumes
+    scaling - (slope, intercept) applied to the stored values
+    """
+
+    def __init__(self, dataPath, fileOffset, streamOffset, encoding, dtype, diskShape, componentAxis, tensorKind,
+                 ijkToRAS, measurementFrame=None, scaling=(1.0, 0.0)):
+        self.dataPath = dataPath
+        self.fileOffset = fileOffset
+        self.streamOffset = streamOffset
+        self.encoding = encoding
+        self.dtype = dtype
+        self.diskShape = tuple(diskShape)
+        self.componentAxis = componentAxis
+        self.tensorKind = tensorKind
+        self.ijkToRAS = ijkToRAS
+        self.measurementFrame = np.eye(3) if measurementFrame is None else measurementFrame
+        self.scaling = scaling
+
+    @property
+    def shape(self):
+        return tuple(size for axis, size in enumerate(self.diskShape) if axis != self.componentAxis)
+
+    @property
+    def isTensor(self):
+        return self.tensorKind is not None
+
+    @property
+    def isTensorDiagonal(self):
+        """
+        True for a tensor diagonal file (see writeTensorDiagonal), which holds Dxx, Dyy and Dzz only.
+        """
+        return self.tensorKind == TENSOR_DIAGONAL_KIND
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.diskShape))*self.dtype.itemsize
+
+
+def expandSymmetricTensor(components):
+    """
+    Expand the 6 unique tensor components (xx, xy, xz, yy, yz, zz) at the last axis to a full 3x3 matrix.
+    """
+    xx, xy, xz, yy, yz, zz = (components[..., n] for n in range(6))
+    tensors = np.empty(components.shape[:-1]+(3, 3), dtype=components.dtype)
+    tensors[..., 0, 0] = xx
+    tensors[..., 0, 1] = tensors[..., 1, 0] = xy
+    tensors[..., 0, 2] = tensors[..., 2, 0] = xz
+    tensors[..., 1, 1] = yy
+    tensors[..., 1, 2] = tensors[..., 2, 1] = yz
+    tensors[..., 2, 2] = zz
+    return tensors
+
+
+def _openStream(header):
+    """
+    Open the voxel data stream, returns the (decompressing) file object and the position of the voxel data in it.
+    """
+    f = open(header.dataPath, "rb")
+    if header.encoding in ("gzip", "gz"):
+        f.seek(header.fileOffset)
+        return gzip.GzipFile(fileobj=f), header.streamOffset
+    if header.encoding in ("bzip2", "bz2"):
+        f.seek(header.fileOffset)
+        return bz2.BZ2File(f), header.streamOffset
+    return f, header.fileOffset+header.streamOffset
+
+
+def _skipLines(path, offset, lines):
+    """
+    Byte offset after skipping lines from the offset of a file (NRRD line skip).
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for _ in range(lines):
+            if not f.readline():
+                raise ValueError(f"NRRD line skip {lines} is beyond the end of {path}")
+        return f.tell()
+
+
+def _parseVector(text):
+    text = text.strip()
+    if text == "none":
+        return None
+    return [float(value) for value in text.strip("()").split(",")]
+
+
+def _parseVectorList(text):
+    return [_parseVector(item) for item in re.findall(r"\([^)]*\)|none", text)]
+
+
+def readNRRDKeyValues(path):
+    """
+    Read the key/value pairs (key:=value lines) of a NRRD header, e.g. the DWMRI gradients.
+    """
+    keyValues = {}
+    with open(path, "rb") as f:
+        f.readline()
+        while True:
+            line = f.readline()
+            if not line or not line.strip():
+                break
+            line = line.decode("latin-1").rstrip("\r\n")
+            if ":=" in line and not line.startswith("#"):
+                key, _, value = line.partition(":=")
+                keyValues[key] = value
+
+    return keyValues
+
+
+def readNRRDHeader(path):
+    """
+    Read the NRRD header fields (lower case names) and the byte offset where the attached data starts.
+    """
+    fields = {}
+    with open(path, "rb") as f:
+        magic = f.readline().decode("ascii").strip()
+        if not magic.startswith("NRRD"):
+            raise ValueError(f"{path} is not a NRRD file")
+        while True:
+            line = f.readline()
+            if not line or not line.strip():
+                break
+            line = line.decode("latin-1").rstrip("\r\n")
+            if line.startswith("#") or ":=" in line:
+                continue
+            key, _, value = line.partition(":")
+            fields[key.strip().lower()] = value.strip()
+        dataOffset = f.tell()
+
+    return fields, dataOffset
+
+
+def nrrdGeometry(fields):
+    """
+    IJK to RAS matrix and measurement frame (in RAS) from the NRRD header fields.
+    """
+    dimension = int(fields["dimension"])
+    kinds = fields.get("kinds", " ".join(["domain"]*dimension)).lower().split()
+    space = fields.get("space", "right-anterior-superior").lower()
+    spaceToRAS = LPS_TO_RAS if space in ("left-posterior-superior", "lps") else np.eye(3)
+
+    ijkToRAS = np.eye(4)
+    if "space directions" in fields:
+        directions = [vector for vector in _parseVectorList(fields["space directions"]) if vector is not None]
+        ijkToRAS[:3, :3] = spaceToRAS @ np.array(directions).T
+    elif "spacings" in fields:
+        spacings = [float(value) for value, kind in zip(fields["spacings"].split(), kinds) if kind not in NRRD_TENSOR_KINDS]
+        ijkToRAS[:3, :3] = np.diag(spacings[:3])
+    if "space origin" in fields:
+        ijkToRAS[:3, 3] = spaceToRAS @ np.array(_parseVector(fields["space origin"]))
+
+    measurementFrame = None
+    if "measurement frame" in fields:
+        measurementFrame = spaceToRAS @ np.array(_parseVectorList(fields["measurement frame"])).T
+
+    return ijkToRAS, measurementFrame
+
+
+def readNRRDVolumeHeader(path):
+    """
+    Voxel data layout and geometry of a NRRD file (attached or detached data).
+    """
+    fields, dataOffset = readNRRDHeader(path)
+
+    sizes = [int(size) for size in fields["sizes"].split()]
+    dimension = int(fields["dimension"])
+    kinds = fields.get("kinds", " ".join(["domain"]*dimension)).lower().split()
+    dtype = np.dtype(NRRD_TYPES[fields["type"].lower()])
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder("<" if fields.get("endian", "little") == "little" else ">")
+    encoding = fields.get("encoding", "raw").lower()
+
+    dataPath = path
+    if "data file" in fields or "datafile" in fields:
+        dataPath = os.path.join(os.path.dirname(path), fields.get("data file", fields.get("datafile")))
+        dataOffset = 0
+
+    # The lines are skipped in the file, the bytes in the decompressed stream for the gzip and bzip2 encodings
+    lineSkip = int(fields.get("line skip", fields.get("lineskip", 0)))
+    byteSkip = int(fields.get("byte skip", fields.get("byteskip", 0)))
+    streamOffset = 0
+    if lineSkip:
+        dataOffset = _skipLines(dataPath, dataOffset, lineSkip)
+    if byteSkip == -1:
+        # The data is at the end of the file, which can only be located without decompressing it
+        if encoding != "raw":
+            raise ValueError(f"NRRD byte skip -1 requires the raw encoding, not {encoding}: {path}")
+        dataOffset = os.path.getsize(dataPath)-int(np.prod(sizes))*dtype.itemsize
+    elif encoding in ("gzip", "gz", "bzip2", "bz2"):
+        streamOffset = byteSkip
+    else:
+        dataOffset += byteSkip
+
+    # NRRD fastest axis is the first one, thus reversing the sizes gives the arrayFromVolume order.
+    # The non-spatial axis holds the tensor components, or the gradient volumes of a DWI (e.g. list kind).
+    componentAxis, tensorKind = None, None
+    componentAxes = [axis for axis, kind in enumerate(kinds) if kind not in ("domain", "space")]
+    if dimension > 3 and componentAxes:
+        componentAxis = dimension-1-componentAxes[0]
+        if kinds[componentAxes[0]] in NRRD_TENSOR_KINDS:
+            tensorKind = kinds[componentAxes[0]]
+
+    ijkToRAS, measurementFrame = nrrdGeometry(fields)
+    return VolumeHeader(dataPath, dataOffset, streamOffset, encoding, dtype, sizes[::-1], componentAxis, tensorKind,
+                        ijkToRAS, measurementFrame)
+
+
+def readNIfTIHeader(path):
+    """
+    Read the NIfTI-1 header fields needed to read the voxel data and its geometry.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        header = f.read(348)
+
+    endian = "<"
+    if struct.unpack("<i", header[:4])[0] != 348:
+        endian = ">"
+        if struct.unpack(">i", header[:4])[0] != 348:
+            raise ValueError(f"{path} is not a NIfTI-1 file")
+
+    def unpack(fmt, offset):
+        return struct.unpack_from(endian+fmt, header, offset)
+
+    fields = {
+        "endian": endian,
+        "dim": unpack("8h", 40),
+        "intent_code": unpack("h", 68)[0],
+        "datatype": unpack("h", 70)[0],
+        "pixdim": unpack("8f", 76),
+        "vox_offset": unpack("f", 108)[0],
+        "scl_slope": unpack("f", 112)[0],
+        "scl_inter": unpack("f", 116)[0],
+        "qform_code": unpack("h", 252)[0],
+        "sform_code": unpack("h", 254)[0],
+        "quatern": unpack("6f", 256),
+        "srow": unpack("12f", 280),
+    }
+    return fields
+
+
+def niftiGeometry(fields):
+    """
+    IJK to RAS matrix from the NIfTI sform (preferred) or qform.
+    """
+    pixdim = fields["pixdim"]
+    ijkToRAS = np.eye(4)
+    if fields["sform_code"] > 0:
+        ijkToRAS[:3, :] = np.array(fields["srow"]).reshape(3, 4)
+    elif fields["qform_code"] > 0:
+        b, c, d, qx, qy, qz = fields["quatern"]
+        a = np.sqrt(max(0.0, 1.0-(b*b+c*c+d*d)))
+        rotation = np.array([
+            [a*a+b*b-c*c-d*d, 2*(b*c-a*d), 2*(b*d+a*c)],
+            [2*(b*c+a*d), a*a+c*c-b*b-d*d, 2*(c*d-a*b)],
+            [2*(b*d-a*c), 2*(c*d+a*b), a*a+d*d-c*c-b*b],
+        ])
+        qfac = -1.0 if pixdim[0] < 0 else 1.0
+        ijkToRAS[:3, :3] = rotation*np.array([pixdim[1], pixdim[2], pixdim[3]*qfac])
+        ijkToRAS[:3, 3] = [qx, qy, qz]
+    else:
+        ijkToRAS[:3, :3] = np.diag(pixdim[1:4])
+
+    return ijkToRAS
+
+
+def readNIfTIVolumeHeader(path):
+    """
+    Voxel data layout and geometry of a NIfTI-1 file. Tensor volumes are stored either as a 4D image with
+    6 volumes (xx, xy, xz, yy, yz, zz), as the NIfTI symmetric matrix intent (lower triangular) or with 9 volumes.
+    """
+    fields = readNIfTIHeader(path)
+    ndim = fields["dim"][0]
+    sizes = list(fields["dim"][1:ndim+1])
+    dtype = np.dtype(NIFTI_TYPES[fields["datatype"]]).newbyteorder(fields["endian"])
+
+    # NIfTI fastest axis is the first one, thus reversing the sizes gives the arrayFromVolume order.
+    # Any dimension after the third one holds the tensor components (singleton dimensions are dropped).
+    diskShape = sizes[:3][::-1]
+    components = int(np.prod(sizes[3:]))
+    componentAxis, tensorKind = None, None
+    if components > 1:
+        diskShape = [components]+diskShape
+        componentAxis = 0
+        if components == 9:
+            tensorKind = "3d-matrix"
+        elif components == 6:
+            tensorKind = "nifti-symmetric-matrix" if fields["intent_code"] == NIFTI_INTENT_SYMMATRIX else "3d-symmetric-matrix"
+
+    scaling = (1.0, 0.0)
+    slope, intercept = fields["scl_slope"], fields["scl_inter"]
+    if slope not in (0.0, 1.0) or intercept != 0.0:
+        scaling = (slope if slope != 0.0 else 1.0, intercept)
+
+    encoding = "gzip" if path.lower().endswith(".gz") else "raw"
+    return VolumeHeader(path, 0, int(fields["vox_offset"]), encoding, dtype, diskShape, componentAxis, tensorKind,
+                        niftiGeometry(fields), scaling=scaling)
+
+
+def isNRRD(path):
+    return path.lower().endswith((".nrrd", ".nhdr"))
+
+
+def isNIfTI(path):
+    return path.lower().endswith((".nii", ".nii.gz"))
+
+
+def readVolumeHeader(path):
+    """
+    Voxel data layout and geometry of a NRRD (.nrrd, .nhdr) or NIfTI (.nii, .nii.gz) file, without reading the voxel data.
+    """
+    if isNRRD(path):
+        return readNRRDVolumeHeader(path)
+    if isNIfTI(path):
+        return readNIfTIVolumeHeader(path)
+    raise ValueError(f"Unsupported image format: {path}. Only NRRD and NIfTI files can be read without Slicer.")
+
+
+def _asHeader(source):
+    return source if isinstance(source, VolumeHeader) else readVolumeHeader(source)
+
+
+def _applyScaling(array, header):
+    slope, intercept = header.scaling
+    if slope != 1.0 or intercept != 0.0:
+        return array*slope+intercept
+    return array
+
+
+def _expandTensor(components, tensorKind):
+    """
+    Expand the tensor components at the last axis to a full 3x3 matrix.
+    """
+    if tensorKind == "3d-matrix":
+        return components.reshape(components.shape[:-1]+(3, 3))
+    if tensorKind == "3d-masked-symmetric-matrix":
+        components = components[..., 1:]
+    elif tensorKind == "nifti-symmetric-matrix":
+        # Lower triangular row order (xx, yx, yy, zx, zy, zz)
+        components = components[..., [0, 1, 3, 2, 4, 5]]
+    return expandSymmetricTensor(components)
+
+
+def _readData(header):
+    """
+    Read the whole voxel data, in storage order.
+    """
+    count = int(np.prod(header.diskShape))
+    if header.encoding in ("ascii", "text", "txt"):
+        with open(header.dataPath, "r") as f:
+            f.seek(header.fileOffset)
+            data = np.array(f.read().split()[:count], dtype=header.dtype)
+    else:
+        stream, position = _openStream(header)
+        with stream:
+            stream.seek(position)
+            data = np.frombuffer(stream.read(header.nbytes), dtype=header.dtype)
+
+    return data.reshape(header.diskShape)
+
+
+def readVolume(source):
+    """
+    Read a NRRD (.nrrd, .nhdr) or NIfTI (.nii, .nii.gz) volume, given its path or its VolumeHeader.
+    A tensor diagonal file (see writeTensorDiagonal) gives the (K, J, I, 3) tensor diagonal array.
+    """
+    header = _asHeader(source)
+    array = _applyScaling(_readData(header), header)
+    if header.isTensor and not header.isTensorDiagonal:
+        array = _expandTensor(np.moveaxis(array, header.componentAxis, -1), header.tensorKind)
+    elif header.componentAxis is not None:
+        array = np.moveaxis(array, header.componentAxis, -1)
+
+    return Volume(array, header.ijkToRAS, header.measurementFrame)
+
+
+def readNRRD(path):
+    return readVolume(readNRRDVolumeHeader(path))
+
+
+def readNIfTI(path):
+    return readVolume(readNIfTIVolumeHeader(path))
+
+
+def _streamComponents(header, bounds, channels):
+    """
+    Stream compressed multi-component data in slabs along K, keeping only the bounding box and the given channels.
+    """
+    (k0, k1), (j0, j1), (i0, i1) = bounds
+    K, J, I = header.shape
+    itemsize = header.dtype.itemsize
+    components = np.empty((k1-k0, j1-j0, i1-i0, len(channels)), dtype=header.dtype)
+
+    stream, position = _openStream(header)
+    with stream:
+        if header.componentAxis == 0:
+            # Components stored as separate volumes: read only the diagonal volumes, slice by slice
+            sliceBytes = J*I*itemsize
+            slabSlices = max(1, STREAM_SLAB_BYTES//sliceBytes)
+            for n, channel in enumerate(channels):
+                for k in range(k0, k1, slabSlices):
+                    slices = min(slabSlices, k1-k)
+                    stream.seek(position+(channel*K+k)*sliceBytes)
+                    slab = np.frombuffer(stream.read(slices*sliceBytes), dtype=header.dtype).reshape(slices, J, I)
+                    components[k-k0:k-k0+slices, ..., n] = slab[:, j0:j1, i0:i1]
+        else:
+            # Components stored per voxel: the data before k0 is skipped and the data after k1 is never decompressed
+            channelCount = header.diskShape[-1]
+            sliceBytes = J*I*channelCount*itemsize
+            slabSlices = max(1, STREAM_SLAB_BYTES//sliceBytes)
+            stream.seek(position+k0*sliceBytes)
+            for k in range(k0, k1, slabSlices):
+                slices = min(slabSlices, k1-k)
+                slab = np.frombuffer(stream.read(slices*sliceBytes), dtype=header.dtype).reshape(slices, J, I, channelCount)
+                components[k-k0:k-k0+slices] = slab[:, j0:j1, i0:i1, channels]
+
+    return components
+
+
+def readVolumeComponents(source, channels=None, bounds=None):
+    """
+    Read some stored channels of a multi-component volume (tensor or DWI), restricted to a bounding box.
+    Uncompressed data is memory-mapped, so that only the pages covering the bounding box are read, and compressed
+    data is streamed in slabs, so that the whole volume is never held in memory.
+    :param source: Path or VolumeHeader of a multi-component volume
+    :param channels: Stored channels to be read, all the channels if not given
+    :param bounds: ((k0, k1), (j0, j1), (i0, i1)) voxel ranges, the whole volume if not given
+    :return: Volume with a (K, J, I, channels) array, its geometry starting at the bounding box corner
+    """
+    header = _asHeader(source)
+    if header.componentAxis is None:
+        raise ValueError(f"Input image is not a multi-component volume: {header.dataPath}")
+
+    if bounds is None:
+        bounds = tuple((0, size) for size in header.shape)
+    if channels is None:
+        channels = list(range(header.diskShape[header.componentAxis]))
+    (k0, k1), (j0, j1), (i0, i1) = bounds
+    lastAxis = len(header.diskShape)-1
+
+    if header.encoding == "raw" and header.componentAxis in (0, lastAxis):
+        data = np.memmap(header.dataPath, dtype=header.dtype, mode="r", offset=header.fileOffset+header.streamOffset,
+                         shape=header.diskShape)
+        if header.componentAxis == 0:
+            components = np.stack([data[channel, k0:k1, j0:j1, i0:i1] for channel in channels], axis=-1)
+        else:
+            components = np.array(data[k0:k1, j0:j1, i0:i1, channels])
+        del data
+    elif header.encoding in ("gzip", "gz", "bzip2", "bz2") and header.componentAxis in (0, lastAxis):
+        components = _streamComponents(header, bounds, channels)
+    else:
+        # Uncommon layouts (ascii encoding, components axis in between the spatial axes)
+        allComponents = np.moveaxis(_readData(header), header.componentAxis, -1)
+        components = np.array(allComponents[k0:k1, j0:j1, i0:i1][..., channels])
+
+    ijkToRAS = header.ijkToRAS.copy()
+    ijkToRAS[:3, 3] = (header.ijkToRAS @ np.array([i0, j0, k0, 1.0]))[:3]
+
+    return Volume(_applyScaling(components, header), ijkToRAS, header.measurementFrame)
+
+
+def readTensorDiagonal(source, bounds=None):
+    """
+    Read only the tensor diagonal (Dxx, Dyy, Dzz) of a tensor volume, restricted to a bounding box
+    (see readVolumeComponents).
+    :param source: Path or VolumeHeader of a tensor volume
+    :param bounds: ((k0, k1), (j0, j1), (i0, i1)) voxel ranges, the whole volume if not given
+    :return: Volume with a (K, J, I, 3) diagonal array, its geometry starting at the bounding box corner
+    """
+    header = _asHeader(source)
+    if not header.isTensor:
+        raise ValueError(f"Input image is not a tensor volume: {header.dataPath}")
+
+    return readVolumeComponents(header, TENSOR_DIAGONAL_CHANNELS[header.tensorKind], bounds)
+
+
+def readTensors(source, bounds=None):
+    """
+    Read the full tensors of a tensor volume, restricted to a bounding box (see readVolumeComponents).
+    :param source: Path or VolumeHeader of a tensor volume
+    :param bounds: ((k0, k1), (j0, j1), (i0, i1)) voxel ranges, the whole volume if not given
+    :return: Volume with a (K, J, I, 3, 3) tensor array, its geometry starting at the bounding box corner
+    """
+    header = _asHeader(source)
+    if not header.isTensor:
+        raise ValueError(f"Input image is not a tensor volume: {header.dataPath}")
+    if header.isTensorDiagonal:
+        raise ValueError(f"Input image holds only the tensor diagonal, the full tensors are required: {header.dataPath}")
+
+    components = readVolumeComponents(header, None, bounds)
+    return Volume(_expandTensor(components.array, header.tensorKind), components.ijkToRAS, components.measurementFrame)
+
+
+def iterVolumeComponentSlabs(source, channels=None, slabSlices=None):
+    """
+    Iterate over some stored channels of a multi-component volume in slabs along K, so that the whole volume is never
+    held in memory. Uncompressed data is memory-mapped and compressed data with the components stored per voxel is
+    decompressed once, sequentially. Other layouts (e.g. compressed NIfTI, components stored as separate volumes) read
+    the requested channels at once.
+    :param source: Path or VolumeHeader of a multi-component volume
+    :param channels: Stored channels to be read, all the channels if not given
+    :param slabSlices: Number of K slices of each slab, bounded by STREAM_SLAB_BYTES if not given
+    :return: Iterator of (k0, (k, J, I, channels) array)
+    """
+    header = _asHeader(source)
+    if header.componentAxis is None:
+        raise ValueError(f"Input image is not a multi-component volume: {header.dataPath}")
+
+    K, J, I = header.shape
+    if channels is None:
+        channels = list(range(header.diskShape[header.componentAxis]))
+    lastAxis = len(header.diskShape)-1
+    channelCount = header.diskShape[header.componentAxis]
+    sliceBytes = J*I*channelCount*header.dtype.itemsize
+    slabSlices = slabSlices or max(1, STREAM_SLAB_BYTES//sliceBytes)
+
+    if header.encoding in ("gzip", "gz", "bzip2", "bz2") and header.componentAxis == lastAxis:
+        stream, position = _openStream(header)
+        with stream:
+            stream.seek(position)
+            for k in range(0, K, slabSlices):
+                slices = min(slabSlices, K-k)
+                slab = np.frombuffer(stream.read(slices*sliceBytes), dtype=header.dtype).reshape(slices, J, I, channelCount)
+                yield k, _applyScaling(slab[..., channels], header)
+    elif header.encoding == "raw" and header.componentAxis in (0, lastAxis):
+        for k in range(0, K, slabSlices):
+            yield k, readVolumeComponents(header, channels, ((k, min(k+slabSlices, K)), (0, J), (0, I))).array
+    else:
+        components = readVolumeComponents(header, channels).array
+        for k in range(0, K, slabSlices):
+            yield k, components[k:k+slabSlices]
+
+
+def iterTensorDiagonalSlabs(source, slabSlices=None):
+    """
+    Iterate over the tensor diagonal (Dxx, Dyy, Dzz) of a tensor volume in slabs along K (see iterVolumeComponentSlabs).
+    :return: Iterator of (k0, (k, J, I, 3) diagonal array)
+    """
+    header = _asHeader(source)
+    if not header.isTensor:
+        raise ValueError(f"Input image is not a tensor volume: {header.dataPath}")
+
+    return iterVolumeComponentSlabs(header, TENSOR_DIAGONAL_CHANNELS[header.tensorKind], slabSlices)
+
+
+def _formatVector(vector):
+    return "("+",".join(repr(float(value)) for value in vector)+")"
+
+
+def _nrrdHeader(shape, dtype, ijkToRAS=None, encoding="gzip", measurementFrame=None, keyValues=None, componentKind="list"):
+    """
+    NRRD header of a scalar (K, J, I), multi-component (K, J, I, N) or tensor (K, J, I, 3, 3) array, in LPS space.
+    """
+    ijkToRAS = np.eye(4) if ijkToRAS is None else np.asarray(ijkToRAS, dtype=float)
+    dtype = np.dtype(dtype)
+    isTensor = len(shape) == 5
+    isVector = len(shape) == 4
+
+    directions = LPS_TO_RAS @ ijkToRAS[:3, :3]
+    origin = LPS_TO_RAS @ ijkToRAS[:3, 3]
+    sizes = list(shape[:3][::-1])
+    kinds = ["domain"]*3
+    spaceDirections = [_formatVector(directions[:, axis]) for axis in range(3)]
+    if isTensor:
+        sizes = [9]+sizes
+        kinds = ["3D-matrix"]+kinds
+        spaceDirections = ["none"]+spaceDirections
+    elif isVector:
+        sizes = [shape[3]]+sizes
+        kinds = [componentKind]+kinds
+        spaceDirections = ["none"]+spaceDirections
+
+    lines = [
+        "NRRD0004",
+        f"type: {NRRD_WRITE_TYPES[dtype.str[1:]]}",
+        f"dimension: {len(sizes)}",
+        "space: left-posterior-superior",
+        "sizes: "+" ".join(str(size) for size in sizes),
+        "space directions: "+" ".join(spaceDirections),
+        "kinds: "+" ".join(kinds),
+        f"endian: {'big' if dtype.byteorder == '>' else 'little'}",
+        f"encoding: {encoding}",
+        "space origin: "+_formatVector(origin),
+    ]
+    if isTensor or isVector:
+        frame = LPS_TO_RAS @ (np.eye(3) if measurementFrame is None else np.asarray(measurementFrame))
+        lines.append("measurement frame: "+" ".join(_formatVector(frame[:, axis]) for axis in range(3)))
+    lines += [f"{key}:={value}" for key, value in (keyValues or {}).items()]
+
+    return ("\n".join(lines)+"\n\n").encode("ascii")
+
+
+def writeNRRD(path, array, ijkToRAS=None, encoding="gzip", measurementFrame=None, keyValues=None, componentKind="list"):
+    """
+    Write a scalar (K, J, I), multi-component (K, J, I, N) or tensor (K, J, I, 3, 3) array as a NRRD file
+    in LPS space, as Slicer does.
+    :param ijkToRAS: 4x4 IJK to RAS matrix (identity if not given)
+    :param encoding: raw or gzip
+    :param measurementFrame: 3x3 tensor (or DWI gradients) measurement frame in RAS (identity if not given)
+    :param keyValues: dict of key/value pairs to be written in the header (e.g. DWMRI_b-value)
+    :param componentKind: NRRD kind of the components of a multi-component array (e.g. 3D-diagonal-matrix)
+    """
+    array = np.ascontiguousarray(array)
+    payload = array.tobytes()
+    with open(path, "wb") as f:
+        f.write(_nrrdHeader(array.shape, array.dtype, ijkToRAS, encoding, measurementFrame, keyValues, componentKind))
+        f.write(gzip.compress(payload, compresslevel=1) if encoding == "gzip" else payload)
+
+
+class NRRDSlabWriter:
+    """
+    Write a scalar or multi-component volume as a NRRD file slab by slab along K (see writeNRRD), so that the whole array
+    is never held in memory. Use it as a context manager, the slabs must be written in K order.
+    """
+
+    def __init__(self, path, shape, dtype, ijkToRAS=None, encoding="gzip", measurementFrame=None, componentKind="list"):
+        self.path = path
+        self.shape = tuple(int(size) for size in shape)
+        self.dtype = np.dtype(dtype)
+        self.slices = 0
+        self._file = open(path, "wb")
+        self._file.write(_nrrdHeader(self.shape, self.dtype, ijkToRAS, encoding, measurementFrame, componentKind=componentKind))
+        self._stream = gzip.GzipFile(fileobj=self._file, mode="wb", compresslevel=1) if encoding == "gzip" else self._file
+
+    def write(self, slab):
+        slab = np.ascontiguousarray(slab, dtype=self.dtype)
+        if slab.shape[1:] != self.shape[1:] or self.slices+slab.shape[0] > self.shape[0]:
+            raise ValueError(f"Slab shape {slab.shape} does not fit the volume shape {self.shape} after {self.slices} slices")
+        self._stream.write(slab.tobytes())
+        self.slices += slab.shape[0]
+
+    def close(self):
+        if self._stream is not self._file:
+            self._stream.close()
+        self._file.close()
+        if self.slices != self.shape[0]:
+            raise ValueError(f"Only {self.slices} of {self.shape[0]} slices were written to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self._stream.close()
+            self._file.close()
+
+
+def writeTensorDiagonal(path, source, encoding="raw", dtype=np.float32, slabSlices=None):
+    """
+    Write the tensor diagonal (Dxx, Dyy, Dzz) of a tensor volume as a compact NRRD file (3D-diagonal-matrix kind, float32 by
+    default) with the same geometry and measurement frame, a third of the full tensors. The DTI-ALPS calculation reads
+    it in place of the tensor volume, except for the tensor axes projection and the FA exclusion, which need the full
+    tensors. The tensor volume is read slab by slab (see iterTensorDiagonalSlabs).
+    :param source: Path or VolumeHeader of a tensor volume
+    :param encoding: raw, memory-mapped when read so that only the ROIs bounding box is read, or gzip (lossless, smaller)
+    :param dtype: Stored type of the diagonal
+    :return: VolumeHeader of the written file
+    """
+    header = _asHeader(source)
+    if not header.isTensor:
+        raise ValueError(f"Input image is not a tensor volume: {header.dataPath}")
+
+    with NRRDSlabWriter(path, header.shape+(3,), dtype, header.ijkToRAS, encoding, header.measurementFrame,
+                        "3D-diagonal-matrix") as writer:
+        for k, slab in iterTensorDiagonalSlabs(header, slabSlices):
+            writer.write(slab)
+    return readNRRDVolumeHeader(path)
@@ -0,0 +1,198 @@
+"""
+Standard MNI labels warped to the native space of a subject, so that the DTI-ALPS index is calculated without
+resampling the tensor volume to MNI.
+
+Only the two ROI label maps are warped, with nearest neighbour interpolation, and only the native voxels inside the
+bounding box of the MNI ROIs (mapped to the native space) are visited. The tensors are used as they are stored.
+"""
+
+import itertools
+
+import numpy as np
+
+from .mni import loadMNIROIIndex, mniHemisphereLabels
+from .volumeio import LPS_TO_RAS, isNIfTI, isNRRD, readVolume
+
+
+# Fixed-point inversion of displacement fields: maximum iterations and tolerance (mm)
+INVERSE_ITERATIONS = 50
+INVERSE_TOLERANCE = 1e-3
+
+ITK_AFFINE_TRANSFORMS = ("AffineTransform", "MatrixOffsetTransformBase")
+
+_LPS_TO_RAS_4x4 = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+
+def _applyAffine(matrix, points):
+    return points @ matrix[:3, :3].T+matrix[:3, 3]
+
+
+class MNITransform:
+    """
+    Point mapping between the subject (native) RAS space and the MNI RAS space.
+
+    toMNI - Function mapping subject RAS points (N, 3) to MNI RAS points
+    fromMNI - Function mapping MNI RAS points (N, 3) to subject RAS points
+    """
+
+    def __init__(self, toMNI, fromMNI):
+        self.toMNI = toMNI
+        self.fromMNI = fromMNI
+
+
+def affineMNITransform(subjectToMNI):
+    """
+    MNITransform of a 4x4 affine matrix mapping subject RAS points to MNI RAS points.
+    """
+    subjectToMNI = np.asarray(subjectToMNI, dtype=np.float64)
+    mniToSubject = np.linalg.inv(subjectToMNI)
+    return MNITransform(lambda points: _applyAffine(subjectToMNI, points), lambda points: _applyAffine(mniToSubject, points))
+
+
+def _interpolateTrilinear(field, ijk):
+    """
+    Trilinear interpolation of a (K, J, I, 3) vector field at continuous IJK points (N, 3), clamped at the field borders.
+    """
+    sizes = np.array(field.shape[:3][::-1])
+    ijk = np.clip(ijk, 0, sizes-1)
+    lower = np.floor(ijk).astype(np.int64)
+    upper = np.minimum(lower+1, sizes-1)
+    fraction = ijk-lower
+
+    values = np.zeros((ijk.shape[0], field.shape[-1]))
+    for corner in itertools.product((False, True), repeat=3):
+        index = np.where(corner, upper, lower)
+        weight = np.prod(np.where(corner, fraction, 1-fraction), axis=1)
+        values += weight[:, None]*field[index[:, 2], index[:, 1], index[:, 0]]
+    return values
+
+
+def displacementFieldMNITransform(field, ijkToRAS):
+    """
+    MNITransform of a displacement field defined on the MNI grid, in the ITK convention of a registration of the subject
+    (moving) to the MNI template (fixed): the MNI point p maps to the subject point p+field(p).
+    The subject to MNI mapping is found by fixed-point inversion of the field.
+    :param field: RAS displacements (mm) with shape (K, J, I, 3)
+    :param ijkToRAS: 4x4 IJK to RAS matrix of the field grid
+    """
+    field = np.asarray(field, dtype=np.float64)
+    rasToIJK = np.linalg.inv(ijkToRAS)
+
+    def fromMNI(points):
+        return points+_interpolateTrilinear(field, _applyAffine(rasToIJK, points))
+
+    def toMNI(points):
+        mniPoints = points-_interpolateTrilinear(field, _applyAffine(rasToIJK, points))
+        for _ in range(INVERSE_ITERATIONS):
+            residual = points-fromMNI(mniPoints)
+            mniPoints += residual
+            if np.abs(residual).max(initial=0.0) < INVERSE_TOLERANCE:
+                break
+        return mniPoints
+
+    return MNITransform(toMNI, fromMNI)
+
+
+def readITKAffineTransform(path):
+    """
+    Read an ITK text transform file (.tfm, .txt) holding a single affine transform, as written by ITK based
+    registration tools (e.g. BRAINSFit, ANTs with ConvertTransformFile, Slicer).
+    :return: 4x4 matrix mapping fixed RAS points to moving RAS points (the ITK transform direction)
+    """
+    transforms = []
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            key = key.strip()
+            if key == "Transform":
+                transforms.append({"name": value.strip()})
+            elif key in ("Parameters", "FixedParameters") and transforms:
+                transforms[-1][key] = np.array(value.split(), dtype=np.float64)
+
+    transforms = [transform for transform in transforms if not transform["name"].startswith("CompositeTransform")]
+    if len(transforms) != 1:
+        raise ValueError(f"{path} must hold a single affine transform, {len(transforms)} transforms found")
+    transform = transforms[0]
+    if not transform["name"].startswith(ITK_AFFINE_TRANSFORMS) or not transform["name"].endswith("_3_3"):
+        raise ValueError(f"Unsupported ITK transform {transform['name']} in {path}, only 3D affine transforms are supported")
+
+    parameters = transform.get("Parameters", np.zeros(0))
+    center = transform.get("FixedParameters", np.zeros(3))
+    if parameters.size != 12 or center.size != 3:
+        raise ValueError(f"Invalid affine transform parameters in {path}")
+
+    # ITK maps x to A (x - c) + c + t, in the LPS space
+    matrix, translation = parameters[:9].reshape(3, 3), parameters[9:]
+    fixedToMovingLPS = np.eye(4)
+    fixedToMovingLPS[:3, :3] = matrix
+    fixedToMovingLPS[:3, 3] = translation+center-matrix @ center
+    return _LPS_TO_RAS_4x4 @ fixedToMovingLPS @ _LPS_TO_RAS_4x4
+
+
+def readMNITransform(path):
+    """
+    Read the transform of a subject to the MNI space:
+    - ITK affine transform file (.tfm, .txt) of the registration of the subject (moving) to the MNI template (fixed)
+    - Displacement field image (NRRD or NIfTI, 3 components in LPS as written by ITK) of the same registration,
+      defined on the MNI grid (e.g. ANTs 1Warp.nii.gz combined with the affine into a single field)
+    - Plain text 4x4 matrix mapping subject RAS points to MNI RAS points (e.g. a Slicer linear transform to parent)
+    """
+    if isNRRD(path) or isNIfTI(path):
+        volume = readVolume(path)
+        if volume.array.ndim != 4 or volume.array.shape[-1] != 3:
+            raise ValueError(f"{path} is not a displacement field, 3 components are expected")
+        return displacementFieldMNITransform(volume.array @ LPS_TO_RAS, volume.ijkToRAS)
+
+    with open(path) as f:
+        isITK = f.readline().startswith("#Insight Transform File")
+    if isITK:
+        return affineMNITransform(np.linalg.inv(readITKAffineTransform(path)))
+
+    matrix = np.loadtxt(path, dtype=np.float64)
+    if matrix.shape != (4, 4):
+        raise ValueError(f"{path} is not a 4x4 matrix, an ITK transform file or a displacement field")
+    return affineMNITransform(matrix)
+
+
+def warpMNILabels(shape, ijkToRAS, transform, mniIndex=None):
+    """
+    Standard MNI Projection and Association labels (split in left and right hemispheres, see MNI_HEMISPHERE_PAIRS)
+    warped to the native image grid with nearest neighbour interpolation. Only the native voxels inside the bounding
+    box of the MNI ROIs mapped to the native space are visited.
+    :param shape: Native image shape (K, J, I)
+    :param ijkToRAS: 4x4 IJK to RAS matrix of the native image
+    :param transform: MNITransform of the subject
+    :return: (projArray, assocArray) label arrays with the native image shape
+    """
+    mniIndex = mniIndex or loadMNIROIIndex()
+    shape = tuple(int(size) for size in shape)
+    ijkToRAS = np.asarray(ijkToRAS, dtype=np.float64)
+
+    # Native bounding box of the MNI ROI voxel corners
+    roi = np.concatenate([mniIndex.projection, mniIndex.association])
+    k, j, i = np.unravel_index(roi, mniIndex.shape)
+    corners = np.array(list(itertools.product((-0.5, 0.5), repeat=3)))
+    mniIJK = (np.stack([i, j, k], axis=1)[:, None, :]+corners).reshape(-1, 3)
+    nativeIJK = _applyAffine(np.linalg.inv(ijkToRAS), transform.fromMNI(_applyAffine(mniIndex.ijkToRAS, mniIJK)))
+    lower = np.clip(np.floor(nativeIJK.min(axis=0)).astype(np.int64), 0, shape[::-1])
+    upper = np.clip(np.ceil(nativeIJK.max(axis=0)).astype(np.int64)+1, 0, shape[::-1])
+    if np.any(upper <= lower):
+        raise ValueError("The MNI labels fall outside the image once transformed, check the subject to MNI transform")
+    (i0, j0, k0), (i1, j1, k1) = lower, upper
+
+    # MNI voxel nearest to each native voxel of the bounding box
+    kk, jj, ii = np.meshgrid(np.arange(k0, k1), np.arange(j0, j1), np.arange(i0, i1), indexing="ij")
+    points = _applyAffine(ijkToRAS, np.stack([ii.ravel(), jj.ravel(), kk.ravel()], axis=1).astype(np.float64))
+    nearest = np.rint(_applyAffine(np.linalg.inv(mniIndex.ijkToRAS), transform.toMNI(points))).astype(np.int64)
+    inside = np.all((nearest >= 0) & (nearest < mniIndex.shape[::-1]), axis=1)
+    mniVoxels = np.ravel_multi_index((nearest[inside, 2], nearest[inside, 1], nearest[inside, 0]), mniIndex.shape)
+
+    labelArrays = []
+    for mniLabelArray in mniHemisphereLabels(mniIndex):
+        boxLabels = np.zeros(kk.size, dtype=np.uint8)
+        boxLabels[inside] = mniLabelArray.flat[mniVoxels]
+        labelArray = np.zeros(shape, dtype=np.uint8)
+        labelArray[k0:k1, j0:j1, i0:i1] = boxLabels.reshape(kk.shape)
+        labelArrays.append(labelArray)
+
+    return tuple(labelArrays)
@@ -6,17 +6,90 @@ import numpy as np
 
 # Instantiate the parser
 parser = argparse.ArgumentParser(description="Python script to facilitate calling DTI-ALPS module from command line. \n"+ 
-                                 "This script calls the Slicer module Python code and all the funcionalities are described in the wiki page: "+
+                                 "This script calls the Slicer module Python code, or the DTI_ALPSLib core package when it is executed by a plain Python interpreter "+
+                                 "(NRRD and NIfTI inputs only), and all the funcionalities are described in the wiki page: "+
                                  "https://slicer-dti-alps.readthedocs.io/en/latest/")
 
 parser.add_argument("inputDTI", type=str,
-                    help="Input DTI image file path")
+                    help="Input DTI image file path. A raw DWI image (NRRD with DWMRI gradients, or NIfTI with --bvals/--bvecs) is also accepted, "+
+                    "its diffusion tensors are then fitted only inside the Proj/Assoc ROIs.")
 parser.add_argument("inputProjLabel", type=str, nargs='?',
                     help="Input image label that defines de Projection ROI in the DTI image space")
 parser.add_argument("inputAssocLabel", type=str, nargs='?',
                     help="Input image label that defines de Association ROI in the DTI image space")
 parser.add_argument("--MNISpace", action='store_true',
                     help="Informs whether the input DTI image is already in the MNI space (2 mm resolution). If yes, the input Proj/Assoc paths are changed for the standard MNI labels instead.")
+parser.add_argument("--MNITransform", type=str, default=None,
+                    help="Subject to MNI transform (ITK affine transform file, displacement field image or 4x4 RAS matrix text file). "+
+                    "The standard MNI labels are warped to the native DTI space, so that neither the Proj/Assoc labels nor an input resampled to MNI are needed.")
+parser.add_argument("--lazyLoading", action='store_true',
+                    help="Read only the tensor diagonal (Dxx, Dyy, Dzz) inside the ROIs bounding box from the input DTI file, instead of the whole tensor volume. "+
+                    "Uncompressed files are memory-mapped and compressed files are streamed in slabs. Only NRRD and NIfTI files are supported and the Slicer scene is not used.")
+parser.add_argument("--multiLabel", action='store_true',
+                    help="Calculate one DTI-ALPS index for each label value present in both Proj/Assoc labels (plus all the labels together). "+
+                    "With --MNISpace, the standard MNI labels are split in left, right and bilateral ROIs.")
+parser.add_argument("--roiPairs", type=str, nargs='+', default=None,
+                    help="ROI pairs of multi-valued Proj/Assoc labels given as NAME=PROJ:ASSOC, where several label values are joined by + "+
+                    "(e.g. left=1:1 right=2:2 bilateral=1+2:1+2). All the indices are calculated in a single pass.")
+parser.add_argument("--bvals", type=str, default=None,
+                    help="FSL b-values file of a raw DWI input (not needed for NRRD DWI files with DWMRI gradients).")
+parser.add_argument("--bvecs", type=str, default=None,
+                    help="FSL gradient directions file of a raw DWI input (not needed for NRRD DWI files with DWMRI gradients).")
+parser.add_argument("--fitRegion", type=str, default="roi", choices=["roi", "bounds"],
+                    help="Raw DWI input only: fit the tensors only at the ROI voxels (roi, default) or at every voxel of the ROIs bounding box (bounds).")
+parser.add_argument("--fitMethod", type=str, default="wls", choices=["ols", "wls"],
+                    help="Raw DWI input only: ordinary (ols) or weighted (wls, default) least squares tensor fitting.")
+parser.add_argument("--tensorAxes", type=str, default="tensor", choices=["tensor", "ras", "image"],
+                    help="Axes of Dxx, Dyy and Dzz: the stored tensor axes (tensor, default), the scanner RAS axes (ras) or the image axes nearest to them (image). "+
+                    "With ras or image, the ROI tensors are projected using the measurement frame and the image directions, so that tilted or oblique "+
+                    "acquisitions do not need to be reoriented first.")
+parser.add_argument("--estimator", type=str, default="mean", choices=["mean", "trimmed", "median"],
+                    help="ROI statistic of each diffusivity: mean (default), trimmed mean (see --trimFraction) or median.")
+parser.add_argument("--trimFraction", type=float, default=0.1,
+                    help="Fraction of the sorted ROI values cut at each end for --estimator trimmed (default: 0.1).")
+parser.add_argument("--madThreshold", type=float, default=None,
+                    help="Exclude the ROI voxels farther than the given number of scaled MADs from the ROI median in any diffusivity (e.g. 3).")
+parser.add_argument("--maxMD", type=float, default=None,
+                    help="Exclude the ROI voxels with a mean diffusivity above the given value, in the tensor units (e.g. 0.002 mm2/s for partial volume CSF).")
+parser.add_argument("--minFA", type=float, default=None,
+                    help="Exclude the ROI voxels with a fractional anisotropy below the given value (e.g. 0.2). Requires the full tensors, "+
+                    "not available with --lazyLoading or DWI inputs.")
+parser.add_argument("--bootstrap", type=int, default=None, metavar="REPLICATES",
+                    help="Bootstrap confidence interval of the DTI-ALPS index, resampling the ROI voxels with the given number of replicates (e.g. 2000). "+
+                    "Single ROI pair only.")
+parser.add_argument("--confidence", type=float, default=0.95,
+                    help="Confidence level of the --bootstrap interval (default: 0.95).")
+parser.add_argument("--seed", type=int, default=0,
+                    help="Seed of the --bootstrap replicates, the same seed always gives the same interval (default: 0).")
+parser.add_argument("--bootstrapProcesses", type=int, default=1,
+                    help="Number of processes sharing the --bootstrap replicates (default: 1). The interval does not depend on it.")
+parser.add_argument("--no-cache", action='store_true',
+                    help="Do not use the DTI-ALPS result cache. By default, results are cached on disk keyed on the input files content and the options, "+
+                    "so that unchanged subjects are not recalculated.")
+parser.add_argument("--refresh", action='store_true',
+                    help="Recalculate the DTI-ALPS index even if it is cached, and update the cache.")
+parser.add_argument("--cacheDir", type=str, default=None,
+                    help="DTI-ALPS result cache folder (default: DTI_ALPS_CACHE_DIR environment variable or ~/.cache/dti-alps).")
+parser.add_argument("--profile", action='store_true',
+                    help="Show the duration, bytes loaded and peak memory of each processing stage, and the ROI voxel counts.")
+parser.add_argument("--profileOutput", type=str, default=None,
+                    help="Append the processing profile as one JSON line to the given file (e.g. to aggregate the profiles of a whole cohort).")
+parser.add_argument("--maps", type=str, default=None,
+                    help="Write the voxelwise ratio maps as NRRD files named MAPS-projectionRatio.nrrd (Dxx/Dyy in the Projection ROI), "+
+                    "MAPS-associationRatio.nrrd (Dxx/Dzz in the Association ROI) and MAPS-alpsRatio.nrrd (Dxx/mean(Dyy, Dzz) in the whole volume). "+
+                    "The maps are computed slab by slab, DTI inputs only.")
+parser.add_argument("--writeDiagonal", type=str, default=None, metavar="PATH",
+                    help="Write the tensor diagonal (Dxx, Dyy, Dzz) of the input DTI as a compact float32 NRRD file, a third of the full tensors, "+
+                    "which later runs read in place of the DTI file (except with --tensorAxes ras/image or --minFA). Without labels, only the file is written.")
+parser.add_argument("--diagonalEncoding", type=str, default="raw", choices=["raw", "gzip"],
+                    help="Encoding of the --writeDiagonal file: raw (default, memory-mapped so that only the ROIs bounding box is read) or gzip (lossless, smaller).")
+parser.add_argument("--output", type=str, default=None,
+                    help="Append one record (subject, DTI-ALPS index, ROI means, ROI voxel counts and processing time) to the given result table: "+
+                    "CSV (.csv), JSON-lines (.jsonl) or Parquet (.parquet, requires pyarrow).")
+parser.add_argument("--subject", type=str, default=None,
+                    help="Subject name of the --output record (default: the input DTI file name).")
+parser.add_argument("--resume", action='store_true',
+                    help="With --output, skip the calculation if the subject was already written with status ok in the result table.")
 parser.add_argument("--verbose", action='store_true',
                     help="Show more details thoughout the processing.")
 
@@ -28,55 +101,296 @@ if args.verbose:
     print("-- DTI-ALPS Initiation:")
     print("Input parameters:")
     print(f"  1. Input DTI: {args.inputDTI}")
-    if not args.MNISpace:
+    if args.MNITransform:
+        print(f"  2. Input Projection label: Used MNI standard warped to native space (--MNITransform {args.MNITransform})")
+        print(f"  3. Input Association label: Used MNI standard warped to native space (--MNITransform {args.MNITransform})")
+    elif not args.MNISpace:
         print(f"  2. Input Projection label: {args.inputProjLabel}")
         print(f"  3. Input Association label: {args.inputAssocLabel}")
     else:
         print("  2. Input Projection label: Used MNI standard (--MNISpace is True)")
         print("  3. Input Association label: Used MNI standard (--MNISpace is True)")
     print(f"  4. MNISpace: {args.MNISpace}")
+    print(f"  5. Lazy loading: {args.lazyLoading}")
+    print(f"  6. Multi-label: {args.multiLabel or bool(args.roiPairs)}")
+    if args.bvals or args.bvecs:
+        print(f"  7. Gradient table: {args.bvals} {args.bvecs}")
+    if args.estimator != "mean" or args.madThreshold or args.maxMD or args.minFA:
+        print(f"  8. ROI estimator: {args.estimator}, MAD threshold {args.madThreshold}, max MD {args.maxMD}, min FA {args.minFA}")
+    if args.tensorAxes != "tensor":
+        print(f"  9. Tensor axes: {args.tensorAxes}")
+
+
+# Without the Slicer application (or for lazy loading), the core package placed next to the Resources folder is used directly
+try:
+    import slicer
+    inSlicer = hasattr(slicer, "app")
+except ImportError:
+    inSlicer = False
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DTI_ALPSLib import (ALPSBootstrap, ProcessingProfile, ROIEstimator, ResultCache, ResultSink,
+                         calculateDTIALPSFromDWI, calculateDTIALPSFromFiles, calculateDTIALPSMultiROIFromFiles, mniSpaceMismatches,
+                         parseROIPairs, readVolumeHeader, resultRecord, writeALPSMapsFromFiles, writeTensorDiagonal)
+
+if args.MNISpace and args.MNITransform:
+    print("ERROR: --MNISpace and --MNITransform cannot be used together")
+    sys.exit(1)
+labelsGiven = args.MNISpace or bool(args.MNITransform) or bool(args.inputProjLabel and args.inputAssocLabel)
+if not labelsGiven and not args.writeDiagonal:
+    print("ERROR: Input Projection and Association labels are required without --MNISpace or --MNITransform")
+    sys.exit(1)
+
+# Structured result table, the subject is skipped when resuming if it is already finished
+resultSink = None
+subject = args.subject or os.path.basename(args.inputDTI)
+if args.output:
+    try:
+        resultSink = ResultSink(args.output, resume=True)
+    except ValueError as error:
+        print(f"ERROR: {error}")
+        sys.exit(1)
+    if args.resume and subject in resultSink.finishedSubjects:
+        print(f"-- Subject {subject} already finished in {args.output}")
+        sys.exit(0)
+
+multiROI = args.multiLabel or bool(args.roiPairs)
+roiPairs = None
+if args.roiPairs:
+    try:
+        roiPairs = parseROIPairs(args.roiPairs)
+    except ValueError as error:
+        print(f"ERROR: {error}")
+        sys.exit(1)
+
+# Robust ROI statistics, the plain ROI means are used by default
+estimator = None
+if args.estimator != "mean" or args.madThreshold is not None or args.maxMD is not None or args.minFA is not None:
+    try:
+        estimator = ROIEstimator(args.estimator, args.trimFraction, args.madThreshold, args.maxMD, args.minFA)
+    except ValueError as error:
+        print(f"ERROR: {error}")
+        sys.exit(1)
+
+# Bootstrap confidence interval of the index
+bootstrap = None
+if args.bootstrap:
+    try:
+        if multiROI:
+            raise ValueError("--bootstrap is calculated for a single ROI pair, not with --multiLabel or --roiPairs")
+        bootstrap = ALPSBootstrap(args.bootstrap, args.confidence, args.seed, args.bootstrapProcesses)
+    except ValueError as error:
+        print(f"ERROR: {error}")
+        sys.exit(1)
+
+
+# Raw DWI inputs are fitted by the core package, reading only the ROIs bounding box
+isDWI, isTensorDiagonal = bool(args.bvals or args.bvecs), False
+if not isDWI:
+    try:
+        inputHeader = readVolumeHeader(args.inputDTI)
+        isDWI = inputHeader.componentAxis is not None and not inputHeader.isTensor
+        isTensorDiagonal = inputHeader.isTensorDiagonal
+    except (ValueError, OSError):
+        pass
+
+# Compact tensor diagonal file for the later runs
+if args.writeDiagonal:
+    if args.verbose:
+        print("-- DTI-ALPS tensor diagonal file...", end="", flush=True)
+    try:
+        writeTensorDiagonal(args.writeDiagonal, args.inputDTI, args.diagonalEncoding)
+    except (ValueError, OSError) as error:
+        print(f"ERROR: {error}")
+        sys.exit(1)
+    if args.verbose:
+        print(f"done ({args.writeDiagonal})")
+    if not labelsGiven:
+        sys.exit(0)
+
+# The MNI labels are warped to the native space by the core package as well. Slicer does not load the tensor diagonal files
+useCorePackage = not inSlicer or args.lazyLoading or isDWI or isTensorDiagonal or bool(args.MNITransform)
+
+profile = ProcessingProfile(dti=args.inputDTI, proj_label=args.inputProjLabel, assoc_label=args.inputAssocLabel, MNISpace=args.MNISpace,
+                            MNITransform=args.MNITransform, lazyLoading=args.lazyLoading, multiROI=multiROI, DWI=isDWI,
+                            slicer=not useCorePackage, tensorAxes=args.tensorAxes, cached=False)
+
+
+def reportProfile(dti_alps_idx):
+    profile.metadata["dti_alps"] = dti_alps_idx
+    if args.profile:
+        print("-- DTI-ALPS processing profile")
+        print(profile.summary())
+    if args.profileOutput:
+        profile.writeJSONLine(args.profileOutput)
+
+
+def exitIfNotMNI(mismatches):
+    if mismatches:
+        print("ERROR: Input DTI is not in MNI space 2mm:")
+        for mismatch in mismatches:
+            print(f"  - {mismatch}")
+        writeRecord(status="failed", error=f"Input DTI image is not in MNI space: {'; '.join(mismatches)}")
+        sys.exit(1)
+    if args.verbose:
+        print("done")
+
+
+def writeRecord(dti_alps_idx=None, status="ok", error="", cached=False):
+    if resultSink:
+        resultSink.write(resultRecord(subject, dti_alps_idx, profile, status, error, cached, dti=args.inputDTI,
+                                      proj_label=args.inputProjLabel or "", assoc_label=args.inputAssocLabel or ""))
+        resultSink.close()
+
+
+def printResult(dti_alps_idx):
+    if multiROI:
+        for name, index in dti_alps_idx.items():
+            print(f"DTI-ALPS index ({name}) = {index}")
+    else:
+        print(f"DTI-ALPS index = {dti_alps_idx}")
+    if bootstrap is not None:
+        print(f"DTI-ALPS index {bootstrap.confidence:.0%} CI = [{profile.measures['dtiAlpsLower']}, {profile.measures['dtiAlpsUpper']}] "
+              f"(SE {profile.measures['dtiAlpsSE']}, {bootstrap.replicates} bootstrap replicates)")
+
+
+def outputResult(dti_alps_idx):
+    if cacheKey:
+        with profile.stage("cacheStore"):
+            # The confidence interval is cached along with the index, in the profile measures
+            resultCache.putResult(cacheKey, dti_alps_idx, profile)
+    printResult(dti_alps_idx)
+    reportProfile(dti_alps_idx)
+    writeRecord(dti_alps_idx)
+
+
+# Voxelwise ratio maps are written from the files, slab by slab, whether the index is cached or not
+if args.maps:
+    if args.verbose:
+        print("-- DTI-ALPS voxelwise ratio maps...", end="", flush=True)
+    try:
+        if isDWI:
+            raise ValueError("The voxelwise ratio maps require a DTI input, not a raw DWI")
+        mapPaths = writeALPSMapsFromFiles(args.inputDTI, args.maps, args.inputProjLabel, args.inputAssocLabel, args.MNISpace,
+                                          args.MNITransform, profile=profile)
+    except (ValueError, OSError) as error:
+        print(f"ERROR: {error}")
+        writeRecord(status="failed", error=error)
+        sys.exit(1)
+    if args.verbose:
+        print("done")
+        for path in mapPaths.values():
+            print(f"  {path}")
+
+
+# Reuse the result cached for the same input files and options
+resultCache, cacheKey = None, None
+if not args.no_cache:
+    resultCache = ResultCache(args.cacheDir)
+    with profile.stage("cacheLookup"):
+        try:
+            cacheKey = resultCache.calculationKey(args.inputDTI, args.inputProjLabel, args.inputAssocLabel, args.MNISpace, isDWI,
+                                                  args.fitRegion, args.fitMethod, [args.bvals, args.bvecs], args.MNITransform, estimator,
+                                                  bootstrap, args.tensorAxes, multiROI, args.roiPairs)
+        except OSError as error:
+            print(f"ERROR: Could not read the input files: {error}")
+            sys.exit(1)
+        cached = None if args.refresh else resultCache.getResult(cacheKey, profile)
+    if cached is not None:
+        if args.verbose:
+            print("-- DTI-ALPS index found in the result cache")
+        profile.metadata["cached"] = True
+        printResult(cached)
+        reportProfile(cached)
+        writeRecord(cached, cached=True)
+        sys.exit(0)
+
+
+if useCorePackage:
+    if args.verbose:
+        print("-- DTI-ALPS index calculation")
+        print("  1. Calling DTI_ALPSLib core package...", end="", flush=True)
+    try:
+        if isDWI:
+            dti_alps_idx = calculateDTIALPSFromDWI(args.inputDTI, args.inputProjLabel, args.inputAssocLabel, args.MNISpace,
+                                                   args.bvals, args.bvecs, multiROI, roiPairs, args.fitRegion, args.fitMethod, profile,
+                                                   args.MNITransform, estimator, bootstrap, args.tensorAxes)
+        elif multiROI:
+            dti_alps_idx = calculateDTIALPSMultiROIFromFiles(args.inputDTI, args.inputProjLabel, args.inputAssocLabel, args.MNISpace,
+                                                             roiPairs, lazyLoading=args.lazyLoading, profile=profile,
+                                                             mniTransformPath=args.MNITransform, estimator=estimator, tensorAxes=args.tensorAxes)
+        else:
+            dti_alps_idx = calculateDTIALPSFromFiles(args.inputDTI, args.inputProjLabel, args.inputAssocLabel, args.MNISpace,
+                                                     lazyLoading=args.lazyLoading, profile=profile, mniTransformPath=args.MNITransform,
+                                                     estimator=estimator, bootstrap=bootstrap, tensorAxes=args.tensorAxes)
+    except ValueError as error:
+        print(f"ERROR: {error}")
+        writeRecord(status="failed", error=error)
+        sys.exit(1)
+    if args.verbose:
+        print("done")
+
+    outputResult(dti_alps_idx)
+    sys.exit(0)
 
 
 # General variables
-module_path = os.path.dirname(slicer.modules.dti_alps.path)
 inputDTI = ""
 inputProjLabel = ""
 inputAssocLabel = ""
-dti_alps_obj = slicer.modules.dti_alps.widgetRepresentation().self()
+
+# Use the module logic directly, there is no need to build the module widget in batch mode
+import DTI_ALPS
+dti_alps_logic = DTI_ALPS.DTI_ALPSLogic()
 
 dti_alps_idx = 0
 
 
+# Check if input data is in MNI space 2mm from the file header, so that a rejected image is never loaded
+mniChecked = False
+if args.MNISpace:
+    try:
+        dtiHeader = readVolumeHeader(args.inputDTI)
+    except (ValueError, OSError):
+        # Formats not supported by DTI_ALPSLib are checked once loaded by Slicer
+        dtiHeader = None
+    if dtiHeader is not None:
+        if args.verbose:
+            print("-- Check input and MNI spacing...", end="", flush=True)
+        with profile.stage("checkMNISpace"):
+            mismatches = mniSpaceMismatches(dtiHeader.shape, dtiHeader.ijkToRAS)
+        exitIfNotMNI(mismatches)
+        mniChecked = True
+
 # Load the input data
 if args.verbose:
     print("-- DTI-ALPS: Load data")
     print("  1. Load DTI volume...", end="", flush=True)
-inputDTI = slicer.util.loadVolume(args.inputDTI)
+with profile.stage("loadDTI") as stage:
+    inputDTI = slicer.util.loadVolume(args.inputDTI)
+    stage["bytes"] = slicer.util.arrayFromVolume(inputDTI).nbytes
 if args.verbose:
     print("done")
 
-if args.verbose:
-    print("-- DTI-ALPS: Load data")
-    print("  1. Load Projection and Association label volumes...", end="", flush=True)
+# The standard MNI labels are not loaded, their precomputed voxel index is used instead
 if not args.MNISpace:
-    inputProjLabel = slicer.util.loadLabelVolume(args.inputProjLabel)
-    inputAssocLabel = slicer.util.loadLabelVolume(args.inputAssocLabel)
-else:
-    inputProjLabel = slicer.util.loadLabelVolume(module_path+os.path.sep+"Resources"+os.path.sep+"MNI"+os.path.sep+"Projection-label-2mm-MNI.nii.gz")
-    inputAssocLabel = slicer.util.loadLabelVolume(module_path+os.path.sep+"Resources"+os.path.sep+"MNI"+os.path.sep+"Association-label-2mm-MNI.nii.gz")
-if args.verbose:
-    print("done")
+    if args.verbose:
+        print("-- DTI-ALPS: Load data")
+        print("  1. Load Projection and Association label volumes...", end="", flush=True)
+    with profile.stage("loadLabels") as stage:
+        inputProjLabel = slicer.util.loadLabelVolume(args.inputProjLabel)
+        inputAssocLabel = slicer.util.loadLabelVolume(args.inputAssocLabel)
+        stage["bytes"] = slicer.util.arrayFromVolume(inputProjLabel).nbytes+slicer.util.arrayFromVolume(inputAssocLabel).nbytes
+    if args.verbose:
+        print("done")
 
 # Check if input data is in MNI space 2mm
-if args.MNISpace:
+if args.MNISpace and not mniChecked:
     if args.verbose:
         print("-- Check input and MNI spacing...", end="", flush=True)
-    isMNI = dti_alps_obj.logic.checkMNISpaceInput(inputDTI,inputProjLabel)
-    if not isMNI:
-        print("ERROR: Input DTI is not in MNI space 2mm")
-        sys.exit(1)
-    if args.verbose:
-        print("done")
+    with profile.stage("checkMNISpace"):
+        mismatches = dti_alps_logic.mniSpaceInputMismatches(inputDTI)
+    exitIfNotMNI(mismatches)
 
 # Call Slicer DTI-ALPS module
 if args.verbose:
@@ -84,11 +398,27 @@ if args.verbose:
     print("  1. Calling Slicer DTI-ALPS module...", end="", flush=True)
 
 # Call the DTI-ALPS calculation method
-dti_alps_idx = dti_alps_obj.logic.calculateDTIALPS(inputDTI, inputProjLabel, inputAssocLabel)
+try:
+    if multiROI:
+        if args.MNISpace:
+            dti_alps_idx = dti_alps_logic.calculateDTIALPSMultiROI(inputDTI, roiPairs=roiPairs, profile=profile, estimator=estimator,
+                                                                   tensorAxes=args.tensorAxes)
+        else:
+            dti_alps_idx = dti_alps_logic.calculateDTIALPSMultiROI(inputDTI, inputProjLabel, inputAssocLabel, roiPairs, profile=profile,
+                                                                   estimator=estimator, tensorAxes=args.tensorAxes)
+    elif args.MNISpace:
+        dti_alps_idx = dti_alps_logic.calculateDTIALPSMNI(inputDTI, profile, estimator, bootstrap, args.tensorAxes)
+    else:
+        dti_alps_idx = dti_alps_logic.calculateDTIALPS(inputDTI, inputProjLabel, inputAssocLabel, profile, estimator, bootstrap,
+                                                       args.tensorAxes)
+except ValueError as error:
+    print(f"ERROR: {error}")
+    writeRecord(status="failed", error=error)
+    sys.exit(1)
 if args.verbose:
     print("done")
 
 # Output result
-print(f"DTI-ALPS index = {dti_alps_idx}")
+outputResult(dti_alps_idx)
 
 sys.exit(0)
\ No newline at end of file
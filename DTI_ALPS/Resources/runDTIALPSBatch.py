@@ -0,0 +1,530 @@
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+
+# Instantiate the parser
+parser = argparse.ArgumentParser(description="Python script to calculate the DTI-ALPS index for a whole cohort using a single Slicer session. \n"+
+                                 "The subjects are read from a manifest file (CSV or JSON) and the results are appended to a single table as they complete, "+
+                                 "so that an interrupted run can be resumed. "+
+                                 "All the funcionalities are described in the wiki page: "+
+                                 "https://slicer-dti-alps.readthedocs.io/en/latest/")
+
+parser.add_argument("manifest", type=str,
+                    help="Manifest file (.csv or .json) listing the subjects. Each entry has the fields: subject, dti, proj_label and assoc_label (labels are optional with --MNISpace), "+
+                    "and session and time with --longitudinal")
+parser.add_argument("output", type=str,
+                    help="Output table with one row per subject: CSV (.csv), JSON-lines (.jsonl) or Parquet (.parquet, requires pyarrow). "+
+                    "Each row holds the DTI-ALPS index, the ROI means, the ROI voxel counts and the processing time")
+parser.add_argument("--MNISpace", action='store_true',
+                    help="Informs whether the input DTI images are already in the MNI space (2 mm resolution). If yes, the standard MNI labels are used for all subjects.")
+parser.add_argument("--jobs", type=int, default=1,
+                    help="Number of long-lived Slicer worker processes. Each worker processes a shard of the manifest (default: 1, run in this process)")
+parser.add_argument("--prefetch", type=int, default=0, metavar="SUBJECTS",
+                    help="Read the DTI and label files of the given number of next subjects in background threads while the current one is calculated (e.g. 2). "+
+                    "The files are then read without Slicer, thus only NRRD and NIfTI files are supported (default: 0, loaded by Slicer in turn)")
+parser.add_argument("--prefetchMemory", type=float, default=4096, metavar="MB",
+                    help="Memory budget in MB of the subjects read ahead with --prefetch, estimated from their file headers (default: 4096)")
+parser.add_argument("--longitudinal", action='store_true',
+                    help="Longitudinal mode: the entries of the same subject are its sessions, sharing the labels. The sessions in the same space are checked once "+
+                    "and reduced together, each session gives a row named SUBJECT_SESSION and the change of the index along the sessions is written to --changeOutput. "+
+                    "The files are read without Slicer, thus only NRRD and NIfTI files are supported")
+parser.add_argument("--changeOutput", type=str, default=None,
+                    help="Output table of --longitudinal with one row per subject: number of sessions, baseline and last index, absolute and percent change, "+
+                    "slope per time unit (the manifest time field, otherwise the session order) and time span (default: OUTPUT-change with the output table extension)")
+parser.add_argument("--resume", action='store_true',
+                    help="Resume an interrupted run: the subjects already written with status ok in the output table are skipped, "+
+                    "failed subjects are processed again. Without this option, the output table is overwritten.")
+parser.add_argument("--tensorAxes", type=str, default="tensor", choices=["tensor", "ras", "image"],
+                    help="Axes of Dxx, Dyy and Dzz: the stored tensor axes (tensor, default), the scanner RAS axes (ras) or the image axes nearest to them (image).")
+parser.add_argument("--estimator", type=str, default="mean", choices=["mean", "trimmed", "median"],
+                    help="ROI statistic of each diffusivity: mean (default), trimmed mean (see --trimFraction) or median.")
+parser.add_argument("--trimFraction", type=float, default=0.1,
+                    help="Fraction of the sorted ROI values cut at each end for --estimator trimmed (default: 0.1).")
+parser.add_argument("--madThreshold", type=float, default=None,
+                    help="Exclude the ROI voxels farther than the given number of scaled MADs from the ROI median in any diffusivity (e.g. 3).")
+parser.add_argument("--maxMD", type=float, default=None,
+                    help="Exclude the ROI voxels with a mean diffusivity above the given value, in the tensor units (e.g. 0.002 mm2/s).")
+parser.add_argument("--minFA", type=float, default=None,
+                    help="Exclude the ROI voxels with a fractional anisotropy below the given value (e.g. 0.2).")
+parser.add_argument("--bootstrap", type=int, default=None, metavar="REPLICATES",
+                    help="Bootstrap confidence interval of the DTI-ALPS index of each subject, resampling the ROI voxels with the given number of replicates (e.g. 2000).")
+parser.add_argument("--confidence", type=float, default=0.95,
+                    help="Confidence level of the --bootstrap interval (default: 0.95).")
+parser.add_argument("--seed", type=int, default=0,
+                    help="Seed of the --bootstrap replicates, the same seed always gives the same intervals (default: 0).")
+parser.add_argument("--no-cache", action='store_true',
+                    help="Do not use the DTI-ALPS result cache, all the subjects are recalculated.")
+parser.add_argument("--refresh", action='store_true',
+                    help="Recalculate all the subjects even if they are cached, and update the cache.")
+parser.add_argument("--cacheDir", type=str, default=None,
+                    help="DTI-ALPS result cache folder (default: DTI_ALPS_CACHE_DIR environment variable or ~/.cache/dti-alps).")
+parser.add_argument("--shard", type=int, default=None,
+                    help=argparse.SUPPRESS)
+parser.add_argument("--verbose", action='store_true',
+                    help="Show more details thoughout the processing.")
+
+
+def readManifest(manifestPath):
+    """
+    Read the cohort manifest (CSV with header or JSON list of objects).
+    Relative paths are resolved from the manifest folder.
+    """
+    if manifestPath.lower().endswith(".json"):
+        with open(manifestPath) as f:
+            entries = json.load(f)
+    else:
+        with open(manifestPath, newline="") as f:
+            entries = list(csv.DictReader(f))
+
+    baseDir = os.path.dirname(os.path.abspath(manifestPath))
+    subjects = []
+    for number, entry in enumerate(entries):
+        subject = {field: (entry.get(field) or "") for field in ["subject", "dti", "proj_label", "assoc_label", "session", "time"]}
+        if not subject["subject"]:
+            subject["subject"] = f"subject-{number:05d}"
+        for field in ["dti", "proj_label", "assoc_label"]:
+            if subject[field] and not os.path.isabs(subject[field]):
+                subject[field] = os.path.join(baseDir, subject[field])
+        subjects.append(subject)
+
+    return subjects
+
+
+def longitudinalSessions(subjects):
+    """
+    Manifest entries grouped by subject for --longitudinal, in the manifest order. Each session is given a row named
+    SUBJECT_SESSION in the result table (the session number from 1 if the session field is empty).
+    :return: (sessions, sessionSubjects), sessions being the renamed entries and sessionSubjects the list of (subject, entries)
+    """
+    groups = {}
+    for subject in subjects:
+        groups.setdefault(subject["subject"], []).append(subject)
+
+    sessions, sessionSubjects = [], []
+    for name, entries in groups.items():
+        entries = [dict(entry, subject=f"{name}_{entry['session'] or f'ses-{number+1}'}") for number, entry in enumerate(entries)]
+        sessions += entries
+        sessionSubjects.append((name, entries))
+    return sessions, sessionSubjects
+
+
+def subjectCacheKey(resultCache, subject, MNISpace, estimator=None, bootstrap=None, tensorAxes="tensor"):
+    """
+    Result cache key of one manifest entry and of the calculation parameters, the same as runDTIALPS.py for the same
+    inputs and options (see DTI_ALPSLib.cache.ResultCache.calculationKey).
+    """
+    try:
+        dtiHeader = readVolumeHeader(subject["dti"])
+        isDWI = dtiHeader.componentAxis is not None and not dtiHeader.isTensor
+    except ValueError:
+        # Formats not supported by DTI_ALPSLib are loaded by Slicer
+        isDWI = False
+    return resultCache.calculationKey(subject["dti"], subject["proj_label"], subject["assoc_label"], MNISpace, isDWI,
+                                      estimator=estimator, bootstrap=bootstrap, tensorAxes=tensorAxes)
+
+
+def cachedSubjectRecord(subject, cached, profile):
+    """
+    Result table record of a subject found in the result cache.
+    :param profile: ProcessingProfile where the cached measures were restored (see DTI_ALPSLib.cache.ResultCache.getResult)
+    """
+    inputs = {field: subject[field] for field in ["dti", "proj_label", "assoc_label"]}
+    return resultRecord(subject["subject"], cached, profile, cached=True, **inputs)
+
+
+def processSubject(logic, subject, MNISpace, resultCache=None, refresh=False, estimator=None, bootstrap=None, tensorAxes="tensor"):
+    """
+    Calculate the DTI-ALPS index of one manifest entry. Loaded nodes are removed from the scene afterwards,
+    so that the memory usage stays bounded along the cohort. The MNI labels are kept loaded and reused.
+    Subjects found in the result cache are not loaded at all.
+    :param estimator: ROI statistic (see DTI_ALPSLib.robust.ROIEstimator), plain ROI means if not given
+    :param bootstrap: ALPSBootstrap of the index confidence interval (see DTI_ALPSLib.bootstrap), cached along with the index
+    :param tensorAxes: Axes of Dxx, Dyy and Dzz: tensor, ras or image (see DTI_ALPSLib.orientation)
+    :return: Result table record (see DTI_ALPSLib.results.resultRecord)
+    """
+    inputs = {field: subject[field] for field in ["dti", "proj_label", "assoc_label"]}
+    profile = ProcessingProfile()
+    loadedNodes = []
+    try:
+        cacheKey = None
+        if resultCache:
+            with profile.stage("cacheLookup"):
+                cacheKey = subjectCacheKey(resultCache, subject, MNISpace, estimator, bootstrap, tensorAxes)
+                cached = None if refresh else resultCache.getResult(cacheKey, profile)
+            if cached is not None:
+                return cachedSubjectRecord(subject, cached, profile)
+
+        if isTensorDiagonalFile(subject["dti"]):
+            # Slicer does not load the tensor diagonal files, they are read by the core package
+            arrays = readDTIALPSInputs(subject["dti"], subject["proj_label"], subject["assoc_label"], MNISpace, True, profile,
+                                       estimator=estimator, tensorAxes=tensorAxes)
+            return calculateSubject(subject, arrays, profile, resultCache, cacheKey, estimator, bootstrap)
+
+        if MNISpace:
+            # Reject images outside the MNI space from the file header, before loading the tensor volume
+            from DTI_ALPSLib import mniSpaceMismatches, readVolumeHeader
+            try:
+                dtiHeader = readVolumeHeader(subject["dti"])
+            except ValueError:
+                dtiHeader = None
+            mismatches = mniSpaceMismatches(dtiHeader.shape, dtiHeader.ijkToRAS) if dtiHeader else []
+            if mismatches:
+                raise ValueError(f"Input DTI image is not in MNI space: {'; '.join(mismatches)}")
+
+        with profile.stage("loadVolumes"):
+            inputDTI = slicer.util.loadVolume(subject["dti"])
+            loadedNodes.append(inputDTI)
+            inputProjLabel, inputAssocLabel = None, None
+            if not MNISpace:
+                inputProjLabel = slicer.util.loadLabelVolume(subject["proj_label"])
+                loadedNodes.append(inputProjLabel)
+                inputAssocLabel = slicer.util.loadLabelVolume(subject["assoc_label"])
+                loadedNodes.append(inputAssocLabel)
+
+        logic.process(inputDTI, inputProjLabel, inputAssocLabel, MNISpace, useCache=False, profile=profile, estimator=estimator,
+                      bootstrap=bootstrap, tensorAxes=tensorAxes)
+        if cacheKey:
+            with profile.stage("cacheStore"):
+                resultCache.putResult(cacheKey, logic.dti_alps, profile)
+        return resultRecord(subject["subject"], logic.dti_alps, profile, **inputs)
+    except Exception as error:
+        return resultRecord(subject["subject"], profile=profile, status="failed", error=error, **inputs)
+    finally:
+        for node in loadedNodes:
+            slicer.mrmlScene.RemoveNode(node)
+
+
+def isTensorDiagonalFile(path):
+    """
+    True for a tensor diagonal file written by runDTIALPS.py --writeDiagonal (see DTI_ALPSLib.volumeio.writeTensorDiagonal).
+    """
+    try:
+        return readVolumeHeader(path).isTensorDiagonal
+    except (ValueError, OSError):
+        # Formats not supported by DTI_ALPSLib are loaded by Slicer
+        return False
+
+
+def calculateSubject(subject, arrays, profile, resultCache=None, cacheKey=None, estimator=None, bootstrap=None):
+    """
+    Calculate the DTI-ALPS index of one manifest entry from its arrays read by the core package.
+    :param arrays: (dtiArray, projROI, assocROI), see DTI_ALPSLib.pipeline.readDTIALPSInputs
+    :return: Result table record (see DTI_ALPSLib.results.resultRecord)
+    """
+    inputs = {field: subject[field] for field in ["dti", "proj_label", "assoc_label"]}
+    try:
+        dtiArray, projROI, assocROI = arrays
+        index = calculateDTIALPSFromROIs(dtiArray, projROI, assocROI, profile, estimator)
+        if bootstrap is not None:
+            bootstrapDTIALPS(dtiArray, projROI, assocROI, bootstrap, estimator, profile)
+        if cacheKey:
+            with profile.stage("cacheStore"):
+                resultCache.putResult(cacheKey, index, profile)
+        return resultRecord(subject["subject"], index, profile, **inputs)
+    except Exception as error:
+        return resultRecord(subject["subject"], profile=profile, status="failed", error=error, **inputs)
+
+
+def subjectBytes(subject, MNISpace):
+    """
+    Memory of the DTI and label arrays of one manifest entry, from their file headers (see DTI_ALPSLib.prefetch.Prefetcher).
+    """
+    paths = [subject["dti"]] if MNISpace else [subject["dti"], subject["proj_label"], subject["assoc_label"]]
+    return sum(readVolumeHeader(path).nbytes for path in paths)
+
+
+def prefetchSubject(subject, MNISpace, resultCache=None, refresh=False, estimator=None, bootstrap=None, tensorAxes="tensor"):
+    """
+    Read one manifest entry in a prefetch thread, with the core package only (the Slicer scene must not be accessed).
+    The result cache is looked up first, and only the ROIs bounding box of the DTI file is read.
+    :return: (profile, cacheKey, cached, inputs), inputs being (dtiArray, projROI, assocROI) or None when the subject is cached,
+             or when the DTI file is not a tensor volume (e.g. DWI, loaded by Slicer in turn)
+    """
+    profile = ProcessingProfile()
+    cacheKey, cached = None, None
+    if resultCache:
+        with profile.stage("cacheLookup"):
+            cacheKey = subjectCacheKey(resultCache, subject, MNISpace, estimator, bootstrap, tensorAxes)
+            cached = None if refresh else resultCache.getResult(cacheKey, profile)
+        if cached is not None:
+            return profile, cacheKey, cached, None
+    if not readVolumeHeader(subject["dti"]).isTensor:
+        return profile, cacheKey, None, None
+
+    # The FA exclusion requires the full tensors, otherwise only the tensor diagonal is read
+    lazyLoading = estimator is None or estimator.minFA is None
+    inputs = readDTIALPSInputs(subject["dti"], subject["proj_label"], subject["assoc_label"], MNISpace, lazyLoading, profile,
+                               estimator=estimator, tensorAxes=tensorAxes)
+    return profile, cacheKey, None, inputs
+
+
+def processPrefetchedSubject(logic, subject, future, MNISpace, resultCache=None, refresh=False, estimator=None, bootstrap=None,
+                             tensorAxes="tensor"):
+    """
+    Calculate the DTI-ALPS index of one manifest entry read by prefetchSubject.
+    :param future: Future of the prefetchSubject result, see DTI_ALPSLib.prefetch.Prefetcher
+    :return: Result table record (see DTI_ALPSLib.results.resultRecord)
+    """
+    inputs = {field: subject[field] for field in ["dti", "proj_label", "assoc_label"]}
+    try:
+        profile, cacheKey, cached, arrays = future.result()
+    except Exception as error:
+        return resultRecord(subject["subject"], status="failed", error=error, **inputs)
+    if cached is not None:
+        return cachedSubjectRecord(subject, cached, profile)
+    if arrays is None:
+        return processSubject(logic, subject, MNISpace, resultCache, refresh, estimator, bootstrap, tensorAxes)
+    return calculateSubject(subject, arrays, profile, resultCache, cacheKey, estimator, bootstrap)
+
+
+def runSubjects(subjects, args, resultSink, estimator=None, bootstrap=None):
+    """
+    Process the subjects not finished yet in the result table, each record is appended as soon as it completes.
+    """
+    import DTI_ALPS
+    from DTI_ALPSLib import ResultCache
+    logic = DTI_ALPS.DTI_ALPSLogic()
+    resultCache = None if args.no_cache else ResultCache(args.cacheDir)
+
+    finishedSubjects = resultSink.finishedSubjects
+    numbers = [number for number, subject in enumerate(subjects) if subject["subject"] not in finishedSubjects]
+    if args.prefetch > 0:
+        # The next subjects are read in background threads while the current one is calculated
+        prefetcher = Prefetcher(numbers, lambda number: prefetchSubject(subjects[number], args.MNISpace, resultCache, args.refresh,
+                                                                        estimator, bootstrap, args.tensorAxes),
+                                args.prefetch, int(args.prefetchMemory*1024*1024), lambda number: subjectBytes(subjects[number], args.MNISpace))
+    else:
+        prefetcher = ((number, None) for number in numbers)
+
+    for number, future in prefetcher:
+        subject = subjects[number]
+        if args.verbose:
+            print(f"  {number+1}/{len(subjects)} {subject['subject']}...", end="", flush=True)
+        if future is None:
+            result = processSubject(logic, subject, args.MNISpace, resultCache, args.refresh, estimator, bootstrap, args.tensorAxes)
+        else:
+            result = processPrefetchedSubject(logic, subject, future, args.MNISpace, resultCache, args.refresh, estimator, bootstrap,
+                                              args.tensorAxes)
+        if args.verbose:
+            print("done" if result["status"] == "ok" else f"failed ({result['error']})")
+        resultSink.write(result)
+
+
+def processSessions(sessions, MNISpace, resultCache=None, refresh=False, estimator=None, tensorAxes="tensor"):
+    """
+    Calculate the DTI-ALPS index of the sessions of one subject with the core package (see
+    DTI_ALPSLib.pipeline.calculateDTIALPSSessionsFromFiles). The cached sessions are not read.
+    :param sessions: Manifest entries of the subject sessions, sharing their labels
+    :return: Result table records of the sessions
+    """
+    records = [None]*len(sessions)
+    profile = ProcessingProfile()
+    sessionProfiles = [ProcessingProfile() for _ in sessions]
+    try:
+        if len({(session["proj_label"], session["assoc_label"]) for session in sessions}) > 1:
+            raise ValueError("The sessions of a subject must share their Projection and Association labels")
+        cacheKeys, pending = [None]*len(sessions), []
+        for number, session in enumerate(sessions):
+            try:
+                readVolumeHeader(session["dti"])
+                if resultCache:
+                    # The cached ROI means and voxel counts are restored in the session profile, as for the calculated sessions
+                    with sessionProfiles[number].stage("cacheLookup"):
+                        cacheKeys[number] = subjectCacheKey(resultCache, session, MNISpace, estimator, None, tensorAxes)
+                        cached = None if refresh else resultCache.getResult(cacheKeys[number], sessionProfiles[number])
+                    if cached is not None:
+                        records[number] = cachedSubjectRecord(session, cached, sessionProfiles[number])
+                        continue
+            except Exception as error:
+                # A missing or unreadable session does not fail the other sessions of the subject
+                records[number] = resultRecord(session["subject"], profile=sessionProfiles[number], status="failed", error=error,
+                                               **{field: session[field] for field in ["dti", "proj_label", "assoc_label"]})
+                continue
+            pending.append(number)
+        if not pending:
+            return records
+
+        # The FA exclusion requires the full tensors, otherwise only the tensor diagonal is read
+        lazyLoading = estimator is None or estimator.minFA is None
+        indices = calculateDTIALPSSessionsFromFiles([sessions[number]["dti"] for number in pending], sessions[0]["proj_label"],
+                                                    sessions[0]["assoc_label"], MNISpace, lazyLoading, profile, estimator, tensorAxes,
+                                                    [sessionProfiles[number] for number in pending])
+        for number, index in zip(pending, indices):
+            if cacheKeys[number]:
+                with sessionProfiles[number].stage("cacheStore"):
+                    resultCache.putResult(cacheKeys[number], float(index), sessionProfiles[number])
+            records[number] = resultRecord(sessions[number]["subject"], float(index), sessionProfiles[number],
+                                           **{field: sessions[number][field] for field in ["dti", "proj_label", "assoc_label"]})
+            # The sessions are read and reduced together, each one is given an equal share of the subject time
+            records[number]["seconds"] = profile.totalSeconds/len(pending)+sessionProfiles[number].totalSeconds
+    except Exception as error:
+        records = [record or resultRecord(session["subject"], profile=sessionProfile, status="failed", error=error,
+                                          **{field: session[field] for field in ["dti", "proj_label", "assoc_label"]})
+                   for record, session, sessionProfile in zip(records, sessions, sessionProfiles)]
+    return records
+
+
+def changeRecord(subject, sessions, records):
+    """
+    Change table record of one subject (see DTI_ALPSLib.longitudinal.longitudinalChange), the failed sessions are ignored.
+    The session times are taken from the manifest time field, otherwise the session order is used.
+    """
+    try:
+        indices = [float(record["dti_alps"]) if record["status"] == "ok" else float("nan") for record in records]
+        times = None
+        if any(session["time"] != "" for session in sessions):
+            times = [float(session["time"]) if session["time"] != "" else float("nan") for session in sessions]
+        return dict(subject=subject, status="ok", error="", **longitudinalChange(indices, times))
+    except ValueError as error:
+        return dict(dict.fromkeys(CHANGE_FIELDS, ""), subject=subject, status="failed", error=str(error))
+
+
+def runLongitudinal(sessionSubjects, args, resultSink, changeSink, estimator=None):
+    """
+    Process the subjects of --longitudinal not finished yet, the session records and the change record of each subject
+    are appended as soon as it completes.
+    """
+    from DTI_ALPSLib import ResultCache
+    resultCache = None if args.no_cache else ResultCache(args.cacheDir)
+
+    finishedSessions, finishedSubjects = resultSink.finishedSubjects, changeSink.finishedSubjects
+    for number, (subject, sessions) in enumerate(sessionSubjects):
+        if subject in finishedSubjects and all(session["subject"] in finishedSessions for session in sessions):
+            continue
+        if args.verbose:
+            print(f"  {number+1}/{len(sessionSubjects)} {subject} ({len(sessions)} sessions)...", end="", flush=True)
+        records = processSessions(sessions, args.MNISpace, resultCache, args.refresh, estimator, args.tensorAxes)
+        for record in records:
+            if record["subject"] not in finishedSessions:
+                resultSink.write(record)
+        change = changeRecord(subject, sessions, records)
+        changeSink.write(change)
+        if args.verbose:
+            failed = sum(record["status"] != "ok" for record in records)
+            print(f"done, change {change['alps_change']:+.6f}" if change["status"] == "ok" else f"failed ({change['error']})",
+                  f"({failed} sessions failed)" if failed else "")
+
+
+def runWorkers(args, subjects, resultSink):
+    """
+    Fan the manifest out across args.jobs Slicer processes. Each worker processes every jobs-th subject
+    and appends its records to the same result table. Subjects left without a record by a crashed worker are reported as failed.
+    """
+    scriptPath = os.path.abspath(__file__)
+    workers = []
+    for shard in range(args.jobs):
+        command = [slicer.app.applicationFilePath(), "--no-main-window", "--no-splash", "--python-script", scriptPath,
+                   args.manifest, args.output, "--jobs", str(args.jobs), "--shard", str(shard), "--resume"]
+        for option in ["MNISpace", "no_cache", "refresh"]:
+            if getattr(args, option):
+                command.append("--"+option.replace("_", "-"))
+        if args.cacheDir:
+            command += ["--cacheDir", args.cacheDir]
+        command += ["--tensorAxes", args.tensorAxes, "--estimator", args.estimator, "--trimFraction", str(args.trimFraction)]
+        command += ["--confidence", str(args.confidence), "--seed", str(args.seed)]
+        command += ["--prefetch", str(args.prefetch), "--prefetchMemory", str(args.prefetchMemory)]
+        for option in ["madThreshold", "maxMD", "minFA", "bootstrap"]:
+            if getattr(args, option) is not None:
+                command += ["--"+option, str(getattr(args, option))]
+        workers.append((shard, subprocess.Popen(command, stdout=subprocess.DEVNULL)))
+    for shard, worker in workers:
+        worker.wait()
+
+    # Subjects with a record appended by the workers (or before resuming)
+    writtenSubjects = {record["subject"] for record in ResultSink(args.output, resume=True).records}
+    for shard, worker in workers:
+        for subject in subjects[shard::args.jobs]:
+            if subject["subject"] not in writtenSubjects:
+                resultSink.write(resultRecord(subject["subject"], status="failed", error=f"Worker {shard} exited with code {worker.returncode}",
+                                              **{field: subject[field] for field in ["dti", "proj_label", "assoc_label"]}))
+
+
+args = parser.parse_args()
+
+subjects = readManifest(args.manifest)
+sessionSubjects = None
+if args.longitudinal:
+    subjects, sessionSubjects = longitudinalSessions(subjects)
+    outputRoot, outputExtension = os.path.splitext(args.output)
+    args.changeOutput = args.changeOutput or f"{outputRoot}-change{outputExtension}"
+
+# Show input details
+if args.verbose:
+    print("-- DTI-ALPS Batch Initiation:")
+    print("Input parameters:")
+    print(f"  1. Manifest: {args.manifest} ({len(subjects)} subjects)")
+    print(f"  2. Output table: {args.output}")
+    print(f"  3. MNISpace: {args.MNISpace}")
+    print(f"  4. Jobs: {args.jobs}")
+    print(f"  5. Resume: {args.resume}")
+    if args.prefetch > 0:
+        print(f"  6. Prefetch: {args.prefetch} subjects, {args.prefetchMemory:g} MB")
+    if args.longitudinal:
+        print(f"  7. Longitudinal: {len(sessionSubjects)} subjects, change table {args.changeOutput}")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DTI_ALPSLib import (CHANGE_FIELDS, ALPSBootstrap, Prefetcher, ProcessingProfile, ROIEstimator, ResultSink,
+                         bootstrapDTIALPS, calculateDTIALPSFromROIs, calculateDTIALPSSessionsFromFiles, latestRecords, longitudinalChange,
+                         readDTIALPSInputs, readVolumeHeader, resultRecord)
+
+# Robust ROI statistics (the plain ROI means are used by default) and bootstrap confidence intervals
+estimator, bootstrap = None, None
+try:
+    if args.estimator != "mean" or args.madThreshold is not None or args.maxMD is not None or args.minFA is not None:
+        estimator = ROIEstimator(args.estimator, args.trimFraction, args.madThreshold, args.maxMD, args.minFA)
+    if args.bootstrap:
+        bootstrap = ALPSBootstrap(args.bootstrap, args.confidence, args.seed)
+except ValueError as error:
+    print(f"ERROR: {error}")
+    sys.exit(1)
+if args.prefetch < 0 or args.prefetchMemory <= 0:
+    print("ERROR: --prefetch must not be negative and --prefetchMemory must be positive")
+    sys.exit(1)
+if args.longitudinal and (args.jobs > 1 or args.prefetch > 0 or bootstrap is not None):
+    print("ERROR: --longitudinal processes the sessions of each subject together, it can not be used with --jobs, --prefetch or --bootstrap")
+    sys.exit(1)
+
+try:
+    resultSink = ResultSink(args.output, resume=args.resume)
+    changeSink = None
+    if args.longitudinal:
+        changeSink = ResultSink(args.changeOutput, CHANGE_FIELDS, resume=args.resume)
+except ValueError as error:
+    print(f"ERROR: {error}")
+    sys.exit(1)
+if args.resume and args.shard is None:
+    print(f"DTI-ALPS batch: resuming, {len(resultSink.finishedSubjects & {subject['subject'] for subject in subjects})} subjects already finished")
+
+if args.shard is not None:
+    # Worker mode: process only the given shard of the manifest, the main process finalizes the table
+    runSubjects(subjects[args.shard::args.jobs], args, resultSink, estimator, bootstrap)
+    sys.exit(0)
+elif args.longitudinal:
+    if args.verbose:
+        print("-- DTI-ALPS longitudinal index calculation")
+    runLongitudinal(sessionSubjects, args, resultSink, changeSink, estimator)
+elif args.jobs > 1:
+    runWorkers(args, subjects, resultSink)
+else:
+    if args.verbose:
+        print("-- DTI-ALPS index calculation")
+    runSubjects(subjects, args, resultSink, estimator, bootstrap)
+
+# Keep only the last record of the subjects retried when resuming
+for sink in [resultSink, changeSink]:
+    if sink is not None:
+        sink.compact()
+        sink.close()
+
+manifestSubjects = {subject["subject"] for subject in subjects}
+results = [record for record in latestRecords(resultSink.records) if record["subject"] in manifestSubjects]
+failed = [result for result in results if result["status"] != "ok"]
+print(f"DTI-ALPS batch: {len(results)-len(failed)} {'sessions' if args.longitudinal else 'subjects'} processed, {len(failed)} failed. "
+      f"Results saved at {args.output}")
+if changeSink is not None:
+    print(f"DTI-ALPS batch: index change of {len(sessionSubjects)} subjects saved at {args.changeOutput}")
+
+sys.exit(0)
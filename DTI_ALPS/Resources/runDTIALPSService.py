@@ -0,0 +1,46 @@
+import argparse
+import os
+import sys
+
+# Instantiate the parser
+parser = argparse.ArgumentParser(description="Python script to run a long-running DTI-ALPS service, calculating the DTI-ALPS index of the jobs "+
+                                 "posted as JSON to a local HTTP endpoint (POST /jobs, GET /status), so that a pipeline pays the startup only once. "+
+                                 "It runs the DTI_ALPSLib core package (NRRD and NIfTI inputs only), from a plain Python interpreter or from Slicer. "+
+                                 "All the funcionalities are described in the wiki page: "+
+                                 "https://slicer-dti-alps.readthedocs.io/en/latest/")
+
+parser.add_argument("--host", type=str, default="127.0.0.1",
+                    help="Address the service listens on (default: 127.0.0.1, only reachable from this computer)")
+parser.add_argument("--port", type=int, default=8765,
+                    help="TCP port the service listens on (default: 8765)")
+parser.add_argument("--jobs", type=int, default=1,
+                    help="Maximum number of jobs calculated at the same time, the other jobs wait for their turn (default: 1)")
+parser.add_argument("--no-cache", action='store_true',
+                    help="Do not use the DTI-ALPS result cache, all the jobs are calculated.")
+parser.add_argument("--cacheDir", type=str, default=None,
+                    help="DTI-ALPS result cache folder, shared with runDTIALPS.py (default: DTI_ALPS_CACHE_DIR environment variable or ~/.cache/dti-alps).")
+parser.add_argument("--verbose", action='store_true',
+                    help="Show each request received by the service.")
+
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DTI_ALPSLib import ALPSService, ResultCache
+
+service = ALPSService(None if args.no_cache else ResultCache(args.cacheDir), args.jobs)
+try:
+    server = service.createServer(args.host, args.port, args.verbose)
+except OSError as error:
+    print(f"ERROR: Could not listen on {args.host}:{args.port}: {error}")
+    sys.exit(1)
+
+host, port = server.server_address[:2]
+print(f"DTI-ALPS service listening on http://{host}:{port} (POST /jobs, GET /status), press Ctrl+C to stop", flush=True)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+
+sys.exit(0)
@@ -0,0 +1,206 @@
+"""
+DTI-ALPS benchmark and regression suite on synthetic tensor volumes.
+
+Runs offline with a plain Python interpreter (only numpy is required), or inside Slicer to also time the
+DTI_ALPSLogic.process path:
+
+  python DTI_ALPSBenchmark.py --sizes mni2mm mni1mm --output benchmark.jsonl
+  Slicer --no-main-window --no-splash --python-script DTI_ALPSBenchmark.py --output benchmark.jsonl
+
+Each stage records the best and median wall time, the throughput (voxels of the tensor volume per second) and the
+peak memory allocated by the stage. Records are appended to a JSON-lines file, so that versions can be compared
+with --compare. The calculated DTI-ALPS index is checked against the analytic value of the synthetic volume.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from DTI_ALPSLib import (
+    SYNTHETIC_SHAPES,
+    calculateDTIALPS,
+    calculateDTIALPSFromFiles,
+    calculateDTIALPSMultiROI,
+    readVolume,
+    syntheticDTI,
+    writeNRRD,
+)
+
+# Relative tolerance of the calculated index against the analytic value
+INDEX_TOLERANCE = 1e-6
+
+IN_MEMORY_STAGES = ("calculateDTIALPS", "calculateDTIALPSMultiROI")
+
+
+def gitVersion():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measure(function, repeat):
+    """
+    Best and median wall time of the function, and the peak memory allocated in its first call.
+    """
+    times = []
+    peakBytes = 0
+    result = None
+    for number in range(repeat):
+        if number == 0:
+            tracemalloc.start()
+        startTime = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter()-startTime)
+        if number == 0:
+            peakBytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return result, min(times), float(np.median(times)), peakBytes
+
+
+def benchmarkStages(synthetic, paths, encoding):
+    """
+    Stages to be timed: name and function returning the DTI-ALPS index (or None for loading stages).
+    """
+    stages = [
+        ("calculateDTIALPS", lambda: calculateDTIALPS(synthetic.array, synthetic.projArray, synthetic.assocArray)),
+        ("calculateDTIALPSMultiROI", lambda: calculateDTIALPSMultiROI(synthetic.array, synthetic.projArray, synthetic.assocArray)["all"]),
+        (f"readLabels-{encoding}", lambda: (readVolume(paths["proj"]), readVolume(paths["assoc"])) and None),
+        (f"fromFiles-{encoding}", lambda: calculateDTIALPSFromFiles(paths["dti"], paths["proj"], paths["assoc"])),
+        (f"fromFilesLazy-{encoding}", lambda: calculateDTIALPSFromFiles(paths["dti"], paths["proj"], paths["assoc"], lazyLoading=True)),
+    ]
+
+    try:
+        import slicer
+        inSlicer = hasattr(slicer, "app")
+    except ImportError:
+        inSlicer = False
+
+    if inSlicer:
+        import DTI_ALPS
+        logic = DTI_ALPS.DTI_ALPSLogic()
+
+        def process():
+            nodes = [slicer.util.loadVolume(paths["dti"]), slicer.util.loadLabelVolume(paths["proj"]),
+                     slicer.util.loadLabelVolume(paths["assoc"])]
+            try:
+                logic.process(*nodes, useCache=False)
+                return logic.dti_alps
+            finally:
+                for node in nodes:
+                    slicer.mrmlScene.RemoveNode(node)
+
+        stages.append((f"process-{encoding}", process))
+
+    return stages
+
+
+def runBenchmark(args):
+    records = []
+    version = gitVersion()
+    for size in args.sizes:
+        synthetic = syntheticDTI(size, seed=args.seed)
+        voxels = int(np.prod(synthetic.array.shape[:3]))
+
+        for encoding in args.encodings:
+            with tempfile.TemporaryDirectory() as tempDir:
+                paths = {name: os.path.join(tempDir, name+".nrrd") for name in ["dti", "proj", "assoc"]}
+                writeNRRD(paths["dti"], synthetic.array, synthetic.ijkToRAS, encoding)
+                writeNRRD(paths["proj"], synthetic.projArray, synthetic.ijkToRAS, encoding)
+                writeNRRD(paths["assoc"], synthetic.assocArray, synthetic.ijkToRAS, encoding)
+
+                for stage, function in benchmarkStages(synthetic, paths, encoding):
+                    # In-memory stages do not depend on the file encoding, they are timed once
+                    if encoding != args.encodings[0] and stage in IN_MEMORY_STAGES:
+                        continue
+                    error = ""
+                    try:
+                        index, best, median, peakBytes = measure(function, args.repeat)
+                    except Exception as stageError:
+                        # A failing stage is reported as a regression, the other stages are still run
+                        tracemalloc.stop()
+                        error, index, best, median, peakBytes = str(stageError), float("nan"), float("nan"), float("nan"), 0
+                    record = {
+                        "version": version,
+                        "label": args.label,
+                        "size": size,
+                        "shape": list(synthetic.array.shape[:3]),
+                        "encoding": encoding,
+                        "stage": stage,
+                        "best_s": best,
+                        "median_s": median,
+                        "voxels_per_s": voxels/best,
+                        "peak_bytes": peakBytes,
+                        "dti_alps": index,
+                        "expected": synthetic.expected if index is not None else None,
+                        "ok": not error and (index is None or abs(index-synthetic.expected) <= INDEX_TOLERANCE*abs(synthetic.expected)),
+                        "error": error,
+                    }
+                    records.append(record)
+                    print(f"{size:>15} {record['stage']:>28} {best*1000:10.2f} ms {voxels/best/1e6:10.1f} Mvox/s "
+                          f"{peakBytes/2**20:9.1f} MiB {'ok' if record['ok'] else error or 'INDEX MISMATCH'}", flush=True)
+
+    return records
+
+
+def compareRecords(records, previousPath):
+    """
+    Print the relative change of the best time against the last previous record of each size and stage.
+    """
+    previous = {}
+    with open(previousPath) as f:
+        for line in f:
+            record = json.loads(line)
+            previous[(record["size"], record["stage"])] = record
+
+    print("-- Comparison against", previousPath)
+    for record in records:
+        reference = previous.get((record["size"], record["stage"]))
+        if reference:
+            change = record["best_s"]/reference["best_s"]-1.0
+            print(f"{record['size']:>15} {record['stage']:>28} {change*100:+8.1f}% (previous version {reference['version']})")
+
+
+parser = argparse.ArgumentParser(description="DTI-ALPS benchmark and regression suite on synthetic tensor volumes")
+parser.add_argument("--sizes", nargs="+", default=["mni2mm", "mni1mm"], choices=list(SYNTHETIC_SHAPES),
+                    help="Synthetic volume sizes to be benchmarked (default: mni2mm mni1mm)")
+parser.add_argument("--encodings", nargs="+", default=["raw", "gzip"], choices=["raw", "gzip"],
+                    help="NRRD encodings of the synthetic files (default: raw gzip)")
+parser.add_argument("--repeat", type=int, default=3,
+                    help="Number of runs of each stage (default: 3)")
+parser.add_argument("--seed", type=int, default=0,
+                    help="Random seed of the synthetic volumes")
+parser.add_argument("--label", type=str, default="",
+                    help="Free text label stored with the records (e.g. machine name)")
+parser.add_argument("--output", type=str, default=None,
+                    help="JSON-lines file where the records are appended")
+parser.add_argument("--compare", type=str, default=None,
+                    help="JSON-lines file of previous records to compare against")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    records = runBenchmark(args)
+
+    if args.compare:
+        compareRecords(records, args.compare)
+    if args.output:
+        with open(args.output, "a") as f:
+            for record in records:
+                f.write(json.dumps(record)+"\n")
+
+    # Non-zero exit code for the regression test (see Testing/Python/CMakeLists.txt)
+    failed = [record for record in records if not record["ok"]]
+    if failed:
+        print(f"-- {len(failed)} stages failed (error, or index beyond the relative tolerance {INDEX_TOLERANCE:g}): "
+              f"{', '.join(record['size']+' '+record['stage'] for record in failed)}")
+    sys.exit(1 if failed else 0)